@@ -162,10 +162,13 @@ def get_liveblog_context():
     Get liveblog context
     for production we will reuse a fake g context
     in order not to perform the parsing twice
+    nor to reload the copy spreadsheet for every view
     """
     from flask import g
     context = flatten_app_config()
-    context['COPY'] = copytext.Copy(app_config.COPY_PATH)
+    context['COPY'] = getattr(g, 'copy', None)
+    if context['COPY'] is None:
+        context['COPY'] = copytext.Copy(app_config.COPY_PATH)
     parsed_liveblog_doc = getattr(g, 'parsed_liveblog', None)
     if parsed_liveblog_doc is None:
         logger.debug("did not find parsed_liveblog")
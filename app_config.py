@@ -155,12 +155,50 @@ AUTHORS DICTIONARY
 """
 AUTHORS_GOOGLE_DOC_KEY = '1wisK_wB7b9hyJ_hf5AqyacNVdO7lbhjEmOTC2n7j7IM'
 AUTHORS_PATH = 'data/authors.xlsx'
-# Number of cycles needed to refresh the author excel file
-REFRESH_AUTHOR_CYCLES = 6
 
 LIVEBLOG_HTML_PATH = 'data/liveblog.html'
 LIVEBLOG_BACKUP_PATH = 'data/liveblog_backup.pickle'
-LOAD_COPY_INTERVAL = 10
+# Rendered views are published straight from memory. Set to a folder
+# (e.g. '.liveblog') to also write them to disk for debugging
+LIVEBLOG_MIRROR_PATH = None
+# Set to a folder (e.g. 'data/captures') to archive every downloaded
+# version of the liveblog doc, to be replayed with `fab benchmarks.replay`
+LIVEBLOG_CAPTURE_PATH = None
+# Deploy daemon schedules, in seconds. The copy and authors
+# spreadsheets are only downloaded if they have changed
+LIVEBLOG_REFRESH_INTERVAL = 10
+COPY_REFRESH_INTERVAL = 60 * 5
+AUTHORS_REFRESH_INTERVAL = 60 * 5
+# The liveblog is polled every LIVEBLOG_MIN_REFRESH_INTERVAL seconds while
+# any of the last LIVEBLOG_ACTIVE_CYCLES cycles found changes, otherwise the
+# interval backs off by LIVEBLOG_REFRESH_BACKOFF up to the max
+LIVEBLOG_MIN_REFRESH_INTERVAL = 5
+LIVEBLOG_MAX_REFRESH_INTERVAL = 30
+LIVEBLOG_REFRESH_BACKOFF = 1.5
+LIVEBLOG_ACTIVE_CYCLES = 3
+# A failed upload is retried even if the doc does not change, after
+# LIVEBLOG_PUBLISH_RETRY_INTERVAL seconds, doubling up to the max
+LIVEBLOG_PUBLISH_RETRY_INTERVAL = 5
+LIVEBLOG_PUBLISH_MAX_RETRY_INTERVAL = 120
+# Minimum pause, in seconds, between the end of a job and its next run
+DAEMON_MIN_SLACK = 1
+# Per cycle metrics, written to SERVER_LOG_PATH
+DAEMON_METRICS_LOG = 'daemon_cycles.jsonl'
+DAEMON_METRICS_TEXTFILE = 'daemon_metrics.prom'
+# Create this file in SERVER_LOG_PATH to profile the next daemon cycle
+DAEMON_PROFILE_SENTINEL = 'profile_next_cycle'
+# The daemon restarts itself between cycles once its RSS goes over the
+# soft limit (in bytes, None disables), resuming from DAEMON_STATE_PATH
+DAEMON_RSS_SOFT_LIMIT = 1024 * 1024 * 1024
+DAEMON_STATE_PATH = 'data/daemon_state.pickle'
+# ...but not again within this many seconds of its last restart, which
+# would loop if it is over the limit as soon as it resumes
+DAEMON_MIN_UPTIME = 60 * 10
+# Count the live BeautifulSoup nodes every this many cycles (0 disables)
+DAEMON_SOUP_COUNT_CYCLES = 30
+# `fab benchmarks.micro` fails when a helper gets slower than its
+# baseline by more than this fraction
+BENCHMARK_REGRESSION_THRESHOLD = 0.5
 SPONSORSHIP_POSITION = -1  # -1 disables
 NUM_HEADLINE_POSTS = 3
 
@@ -194,12 +232,66 @@ VIZ_GOOGLE_ANALYTICS = {
     'ACCOUNT_ID': 'UA-5828686-75'
 }
 
+"""
+HTTP CLIENT
+"""
+# Seconds to wait for a connection and then for each read of a response
+HTTP_CONNECT_TIMEOUT = 3.05
+HTTP_READ_TIMEOUT = 10
+# GET requests failing to connect or with a 429/5xx status are retried
+# up to HTTP_RETRIES times, after a random delay of up to
+# HTTP_BACKOFF * 2 ** retry seconds
+HTTP_RETRIES = 2
+HTTP_BACKOFF = 0.5
+# Connections kept alive per host
+HTTP_POOL_SIZE = 10
+# Seconds to wait for a connection and then for each read of the Google
+# API requests made through authomatic, which has its own transport
+DRIVE_TIMEOUT = 30
+
 """
 MONGODB
 """
 MONGODB_URL = 'mongodb://localhost:27017/'
-DB_IMAGE_TTL = 60 * 5
-DB_TWEET_TTL = 60 * 2
+# Image metadata never expires, it is checked again in the background
+# with a conditional request once older than IMAGE_REVALIDATE_AFTER
+IMAGE_REVALIDATE_AFTER = 60 * 5
+IMAGE_REFRESH_WORKERS = 2
+# Tweet layouts are evicted after DB_TWEET_TTL but fetched again in the
+# background once older than TWEET_REVALIDATE_AFTER, serving the stale
+# layout meanwhile
+DB_TWEET_TTL = 60 * 60 * 24
+TWEET_REVALIDATE_AFTER = 60 * 2
+TWEET_REFRESH_WORKERS = 2
+# Render the images and tweets seen for the first time as placeholders
+# and look them up in the background, instead of during the cycle
+SHORTCODE_RESOLVE_ASYNC = True
+# Concurrent lookups of the shortcodes missing from the cache, when they
+# are not resolved in the background
+SHORTCODE_FETCH_WORKERS = 8
+# Rendered shortcodes kept in memory
+SHORTCODE_RENDER_CACHE_SIZE = 2000
+# Failed image and tweet lookups are not tried again for
+# FETCH_NEGATIVE_TTL seconds, and a host failing FETCH_BREAKER_THRESHOLD
+# times in a row is left alone for FETCH_BREAKER_RESET seconds.
+# Meanwhile the shortcodes render as placeholders.
+FETCH_NEGATIVE_TTL = 60
+FETCH_BREAKER_THRESHOLD = 5
+FETCH_BREAKER_RESET = 60
+# Padding (height as a % of the width) of unavailable images
+IMAGE_PLACEHOLDER_RATIO = 66.67
+# Where the timestamps, pinned, images and tweets caches live: 'mongo' or
+# 'sqlite' (an embedded database at CACHE_SQLITE_PATH, no server needed)
+CACHE_BACKEND = 'mongo'
+CACHE_SQLITE_PATH = 'data/cache.sqlite'
+# Seconds after which the entries of each cache expire
+CACHE_TTLS = {
+    'tweets': DB_TWEET_TTL,
+}
+# Tables also kept in an in-process LRU of CACHE_FRONT_SIZE entries
+# (0 disables it)
+CACHE_FRONT_TABLES = ['images', 'tweets']
+CACHE_FRONT_SIZE = 5000
 
 """
 OAUTH
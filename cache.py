@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+"""
+Key value caches used while parsing the liveblog: post timestamps, the
+pinned post contents, image ratios and tweet layouts.
+
+Each cache table maps a key (a post slug, an image or tweet id) to a
+dictionary. Tables listed in CACHE_TTLS expire their entries that many
+seconds after they were written, the others keep them forever.
+
+CACHE_BACKEND selects where the tables live:
+
+* `mongo`: one collection per table in the liveblog MongoDB database.
+* `sqlite`: an embedded SQLite database in WAL mode at CACHE_SQLITE_PATH,
+  which needs no running server.
+
+The tables in CACHE_FRONT_TABLES are also kept in a bounded in-process
+LRU in front of the backend, so that the values looked up by every
+shortcode on every cycle are read from memory in the steady state.
+"""
+
+from collections import Counter, OrderedDict
+from datetime import datetime
+import cPickle as pickle
+import logging
+import sqlite3
+import threading
+
+import app_config
+import db
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+TABLES = ['timestamps', 'pinned', 'images', 'tweets']
+
+_cache = None
+
+
+class Cache(object):
+    """
+    Interface of the cache backends.
+    """
+    def __init__(self, ttls=None):
+        self.ttls = app_config.CACHE_TTLS if ttls is None else ttls
+
+    def is_fresh(self, table, date, now=None):
+        """
+        Whether an entry of `table` written at `date` has not expired.
+        """
+        ttl = self.ttls.get(table)
+        if not ttl:
+            return True
+        now = now or datetime.utcnow()
+        return (now - date).total_seconds() < ttl
+
+    def get(self, table, key):
+        """
+        Returns the value stored under `key`, None if missing or expired.
+        """
+        raise NotImplementedError
+
+    def get_many(self, table, keys):
+        """
+        Returns the values stored under `keys` by key, leaving out the
+        missing or expired ones.
+        """
+        values = {}
+        for key in keys:
+            value = self.get(table, key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def set(self, table, key, value):
+        """
+        Store a dictionary under `key`, replacing any previous value.
+        """
+        raise NotImplementedError
+
+    def values(self, table):
+        """
+        Returns every unexpired value of `table`.
+        """
+        raise NotImplementedError
+
+    def bootstrap(self):
+        """
+        Empty every table, for a new event.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Close the connections of the cache, it can not be used afterwards.
+        """
+        pass
+
+    def get_stats(self):
+        """
+        Returns the usage counts of each table, by table name.
+        """
+        return {}
+
+
+class MongoCache(Cache):
+    """
+    Tables are collections of the liveblog database. Mongo TTL indexes
+    purge expired entries, but they only run once a minute so expiry is
+    also checked on read.
+    """
+    def __init__(self, database=None, ttls=None):
+        super(MongoCache, self).__init__(ttls)
+        self.database = database or db.get_database()
+
+    def is_fresh(self, table, date, now=None):
+        # Entries written before the cache layer had no date
+        return date is None or super(MongoCache, self).is_fresh(table, date,
+                                                                now)
+
+    def _value(self, table, doc):
+        if doc is None or not self.is_fresh(table, doc.get('date')):
+            return None
+        value = dict(doc)
+        del value['_id']
+        value.pop('date', None)
+        return value
+
+    def get(self, table, key):
+        return self._value(table, self.database[table].find_one({'_id': key}))
+
+    def get_many(self, table, keys):
+        values = {}
+        for doc in self.database[table].find({'_id': {'$in': list(keys)}}):
+            value = self._value(table, doc)
+            if value is not None:
+                values[doc['_id']] = value
+        return values
+
+    def set(self, table, key, value):
+        doc = dict(value)
+        doc['_id'] = key
+        doc['date'] = datetime.utcnow()
+        self.database[table].replace_one({'_id': key}, doc, upsert=True)
+
+    def values(self, table):
+        values = []
+        for doc in self.database[table].find():
+            value = self._value(table, doc)
+            if value is not None:
+                values.append(value)
+        return values
+
+    def bootstrap(self):
+        for table in TABLES:
+            self.database[table].drop()
+            ttl = self.ttls.get(table)
+            if ttl:
+                self.database[table].create_index('date',
+                                                  expireAfterSeconds=ttl)
+
+
+class SqliteCache(Cache):
+    """
+    All the tables share one SQLite table, values are pickled. The
+    connection is shared by the daemon threads behind a lock.
+    """
+    def __init__(self, path=None, ttls=None):
+        super(SqliteCache, self).__init__(ttls)
+        self.path = path or app_config.CACHE_SQLITE_PATH
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False,
+                                          detect_types=sqlite3.PARSE_DECLTYPES)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'tbl TEXT NOT NULL, key TEXT NOT NULL, date TIMESTAMP NOT NULL, '
+            'value BLOB NOT NULL, PRIMARY KEY (tbl, key))')
+        self.connection.commit()
+        self.purge()
+
+    def get(self, table, key):
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT date, value FROM cache WHERE tbl = ? AND key = ?',
+                (table, key)).fetchone()
+        if row is None or not self.is_fresh(table, row[0]):
+            return None
+        return pickle.loads(str(row[1]))
+
+    def get_many(self, table, keys):
+        keys = list(keys)
+        rows = []
+        with self._lock:
+            # Stay under SQLite's limit of 999 query parameters
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows.extend(self.connection.execute(
+                    'SELECT key, date, value FROM cache WHERE tbl = ? AND '
+                    'key IN (%s)' % ', '.join('?' * len(chunk)),
+                    [table] + chunk).fetchall())
+        now = datetime.utcnow()
+        return dict((key, pickle.loads(str(value)))
+                    for key, date, value in rows
+                    if self.is_fresh(table, date, now))
+
+    def set(self, table, key, value):
+        blob = sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO cache (tbl, key, date, value) '
+                'VALUES (?, ?, ?, ?)', (table, key, datetime.utcnow(), blob))
+            self.connection.commit()
+
+    def values(self, table):
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT date, value FROM cache WHERE tbl = ?',
+                (table,)).fetchall()
+        now = datetime.utcnow()
+        return [pickle.loads(str(value)) for date, value in rows
+                if self.is_fresh(table, date, now)]
+
+    def purge(self):
+        """
+        Delete the expired entries.
+        """
+        now = datetime.utcnow()
+        with self._lock:
+            for table, ttl in self.ttls.iteritems():
+                if ttl:
+                    self.connection.execute(
+                        "DELETE FROM cache WHERE tbl = ? AND "
+                        "date <= datetime(?, '-%d seconds')" % ttl,
+                        (table, now))
+            self.connection.commit()
+
+    def bootstrap(self):
+        with self._lock:
+            self.connection.execute('DELETE FROM cache')
+            self.connection.commit()
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+class FrontCache(Cache):
+    """
+    Bounded LRU of recently used entries in front of another cache, for
+    the tables in `tables`. Entries expire after the table's TTL counted
+    from when they entered the LRU, so they can outlive the backend copy
+    by at most one TTL. Other tables go straight to the backend.
+    """
+    def __init__(self, backend, tables=None, size=None, ttls=None):
+        super(FrontCache, self).__init__(backend.ttls if ttls is None
+                                         else ttls)
+        self.backend = backend
+        self.tables = (app_config.CACHE_FRONT_TABLES if tables is None
+                       else tables)
+        self.size = size or app_config.CACHE_FRONT_SIZE
+        self.stats = dict((table, Counter()) for table in self.tables)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, table, key):
+        with self._lock:
+            entry = self._entries.pop((table, key), None)
+            if entry is None:
+                self.stats[table]['misses'] += 1
+                return None
+            date, value = entry
+            if not self.is_fresh(table, date):
+                self.stats[table]['expired'] += 1
+                self.stats[table]['misses'] += 1
+                return None
+            # Move to the most recently used end
+            self._entries[(table, key)] = entry
+            self.stats[table]['hits'] += 1
+            return value
+
+    def _store(self, table, key, value):
+        with self._lock:
+            self._entries.pop((table, key), None)
+            self._entries[(table, key)] = (datetime.utcnow(), value)
+            while len(self._entries) > self.size:
+                (evicted, _), _ = self._entries.popitem(last=False)
+                self.stats[evicted]['evictions'] += 1
+
+    def get(self, table, key):
+        if table not in self.tables:
+            return self.backend.get(table, key)
+        value = self._lookup(table, key)
+        if value is None:
+            value = self.backend.get(table, key)
+            if value is not None:
+                self._store(table, key, value)
+        # Callers may modify what they get, keep our copy intact
+        return None if value is None else dict(value)
+
+    def get_many(self, table, keys):
+        if table not in self.tables:
+            return self.backend.get_many(table, keys)
+        values = {}
+        missing = []
+        for key in keys:
+            value = self._lookup(table, key)
+            if value is None:
+                missing.append(key)
+            else:
+                values[key] = value
+        if missing:
+            for key, value in self.backend.get_many(table, missing).items():
+                self._store(table, key, value)
+                values[key] = value
+        return dict((key, dict(value)) for key, value in values.items())
+
+    def set(self, table, key, value):
+        self.backend.set(table, key, value)
+        if table in self.tables:
+            self._store(table, key, dict(value))
+
+    def values(self, table):
+        return self.backend.values(table)
+
+    def bootstrap(self):
+        with self._lock:
+            self._entries.clear()
+        self.backend.bootstrap()
+
+    def clear(self):
+        """
+        Forget the in-process entries, keeping the backend and the stats.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def close(self):
+        self.backend.close()
+
+    def get_stats(self):
+        """
+        Returns the hits, misses, expired and evicted entries of each table
+        since the process started.
+        """
+        with self._lock:
+            return dict((table, dict(counts))
+                        for table, counts in self.stats.items())
+
+
+def get_cache():
+    """
+    Returns the process wide cache of the configured CACHE_BACKEND,
+    behind the in-process LRU unless CACHE_FRONT_SIZE is 0.
+    """
+    global _cache
+    if _cache is None:
+        if app_config.CACHE_BACKEND == 'sqlite':
+            _cache = SqliteCache()
+        else:
+            _cache = MongoCache()
+        if app_config.CACHE_FRONT_SIZE:
+            _cache = FrontCache(_cache)
+    return _cache
+
+
+def close_cache():
+    """
+    Close the process wide cache, the next get_cache creates a new one.
+    """
+    global _cache
+    if _cache is not None:
+        _cache.close()
+        _cache = None
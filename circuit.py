@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+"""
+Protection against failing remote services for the shortcode fetches:
+failed lookups are remembered for a while and hosts that keep failing
+are not called at all until they had time to recover.
+"""
+
+from time import time
+import logging
+import threading
+
+import app_config
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+
+class NegativeCache(object):
+    """
+    Remembers failed lookups for `ttl` seconds.
+    """
+    def __init__(self, ttl=None):
+        self.ttl = app_config.FETCH_NEGATIVE_TTL if ttl is None else ttl
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, reason):
+        with self._lock:
+            self._failures[key] = (time() + self.ttl, reason)
+
+    def get(self, key):
+        """
+        Returns why the lookup of `key` failed, None if it did not fail
+        recently.
+        """
+        with self._lock:
+            failure = self._failures.get(key)
+            if failure is None:
+                return None
+            expires, reason = failure
+            if expires <= time():
+                del self._failures[key]
+                return None
+            return reason
+
+    def __len__(self):
+        return len(self._failures)
+
+
+class CircuitBreaker(object):
+    """
+    Per host circuit breaker. After `threshold` consecutive failures the
+    circuit of a host opens and no request is allowed for `reset_after`
+    seconds. Then a single trial request is let through: its success
+    closes the circuit, its failure keeps it open for another period.
+    """
+    def __init__(self, threshold=None, reset_after=None):
+        self.threshold = threshold or app_config.FETCH_BREAKER_THRESHOLD
+        self.reset_after = (app_config.FETCH_BREAKER_RESET
+                            if reset_after is None else reset_after)
+        # host: [consecutive failures, time the circuit opened]
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def allow(self, host):
+        """
+        Whether a request to `host` may be sent now.
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state[1] is None:
+                return True
+            if time() - state[1] >= self.reset_after:
+                # Half open, let this request through as a trial
+                state[1] = time()
+                return True
+            return False
+
+    def record_success(self, host):
+        with self._lock:
+            state = self._hosts.pop(host, None)
+        if state is not None and state[1] is not None:
+            logger.info('%s recovered, closing its circuit' % host)
+
+    def record_failure(self, host):
+        with self._lock:
+            state = self._hosts.setdefault(host, [0, None])
+            state[0] += 1
+            if state[0] < self.threshold:
+                return
+            opening = state[1] is None
+            state[1] = time()
+        if opening:
+            logger.warning('%s failed %s times in a row, opening its circuit '
+                           'for %ss' % (host, state[0], self.reset_after))
+
+    def is_open(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            return state is not None and state[1] is not None
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+"""
+Shared MongoDB connection.
+
+MongoClient keeps its own connection pool and is thread safe, so a single
+client is reused for the lifetime of the process instead of connecting on
+every lookup.
+"""
+
+import app_config
+
+from pymongo import MongoClient
+
+_client = None
+
+
+def get_client():
+    """
+    Returns the process wide MongoClient, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        _client = MongoClient(app_config.MONGODB_URL)
+    return _client
+
+
+def close_client():
+    """
+    Close the connection pool of the process wide MongoClient.
+    """
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+def get_database():
+    """
+    Returns the liveblog database.
+    """
+    return get_client()['liveblog']
@@ -3,7 +3,7 @@
 from exceptions import KeyError
 import os
 
-import requests
+from http_client import get_client
 
 class GoogleDoc(object):
     """
@@ -64,7 +64,7 @@ class GoogleDoc(object):
             data['service'] = self.service
             data['session'] = self.session
 
-            r = requests.post("https://www.google.com/accounts/ClientLogin", data=data)
+            r = get_client().post("https://www.google.com/accounts/ClientLogin", data=data)
 
             self.auth = r.content.split('\n')[2].split('Auth=')[1]
 
@@ -85,11 +85,11 @@ class GoogleDoc(object):
             url_params = { 'key': self.key, 'format': self.file_format, 'gid': self.gid }
             url = self.new_spreadsheet_url % url_params
 
-            r = requests.get(url, headers=headers)
+            r = get_client().get(url, headers=headers)
 
             if r.status_code != 200:
                 url = self.spreadsheet_url % url_params
-                r = requests.get(url, headers=headers)
+                r = get_client().get(url, headers=headers)
 
             if r.status_code != 200:
                 raise KeyError("Error! Your Google Doc does not exist.")
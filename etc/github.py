@@ -7,11 +7,11 @@ import logging
 import os
 import re
 
-import requests
 from requests.auth import HTTPBasicAuth
 from time import sleep
 
 import app_config
+from http_client import get_client
 
 logging.basicConfig(format=app_config.LOG_FORMAT)
 logger = logging.getLogger(__name__)
@@ -27,7 +27,7 @@ def get_auth():
     auth = HTTPBasicAuth(username, password)
 
     # Test auth by requesting repo events
-    response = requests.get('https://api.github.com/notifications', auth=auth)
+    response = get_client().get('https://api.github.com/notifications', auth=auth)
 
     if response.status_code == 401:
         otp = response.headers.get('X-Github-OTP')
@@ -59,7 +59,7 @@ def delete_existing_labels(auth):
     """
     url = 'https://api.github.com/repos/%s/labels' % get_repo_path()
 
-    response = requests.get(url, auth=auth)
+    response = get_client().get(url, auth=auth)
     labels = json.loads(response.content)
 
     logger.info('Deleting %i labels' % len(labels))
@@ -67,7 +67,7 @@ def delete_existing_labels(auth):
     for label in labels:
         logger.info('Deleting label %s' % label['name'])
 
-        requests.delete(url + '/' + label['name'], auth=auth)
+        get_client().delete(url + '/' + label['name'], auth=auth)
 
 def create_labels(auth, filename='etc/default_labels.csv'):
     """
@@ -84,7 +84,7 @@ def create_labels(auth, filename='etc/default_labels.csv'):
         logger.info('Creating label "%s"' % label['name'])
         data = json.dumps(label)
 
-        requests.post(url, data=data, auth=auth)
+        get_client().post(url, data=data, auth=auth)
 
 def create_tickets(auth, filename='etc/default_tickets.csv'):
     """
@@ -109,7 +109,7 @@ def create_tickets(auth, filename='etc/default_tickets.csv'):
 
         data = json.dumps(ticket)
 
-        requests.post(url, data=data, auth=auth)
+        get_client().post(url, data=data, auth=auth)
 
         # avoid approximately 30 tickets/minute rate limit
         sleep(5)
@@ -130,7 +130,7 @@ def create_milestones(auth, filename='etc/default_milestones.csv'):
 
         data = json.dumps(milestone)
 
-        requests.post(url, data=data, auth=auth)
+        get_client().post(url, data=data, auth=auth)
 
 def create_hipchat_hook(auth):
     """
@@ -161,4 +161,4 @@ def create_hipchat_hook(auth):
         }
     })
 
-    requests.post(url, data=data, auth=auth)
+    get_client().post(url, data=data, auth=auth)
@@ -14,6 +14,7 @@ import app_config
 
 # Other fabfiles
 import assets
+import benchmarks
 import daemons
 import data
 import flat
@@ -235,10 +236,10 @@ def deploy_liveblog():
     """
     require('settings', provided_by=[production, staging])
 
-    render.render_liveblog()
-    flat.deploy_folder(
+    artifacts = render.render_liveblog()
+    flat.deploy_artifacts(
         app_config.S3_BUCKET,
-        '.liveblog',
+        artifacts,
         '%s%s' % (app_config.LIVEBLOG_DIRECTORY_PREFIX,
                   app_config.CURRENT_LIVEBLOG),
         headers={
@@ -248,19 +249,22 @@ def deploy_liveblog():
 
     # TODO turn backup on inauguration day
     if app_config.DEPLOYMENT_TARGET == 'production':
-        execute('deploy_liveblog_backup')
+        execute('deploy_liveblog_backup', artifacts=artifacts)
 
 
 @task
-def deploy_liveblog_backup():
+def deploy_liveblog_backup(artifacts=None):
     """
     deploy to our backup S3 bucket election-backup.apps.npr.org
     """
     now = datetime.now().strftime('%Y-%m-%d-%H:%M:%S')
 
-    flat.deploy_folder(
+    if artifacts is None:
+        artifacts = render.render_liveblog()
+
+    flat.deploy_artifacts(
         app_config.ARCHIVE_S3_BUCKET,
-        '.liveblog',
+        artifacts,
         'liveblogs/%s/%s-%s' % (app_config.CURRENT_LIVEBLOG,
                                 now, app_config.PROJECT_SLUG),
         headers={
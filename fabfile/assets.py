@@ -8,7 +8,9 @@ import os
 
 from fabric.api import prompt, task
 import app_config
+from cache import get_cache
 from fnmatch import fnmatch
+from shortcode import get_image_metadata
 import utils
 
 logging.basicConfig(format=app_config.LOG_FORMAT)
@@ -16,6 +18,7 @@ logger = logging.getLogger(__name__)
 logger.setLevel(app_config.LOG_LEVEL)
 
 ASSETS_ROOT = 'www/assets'
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif']
 
 @task
 def sync():
@@ -177,6 +180,35 @@ def rm(path):
 
             _assets_delete(local_path, key)
 
+@task
+def seed_images(path):
+    """
+    Cache the metadata of the local copies of the images under IMAGE_URL
+    """
+    if not os.path.isdir(path):
+        logger.error('%s is not a folder' % path)
+        return
+
+    cache = get_cache()
+    seeded = 0
+
+    for local_path, subdirs, filenames in os.walk(path):
+        for name in filenames:
+            if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            full_path = os.path.join(local_path, name)
+            id = os.path.relpath(full_path, path).replace(os.sep, '/')
+
+            with open(full_path, 'rb') as f:
+                metadata = get_image_metadata(f.read())
+            # Revalidate on first use, the remote copy may differ. The
+            # md5 tells whether it does, it is not assumed to be its ETag
+            metadata['checked'] = None
+            cache.set('images', id, metadata)
+            seeded += 1
+
+    logger.info('Seeded the metadata of %s images from %s' % (seeded, path))
+
 def _assets_confirm(local_path):
     """
     Check with user about whether to keep local or remote file.
@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+"""
+Benchmarks of the liveblog publishing pipeline.
+
+The pipeline runs on synthetic docs (see synthetic.py) or on the doc
+versions captured during a real event (see capture.py). It uses a scratch
+SQLite cache and the local stand-ins for S3 and the image and oEmbed
+endpoints in fakes.py, so no credentials, mongod or network access
+are needed. The stand-ins and the generators are only imported by the
+benchmark tasks, to keep them out of the daemon.
+"""
+
+from contextlib import contextmanager
+from time import sleep
+from timeit import default_timer, Timer
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from bs4 import BeautifulSoup
+import copytext
+from copydoc import CopyDoc
+from fabric.api import abort, task
+
+import app_config
+import cache
+import capture
+import flat
+import parse_doc
+import render
+import shortcode
+
+from engine import LiveblogEngine
+from metrics import CycleStats
+from render_utils import GetFirstElement, smarty_filter, urlencode_filter
+from stats_utils import percentile
+from utils import prep_bool_arg
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+DEFAULT_SIZES = '10,100,500,2000'
+MICRO_BASELINE_PATH = 'tests/benchmarks_baseline.json'
+
+COLUMNS = [
+    ('posts', '%6s'),
+    ('doc_kb', '%8.1f'),
+    ('split', '%8.3f'),
+    ('parse_cold', '%10.3f'),
+    ('parse', '%8.3f'),
+    ('render', '%8.3f'),
+    ('publish', '%8.3f'),
+    ('republish', '%9.3f'),
+    ('total', '%8.3f'),
+    ('files', '%5s'),
+    ('out_kb', '%8.1f'),
+]
+
+REPLAY_COLUMNS = [
+    ('cycle', '%5s'),
+    ('offset', '%8.1f'),
+    ('lag', '%6.2f'),
+    ('outcome', '%10s'),
+    ('latency', '%8.3f'),
+    ('posts', '%5s'),
+    ('changed', '%7s'),
+    ('files', '%5s'),
+    ('kb', '%8.1f'),
+]
+
+
+@contextmanager
+def offline(http_latency=0):
+    """
+    Point the pipeline at the local stand-ins and a scratch folder,
+    restoring everything on exit. Yields the scratch folder.
+    """
+    from fakes import FakeHTTP, FakeServices
+    tmp_dir = tempfile.mkdtemp(prefix='liveblog-bench-')
+    bench_cache = cache.SqliteCache(os.path.join(tmp_dir, 'cache.sqlite'))
+    if app_config.CACHE_FRONT_SIZE:
+        bench_cache = cache.FrontCache(bench_cache)
+    # Cold parses fetch the embeds, as they would without a running daemon
+    services = FakeServices(bench_cache, FakeHTTP(latency=http_latency),
+                            resolve_async=False)
+    saved_backup_path = app_config.LIVEBLOG_BACKUP_PATH
+    app_config.LIVEBLOG_BACKUP_PATH = os.path.join(tmp_dir, 'backup.pickle')
+    # Keep per post logging out of both the timings and the report
+    logging.disable(logging.INFO)
+    try:
+        with services:
+            yield tmp_dir
+    finally:
+        logging.disable(logging.NOTSET)
+        app_config.LIVEBLOG_BACKUP_PATH = saved_backup_path
+        shutil.rmtree(tmp_dir)
+
+
+def _timed(func, *args, **kwargs):
+    start = default_timer()
+    result = func(*args, **kwargs)
+    return default_timer() - start, result
+
+
+def _parse(html, authors):
+    doc = CopyDoc(html)
+    try:
+        return parse_doc.parse(doc, authors)
+    finally:
+        doc.soup.decompose()
+
+
+def bench_size(num_posts, copy, repeat=3, s3_latency=0):
+    """
+    Time each stage of the pipeline for a doc of `num_posts` posts.
+    The first parse runs with empty caches, every other timing is the
+    best of `repeat` runs.
+    """
+    from fakes import FakeBucket
+    from synthetic import generate_authors, generate_liveblog
+    html = generate_liveblog(num_posts)
+    authors = generate_authors()
+    result = {
+        'posts': num_posts,
+        'doc_kb': len(html.encode('utf-8')) / 1024.0,
+    }
+
+    cache.get_cache().bootstrap()
+    result['parse_cold'], parsed = _timed(_parse, html, authors)
+
+    best = {}
+    for i in range(repeat):
+        timings = {}
+        timings['split'], doc = _timed(CopyDoc, html)
+        timings['parse'], parsed = _timed(parse_doc.parse, doc, authors)
+        doc.soup.decompose()
+        timings['render'], artifacts = _timed(
+            render.generate_views, render.LIVEBLOG_VIEWS, parsed, copy=copy)
+        bucket = FakeBucket(latency=s3_latency)
+        timings['publish'], uploaded = _timed(
+            flat.deploy_artifacts, bucket.name, artifacts, 'liveblog',
+            bucket=bucket)
+        timings['republish'], _ = _timed(
+            flat.deploy_artifacts, bucket.name, artifacts, 'liveblog',
+            bucket=bucket)
+        for stage, seconds in timings.iteritems():
+            best[stage] = min(seconds, best.get(stage, seconds))
+
+    result.update(best)
+    result['total'] = sum(best[stage] for stage in
+                          ('split', 'parse', 'render', 'publish'))
+    result['files'] = len(uploaded)
+    result['out_kb'] = artifacts.total_bytes / 1024.0
+    return result
+
+
+def _report(results, columns=COLUMNS):
+    header = ' '.join((fmt.replace('.1f', 's').replace('.2f', 's')
+                       .replace('.3f', 's') % name)
+                      for name, fmt in columns)
+    print header
+    for result in results:
+        print ' '.join(fmt % result[name] for name, fmt in columns)
+
+
+@task
+def pipeline(sizes=DEFAULT_SIZES, repeat=3, http_latency=0, s3_latency=0,
+             output=None):
+    """
+    Benchmark parse, render and publish on synthetic docs of `sizes` posts
+    """
+    from synthetic import generate_copy
+    sizes = [int(size) for size in str(sizes).split(',')]
+    results = []
+    with offline(float(http_latency)) as tmp_dir:
+        copy_path = os.path.join(tmp_dir, 'copy.xlsx')
+        generate_copy(copy_path)
+        copy = copytext.Copy(copy_path)
+        for num_posts in sizes:
+            results.append(bench_size(num_posts, copy, int(repeat),
+                                      float(s3_latency)))
+    _report(results)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+    return results
+
+
+def _replay_engine(tmp_dir, s3_latency=0):
+    """
+    A LiveblogEngine publishing to fake buckets, with the local copy and
+    authors spreadsheets if there are any.
+    """
+    from fakes import FakeBucket
+    from synthetic import generate_copy
+    engine = LiveblogEngine()
+    for bucket_name in (app_config.S3_BUCKET, app_config.ARCHIVE_S3_BUCKET):
+        engine.buckets[bucket_name] = FakeBucket(bucket_name, s3_latency)
+    copy_path = app_config.COPY_PATH
+    if not os.path.exists(copy_path):
+        copy_path = os.path.join(tmp_dir, 'copy.xlsx')
+        generate_copy(copy_path)
+    engine.copy = copytext.Copy(copy_path)
+    if os.path.exists(app_config.AUTHORS_PATH):
+        engine.authors = parse_doc.getAuthorsData()
+    return engine
+
+
+def replay_cycle(engine, html):
+    """
+    Build and publish one captured version, like a daemon cycle.
+    """
+    stats = CycleStats()
+    try:
+        build = engine.build(html, stats=stats)
+        if build is None:
+            stats.finish('unchanged')
+        else:
+            engine.publish(build[1], stats=stats)
+            stats.finish('published')
+    except Exception:
+        logger.exception('Replayed cycle failed')
+        stats.finish('error')
+    return stats
+
+
+@task
+def replay(folder=None, speed=0, http_latency=0, s3_latency=0, output=None):
+    """
+    Replay the captured versions of a liveblog doc through the pipeline
+    """
+    if folder is None:
+        if not app_config.LIVEBLOG_CAPTURE_PATH:
+            logger.error('LIVEBLOG_CAPTURE_PATH is not set, pass a folder')
+            return []
+        folder = capture.get_capture_folder()
+    speed = float(speed)
+    captures = capture.list_captures(folder)
+    if not captures:
+        logger.error('No captures found in %s' % folder)
+        return []
+
+    results = []
+    with offline(float(http_latency)) as tmp_dir:
+        engine = _replay_engine(tmp_dir, float(s3_latency))
+        first = captures[0][0]
+        start = default_timer()
+        for i, (arrived, path) in enumerate(captures):
+            offset = (arrived - first).total_seconds()
+            lag = 0
+            if speed:
+                # Wait for the version to "arrive", at `speed` times real time
+                due = start + offset / speed
+                wait = due - default_timer()
+                if wait > 0:
+                    sleep(wait)
+                lag = max(0, -wait)
+            stats = replay_cycle(engine, capture.read_capture(path))
+            results.append({
+                'cycle': i,
+                'offset': offset,
+                'lag': lag,
+                'outcome': stats.outcome,
+                'latency': stats.duration,
+                'stages': dict(stats.stages),
+                'posts': stats.counts['posts'],
+                'changed': stats.counts['changed_posts'],
+                'files': stats.counts['files_uploaded'],
+                'kb': stats.counts['bytes_uploaded'] / 1024.0,
+            })
+
+    _report(results, REPLAY_COLUMNS)
+    latencies = sorted(result['latency'] for result in results)
+    print '%s cycles, latency p50 %.3fs, p95 %.3fs, max %.3fs, %s files, %.1fKB published' % (
+        len(results), percentile(latencies, 0.5), percentile(latencies, 0.95),
+        latencies[-1], sum(result['files'] for result in results),
+        sum(result['kb'] for result in results))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+    return results
+
+
+def _calibration():
+    """
+    Fixed pure python workload the microbenchmarks are measured against,
+    so that baselines carry over between machines.
+    """
+    return sum(i * i for i in xrange(10000))
+
+
+def _micro_cases():
+    """
+    Returns the (name, callable) pairs of the microbenchmarks, built on
+    inputs shaped like a typical post.
+    """
+    from synthetic import LOREM, generate_authors
+    authors = generate_authors()
+    byline = 'Author 1 (A01), Author 2 (A02), Someone Else'
+    text = ''.join('<p>%s</p>' % LOREM for i in range(5))
+    link = ('<p>%s [%% internal_link post-1 link_text="Earlier" %%] %s</p>' %
+            (LOREM[:60], LOREM[60:]))
+    embeds = ('<p>[% image photo-1.jpg caption="Caption" credit="Credit" %]</p>'
+              '<p>[% tweet https://twitter.com/npr/status/1 %]</p>'
+              '<p>[% youtube https://www.youtube.com/embed/v1 '
+              'youtube_start_time="0" %]</p>')
+    plain = list(BeautifulSoup(text, 'html.parser').children)
+    mixed = list(BeautifulSoup(text + link + embeds, 'html.parser').children)
+    image_tag = BeautifulSoup(embeds, 'html.parser').p
+    link_match = parse_doc.internal_link_regex.search(link)
+    # Warm the image and tweet caches, benchmarks measure the steady state
+    rendered = parse_doc.process_post_contents(mixed)
+
+    def first_paragraph():
+        parser = GetFirstElement('p', without_classes=['caption', 'credit'])
+        parser.feed(rendered)
+
+    return [
+        ('process_post_contents', lambda: parse_doc.process_post_contents(plain)),
+        ('process_post_contents_shortcodes',
+         lambda: parse_doc.process_post_contents(mixed)),
+        ('process_inline_internal_link',
+         lambda: parse_doc.process_inline_internal_link(link_match)),
+        ('process_shortcode', lambda: shortcode.process_shortcode(image_tag)),
+        ('GetFirstElement', first_paragraph),
+        ('smarty_filter',
+         lambda: smarty_filter(u'"Quoted" -- it\'s %s' % LOREM)),
+        ('urlencode_filter',
+         lambda: urlencode_filter(u'Headline: %s' % LOREM)),
+        ('add_author_metadata',
+         lambda: parse_doc.add_author_metadata({'authors': byline}, authors)),
+    ]
+
+
+def _time_per_call(func, repeat=5, min_time=0.05):
+    """
+    Best per call time of `func` over `repeat` runs of at least `min_time`.
+    """
+    timer = Timer(func)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    return min(timer.repeat(repeat, number)) / number
+
+
+def run_microbenchmarks(repeat=5):
+    """
+    Returns the calibration time and the time per call of each helper,
+    relative to the calibration.
+    """
+    with offline():
+        calibration = _time_per_call(_calibration, repeat)
+        timings = [(name, _time_per_call(func, repeat))
+                   for name, func in _micro_cases()]
+        # Calibrate again once everything is warm, keep the fastest
+        calibration = min(calibration, _time_per_call(_calibration, repeat))
+    results = dict((name, seconds / calibration) for name, seconds in timings)
+    return calibration, results
+
+
+def find_regressions(results, baseline, threshold=None):
+    """
+    Returns the (name, change) of the helpers that got slower than their
+    baseline by more than `threshold` (a fraction).
+    """
+    if threshold is None:
+        threshold = app_config.BENCHMARK_REGRESSION_THRESHOLD
+    regressions = []
+    for name, relative in sorted(results.items()):
+        if name not in baseline:
+            continue
+        change = relative / baseline[name] - 1
+        if change > threshold:
+            regressions.append((name, change))
+    return regressions
+
+
+def load_baseline(path=MICRO_BASELINE_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+@task
+def micro(save=False, threshold=None, repeat=5, path=MICRO_BASELINE_PATH):
+    """
+    Microbenchmark the hot helpers, fail on regressions against the baseline
+    """
+    save = prep_bool_arg(save)
+    calibration, results = run_microbenchmarks(int(repeat))
+    baseline = {} if save else load_baseline(path)
+    print '%-34s %10s %10s %8s' % ('benchmark', 'usec', 'baseline', 'change')
+    for name, relative in sorted(results.items()):
+        usec = relative * calibration * 1e6
+        if name in baseline:
+            print '%-34s %10.1f %10.1f %+7.0f%%' % (
+                name, usec, baseline[name] * calibration * 1e6,
+                (relative / baseline[name] - 1) * 100)
+        else:
+            print '%-34s %10.1f %10s %8s' % (name, usec, '-', '-')
+
+    if save:
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True,
+                      separators=(',', ': '))
+            f.write('\n')
+        print 'Saved baseline to %s' % path
+        return
+
+    if threshold is not None:
+        threshold = float(threshold)
+    regressions = find_regressions(results, baseline, threshold)
+    if regressions:
+        abort('Regressions: %s' % ', '.join(
+            '%s (%+.0f%%)' % (name, change * 100)
+            for name, change in regressions))
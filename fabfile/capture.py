@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+"""
+Archive of the liveblog doc versions downloaded by the deploy daemon.
+
+When LIVEBLOG_CAPTURE_PATH is set every downloaded version is saved,
+gzipped, under a folder named after the event with its arrival time as
+the filename, so that the event can be replayed offline afterwards
+(see `fab benchmarks.replay`).
+"""
+
+from datetime import datetime
+from glob import glob
+import gzip
+import logging
+import os
+
+import app_config
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+TIME_FORMAT = '%Y%m%dT%H%M%S.%fZ'
+
+
+def get_capture_folder(base_path=None, event=None):
+    return os.path.join(base_path or app_config.LIVEBLOG_CAPTURE_PATH,
+                        event or app_config.CURRENT_LIVEBLOG)
+
+
+def archive(html, arrived=None, folder=None):
+    """
+    Save a downloaded version of the liveblog doc. Returns its path.
+    """
+    arrived = arrived or datetime.utcnow()
+    folder = folder or get_capture_folder()
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    path = os.path.join(folder, '%s.html.gz' % arrived.strftime(TIME_FORMAT))
+    with gzip.open(path, 'wb') as f:
+        f.write(html.encode('utf-8'))
+    return path
+
+
+def list_captures(folder):
+    """
+    Returns the (arrival time, path) of the captured versions in `folder`,
+    oldest first.
+    """
+    captures = []
+    for path in glob(os.path.join(folder, '*.html.gz')):
+        name = os.path.basename(path)[:-len('.html.gz')]
+        try:
+            arrived = datetime.strptime(name, TIME_FORMAT)
+        except ValueError:
+            logger.warning('Ignoring %s, not a capture' % path)
+            continue
+        captures.append((arrived, path))
+    return sorted(captures)
+
+
+def read_capture(path):
+    with gzip.open(path, 'rb') as f:
+        return f.read().decode('utf-8')
@@ -1,13 +1,25 @@
 #!/usr/bin/env python
 # _*_ coding:utf-8 _*_
 
-from time import sleep, time
-from fabric.api import execute, require, settings, task
+from collections import deque
+from fabric.api import require, settings, task
+from time import time
 
 import app_config
 import logging
 import sys
 
+from cache import get_cache
+from http_client import get_client
+from engine import LiveblogEngine
+from memory import MemoryGuard
+from metrics import (CycleStats, MetricsExporter, get_latencies,
+                     get_latency_summary, summarize_latencies)
+from pipeline import PublishPipeline
+from profiling import ProfileTrigger, profiled
+from scheduler import Scheduler
+from shortcode import has_resolved, render_cache
+
 logging.basicConfig(format=app_config.LOG_FORMAT)
 logger = logging.getLogger(__name__)
 logger.setLevel(app_config.LOG_LEVEL)
@@ -26,30 +38,127 @@ def deploy(run_once=False):
         sys.exit(0)
 
 
+@task
+def latency(event=None):
+    """
+    Report the edit to live latency of the posts of an event
+    """
+    summary = get_latency_summary(get_cache(), event)
+    if not summary['count']:
+        print 'No posts have gone live yet'
+        return
+    print '%(count)s posts, p50 %(p50).1fs, p95 %(p95).1fs, max %(max).1fs' % (
+        summary)
+
+
 @task
 def main(run_once=False):
     """
     Main loop
     """
-    copy_start = 0
-    cycle = 0
-
-    if not app_config.LOAD_COPY_INTERVAL:
-        logger.error('did not find LOAD_COPY_INTERVAL in app_config')
+    if not app_config.LIVEBLOG_REFRESH_INTERVAL:
+        logger.error('did not find LIVEBLOG_REFRESH_INTERVAL in app_config')
         exit()
 
-    while True:
-        now = time()
-        if (now - copy_start) > app_config.LOAD_COPY_INTERVAL:
-            cycle += 1
-            copy_start = now
-            logger.info('Update liveblog')
-            execute('text.get_liveblog')
-            execute('text.update')
-            if app_config.DEPLOYMENT_TARGET:
-                execute('deploy_liveblog')
-            if (cycle % app_config.REFRESH_AUTHOR_CYCLES == 0):
-                logger.info('Update authors file')
-                cycle = 0
-                execute('text.update')
-        sleep(1)
+    engine = LiveblogEngine()
+    engine.load_state()
+    metrics = engine.metrics
+    memory_guard = MemoryGuard()
+    exporter = MetricsExporter()
+    profile_trigger = ProfileTrigger()
+    profile_trigger.install()
+    # Whether each of the recent cycles found changes and how long
+    # the completed ones took
+    recent_changes = deque(maxlen=app_config.LIVEBLOG_ACTIVE_CYCLES)
+    recent_durations = deque(maxlen=app_config.LIVEBLOG_ACTIVE_CYCLES)
+    # Edit-to-live latencies of the event, read once and then extended
+    # with the posts going live
+    latencies = get_latencies(engine.cache)
+
+    def cycle_done(stats):
+        memory_guard.sample(stats)
+        recent_durations.append(stats.duration)
+        if stats.duration > liveblog_job.interval:
+            metrics['overruns'] += 1
+            stage, seconds = stats.slowest_stage
+            logger.warning('Cycle took %.2fs, longer than the %.2fs interval. Slowest stage: %s (%.2fs)' % (
+                           stats.duration, liveblog_job.interval, stage, seconds))
+        latency = None
+        if stats.latencies:
+            latencies.extend(stats.latencies)
+            latency = summarize_latencies(latencies)
+            logger.info('edit to live latency: %s' % latency)
+        cache_stats = engine.cache.get_stats()
+        cache_stats['shortcodes'] = dict(render_cache.stats)
+        exporter.export(stats, metrics, latency, cache_stats,
+                        get_client().get_stats())
+        if stats.profiler is not None:
+            try:
+                stats.profiler.dump(stats)
+            except IOError, e:
+                logger.error('Could not write cycle profile: %s' % e)
+        logger.info('cycle metrics: %s' % dict(metrics))
+
+    pipeline = PublishPipeline(engine, on_cycle_done=cycle_done)
+    pipeline.start()
+
+    def update_liveblog():
+        # Restart between cycles, never with a version in flight
+        if pipeline.idle and memory_guard.should_restart(engine.restarted):
+            engine.restarted = time()
+            engine.save_state()
+            engine.close()
+            memory_guard.restart()
+        metrics['cycles'] += 1
+        logger.info('Update liveblog')
+        stats = CycleStats()
+        stats.profiler = profile_trigger.take()
+        with profiled(stats):
+            html = engine.fetch_liveblog(stats=stats)
+        changed = html is not None
+        if (not changed and app_config.DEPLOYMENT_TARGET and
+                pipeline.retry_failed(stats=stats)):
+            # S3 still serves the version whose upload failed
+            metrics['publish_retries'] += 1
+        elif (not changed and has_resolved() and engine.html is not None and
+                app_config.DEPLOYMENT_TARGET):
+            # Replace the placeholders of the embeds resolved meanwhile
+            logger.info('Shortcodes resolved in the background, rebuilding')
+            metrics['rebuilt_resolved_shortcodes'] += 1
+            pipeline.submit(engine.html, stats=stats)
+        elif not changed:
+            logger.info('Liveblog has not changed, skipping deploy')
+            metrics['skipped_unchanged_doc'] += 1
+            stats.finish('unchanged')
+            cycle_done(stats)
+        elif app_config.DEPLOYMENT_TARGET:
+            pipeline.submit(html, stats=stats)
+        recent_changes.append(changed)
+        liveblog_job.adapt(any(recent_changes),
+                           floor=max(recent_durations or [0]))
+
+    def update_copy():
+        if engine.refresh_copy():
+            logger.info('Copy file updated')
+            # Copy is not part of the parsed document, force a deploy
+            if app_config.DEPLOYMENT_TARGET and engine.html is not None:
+                pipeline.submit(engine.html, force=True)
+
+    def update_authors():
+        if engine.refresh_authors():
+            logger.info('Authors file updated')
+            if app_config.DEPLOYMENT_TARGET and engine.html is not None:
+                pipeline.submit(engine.html)
+
+    # Copy and authors go first so that they are loaded before the
+    # first liveblog update
+    scheduler = Scheduler()
+    scheduler.add('copy', app_config.COPY_REFRESH_INTERVAL, update_copy)
+    scheduler.add('authors', app_config.AUTHORS_REFRESH_INTERVAL,
+                  update_authors)
+    liveblog_job = scheduler.add(
+        'liveblog', app_config.LIVEBLOG_REFRESH_INTERVAL, update_liveblog,
+        min_interval=app_config.LIVEBLOG_MIN_REFRESH_INTERVAL,
+        max_interval=app_config.LIVEBLOG_MAX_REFRESH_INTERVAL,
+        backoff=app_config.LIVEBLOG_REFRESH_BACKOFF)
+    scheduler.run_forever()
@@ -3,10 +3,9 @@
 """
 Commands that update or process the application data.
 """
-import app_config
-
 from fabric.api import task
-from pymongo import MongoClient
+
+from cache import get_cache
 
 
 @task(default=True)
@@ -20,17 +19,6 @@ def update():
 @task
 def bootstrap_db():
     """
-    Create mongodb
+    Empty the caches (mongodb or sqlite, see CACHE_BACKEND)
     """
-    client = MongoClient(app_config.MONGODB_URL)
-    database = client['liveblog']
-
-    database.images.drop()
-    database.images.create_index('date', expireAfterSeconds=app_config.DB_IMAGE_TTL)
-
-    database.tweets.drop()
-    database.tweets.create_index('date', expireAfterSeconds=app_config.DB_TWEET_TTL)
-
-    database.timestamps.drop()
-
-    database.pinned.drop()
+    get_cache().bootstrap()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+"""
+Long lived liveblog publishing engine used by the deploy daemon.
+
+Every stage of a daemon cycle is a plain method call on a LiveblogEngine,
+which keeps the expensive state (Flask app and Jinja environment, Mongo
+client, authors dictionary, copy spreadsheet, S3 buckets and Google
+credentials) warm across cycles instead of rebuilding it through fabric's
+`execute` machinery.
+"""
+
+from collections import Counter
+from datetime import datetime
+import codecs
+import cPickle as pickle
+import logging
+import os
+
+import copytext
+from copydoc import CopyDoc
+
+import app
+import app_config
+import capture
+import db
+import flat
+import http_client
+import oauth
+import parse_doc
+import render
+import utils
+
+from cache import close_cache, get_cache
+from metrics import CycleStats, mark_posts_live
+from shortcode import take_resolved
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+
+class LiveblogEngine(object):
+    """
+    Holds the state shared by every daemon cycle and exposes each stage
+    of the cycle as a method.
+    """
+    def __init__(self):
+        self.app = app.app
+        # Create the Jinja environment up front, it caches compiled templates
+        self.jinja_env = self.app.jinja_env
+        self.cache = get_cache()
+        self.credentials = None
+        self.buckets = {}
+        self.authors = None
+        self.copy = None
+        self.revision = None
+        self.revisions = {}
+        self.html = None
+        self.last_digest = None
+        self.post_digests = {}
+        self.metrics = Counter()
+        # Only posts first published after this are tracked for latency
+        self.started = datetime.utcnow()
+        self.live_slugs = set()
+        # Time the daemon last restarted itself, from the state snapshot
+        self.restarted = None
+
+    def save_state(self, path=None):
+        """
+        Snapshot what is needed to resume without redeploying: the doc
+        revisions and the digests of the last build. The doc itself is
+        already on disk at LIVEBLOG_HTML_PATH.
+        """
+        path = path or app_config.DAEMON_STATE_PATH
+        state = {
+            'revision': self.revision,
+            'revisions': self.revisions,
+            'last_digest': self.last_digest,
+            'post_digests': self.post_digests,
+            'started': self.started,
+            'restarted': self.restarted,
+        }
+        with open(path, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+
+    def load_state(self, path=None):
+        """
+        Resume from a snapshot written by `save_state`, which is removed
+        so that it is only used once. Returns True if there was one.
+        """
+        path = path or app_config.DAEMON_STATE_PATH
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, 'rb') as f:
+                state = pickle.load(f)
+            with codecs.open(app_config.LIVEBLOG_HTML_PATH, 'r', 'utf-8') as f:
+                html = f.read()
+        except Exception, e:
+            logger.warning('Could not resume from %s: %s' % (path, e))
+            return False
+        finally:
+            os.remove(path)
+        self.html = html
+        for key, value in state.iteritems():
+            setattr(self, key, value)
+        # The files of the saved revisions are on disk, load them so that
+        # the first refreshes do not download them again and redeploy
+        if self.revisions.get(app_config.COPY_GOOGLE_DOC_KEY):
+            self._load_copy()
+        if self.revisions.get(app_config.AUTHORS_GOOGLE_DOC_KEY):
+            self.authors = parse_doc.getAuthorsData()
+        logger.info('Resumed from revision %s' % self.revision)
+        return True
+
+    def close(self):
+        """
+        Close the cache, HTTP and MongoDB connections before the daemon
+        replaces its process. boto can not close the pooled connections
+        of the buckets, they are dropped.
+        """
+        self.buckets = {}
+        self.cache = None
+        close_cache()
+        http_client.close_client()
+        db.close_client()
+
+    def get_credentials(self):
+        """
+        Returns the Google credentials, only rereading them from disk
+        (and refreshing them) when they are no longer valid.
+        """
+        if self.credentials is None or not self.credentials.valid:
+            self.credentials = oauth.get_credentials()
+        return self.credentials
+
+    def get_bucket(self, bucket_name):
+        """
+        Returns a connected S3 bucket, reusing connections between cycles.
+        """
+        if bucket_name not in self.buckets:
+            self.buckets[bucket_name] = utils.get_bucket(bucket_name)
+        return self.buckets[bucket_name]
+
+    def fetch_liveblog(self, force=False, stats=None):
+        """
+        Downloads the liveblog doc if its Drive revision has changed.
+        Returns the new html or None if nothing changed.
+        """
+        stats = stats or CycleStats()
+        key = app_config.LIVEBLOG_GDOC_KEY
+        if not key:
+            return None
+        with stats.stage('fetch'):
+            credentials = self.get_credentials()
+            revision = oauth.get_doc_revision(key, credentials=credentials)
+            if not force and revision == self.revision and self.html:
+                logger.debug('liveblog doc unchanged (revision %s)' % revision)
+                return None
+            self.html = oauth.get_doc(key, app_config.LIVEBLOG_HTML_PATH,
+                                      credentials=credentials)
+        stats.counts['doc_length'] = len(self.html)
+        if app_config.LIVEBLOG_CAPTURE_PATH:
+            try:
+                capture.archive(self.html)
+            except (IOError, OSError), e:
+                logger.warning('Could not capture liveblog doc: %s' % e)
+        self.revision = revision
+        return self.html
+
+    def _download_if_modified(self, key, path, force=False):
+        """
+        Downloads a spreadsheet if its Drive revision has changed.
+        Returns True if a new version was downloaded.
+        """
+        if not key:
+            return False
+        credentials = self.get_credentials()
+        revision = oauth.get_doc_revision(key, credentials=credentials)
+        if not force and self.revisions.get(key) == revision:
+            logger.debug('%s unchanged (revision %s)' % (path, revision))
+            return False
+        oauth.get_document(key, path, credentials=credentials)
+        self.revisions[key] = revision
+        return True
+
+    def refresh_copy(self, force=False):
+        """
+        Downloads and loads the copy spreadsheet if it has changed.
+        Returns True if it did.
+        """
+        force = force or self.copy is None
+        if not self._download_if_modified(app_config.COPY_GOOGLE_DOC_KEY,
+                                          app_config.COPY_PATH, force):
+            return False
+        self._load_copy()
+        return True
+
+    def _load_copy(self):
+        try:
+            self.copy = copytext.Copy(app_config.COPY_PATH)
+        except copytext.CopyException, e:
+            logger.warning('Could not load copy: %s' % e)
+            self.copy = None
+
+    def refresh_authors(self, force=False):
+        """
+        Downloads and loads the authors dictionary if it has changed.
+        Returns True if it did.
+        """
+        force = force or self.authors is None
+        if not self._download_if_modified(app_config.AUTHORS_GOOGLE_DOC_KEY,
+                                          app_config.AUTHORS_PATH, force):
+            return False
+        self.authors = parse_doc.getAuthorsData()
+        return True
+
+    def parse(self, html, stats=None):
+        """
+        Parses the liveblog html into a document.
+        """
+        stats = stats or CycleStats()
+        with stats.stage('split'):
+            doc = CopyDoc(html)
+        try:
+            return parse_doc.parse(doc, self.authors, stats=stats)
+        finally:
+            # Break up the tree now instead of waiting for the collector
+            doc.soup.decompose()
+
+    def render(self, parsed_liveblog):
+        """
+        Renders the liveblog views into an ArtifactCollection.
+        """
+        return render.generate_views(render.LIVEBLOG_VIEWS, parsed_liveblog,
+                                     mirror_path=app_config.LIVEBLOG_MIRROR_PATH,
+                                     copy=self.copy)
+
+    def publish(self, artifacts, stats=None):
+        """
+        Uploads changed artifacts to S3 and, on production, to the
+        backup bucket. Returns the list of uploaded artifacts.
+        """
+        stats = stats or CycleStats()
+        with stats.stage('upload'):
+            uploaded = self._publish(artifacts)
+        stats.counts['files_uploaded'] = len(uploaded)
+        stats.counts['bytes_uploaded'] = sum(len(a.content) for a in uploaded)
+        pending = [slug for slug in stats.published_slugs
+                   if slug not in self.live_slugs]
+        # Posts that are settled are not looked up again
+        stats.latencies, settled = mark_posts_live(self.cache, pending,
+                                                   self.started)
+        stats.counts['posts_went_live'] = len(stats.latencies)
+        self.live_slugs.update(settled)
+        return uploaded
+
+    def _publish(self, artifacts):
+        headers = {
+            'Cache-Control': 'max-age=%i' % app_config.DEFAULT_MAX_AGE
+        }
+        uploaded = flat.deploy_artifacts(
+            app_config.S3_BUCKET,
+            artifacts,
+            '%s%s' % (app_config.LIVEBLOG_DIRECTORY_PREFIX,
+                      app_config.CURRENT_LIVEBLOG),
+            headers=headers,
+            bucket=self.get_bucket(app_config.S3_BUCKET)
+        )
+
+        if app_config.DEPLOYMENT_TARGET == 'production':
+            now = datetime.now().strftime('%Y-%m-%d-%H:%M:%S')
+            flat.deploy_artifacts(
+                app_config.ARCHIVE_S3_BUCKET,
+                artifacts,
+                'liveblogs/%s/%s-%s' % (app_config.CURRENT_LIVEBLOG,
+                                        now, app_config.PROJECT_SLUG),
+                headers=headers,
+                bucket=self.get_bucket(app_config.ARCHIVE_S3_BUCKET)
+            )
+        return uploaded
+
+    def build(self, html, force=False, stats=None):
+        """
+        Parses and renders the liveblog html.
+        Returns a (digest, artifacts) tuple, or None when the parsed
+        document is the same as the last one built.
+        """
+        stats = stats or CycleStats()
+        # This build replaces the placeholders of the embeds resolved so far
+        take_resolved()
+        parsed_liveblog = self.parse(html, stats=stats)
+        with stats.stage('parse'):
+            digest = parse_doc.hash_document(parsed_liveblog)
+            post_digests = dict((post['slug'], parse_doc.hash_post(post))
+                                for post in parsed_liveblog['posts'])
+        stats.counts['posts'] = len(post_digests)
+        stats.published_slugs = [post['slug']
+                                 for post in parsed_liveblog['posts']
+                                 if post.get('published') == 'yes']
+        stats.counts['changed_posts'] = len(
+            [slug for slug, post_digest in post_digests.iteritems()
+             if self.post_digests.get(slug) != post_digest])
+        self.post_digests = post_digests
+        if digest == self.last_digest and not force:
+            logger.info('Parsed liveblog has not changed, skipping deploy')
+            self.metrics['skipped_unchanged_parse'] += 1
+            return None
+        with stats.stage('render'):
+            artifacts = self.render(parsed_liveblog)
+        stats.counts['files_rendered'] = len(artifacts)
+        self.last_digest = digest
+        return digest, artifacts
+
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+"""
+Local stand-ins for the external services used by the liveblog pipeline
+(Google Drive, MongoDB, S3 and the image and oEmbed endpoints), so that
+it can be exercised and benchmarked offline.
+"""
+
+from datetime import datetime, timedelta
+from StringIO import StringIO
+from time import sleep
+from urlparse import urlparse
+import hashlib
+
+from PIL import Image
+from requests import HTTPError
+
+import app_config
+import cache
+import http_client
+
+
+class FakeResponse(object):
+    """
+    Mimics the parts of an Authomatic response that we rely on.
+    """
+    def __init__(self, status, content='', data=None):
+        self.status = status
+        self.content = content
+        self.data = data
+
+
+class FakeDrive(object):
+    """
+    Local stand-in for the Google Drive v3 API.
+
+    Use it in place of `app_config.authomatic`: it answers the metadata and
+    export urls built in `oauth.py` from an in-memory set of files and
+    records every request made against it.
+    """
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        self._clock = datetime(2019, 12, 19, 20, 0, 0)
+
+    def put(self, key, content):
+        """
+        Create or edit a file, bumping its revision.
+        """
+        self._clock += timedelta(seconds=1)
+        version = self.files.get(key, {}).get('version', 0) + 1
+        self.files[key] = {
+            'content': content,
+            'version': version,
+            'modifiedTime': self._clock.isoformat() + 'Z',
+        }
+
+    def access(self, credentials, url, **kwargs):
+        self.requests.append(url)
+        bits = urlparse(url).path.split('/')
+        # /drive/v3/files/<key>[/export]
+        key = bits[4]
+        if key not in self.files:
+            return FakeResponse(404)
+        f = self.files[key]
+        if len(bits) > 5 and bits[5] == 'export':
+            return FakeResponse(200, content=f['content'])
+        return FakeResponse(200, data={
+            'id': key,
+            'version': str(f['version']),
+            'modifiedTime': f['modifiedTime'],
+        })
+
+    @property
+    def exports(self):
+        return [url for url in self.requests if '/export' in url]
+
+
+def _matches(doc, spec):
+    """
+    Minimal MongoDB query matching: equality plus the $in, $gte and
+    $exists operators used by the liveblog.
+    """
+    for field, condition in spec.iteritems():
+        present = field in doc
+        value = doc.get(field)
+        if isinstance(condition, dict):
+            for op, arg in condition.iteritems():
+                if op == '$in' and value not in arg:
+                    return False
+                elif op == '$gte' and (not present or value < arg):
+                    return False
+                elif op == '$exists' and present != bool(arg):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeCollection(object):
+    """
+    In-memory stand-in for a pymongo collection.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.docs = {}
+        self.queries = 0
+
+    def find_one(self, spec):
+        self.queries += 1
+        for doc in self.find(spec):
+            return doc
+        return None
+
+    def find(self, spec=None):
+        return [dict(doc) for doc in self.docs.values()
+                if _matches(doc, spec or {})]
+
+    def insert(self, doc):
+        self.docs[doc['_id']] = dict(doc)
+        return doc['_id']
+
+    def update(self, spec, document, upsert=False):
+        for doc in self.find(spec):
+            new = dict(document)
+            new['_id'] = doc['_id']
+            self.docs[doc['_id']] = new
+
+    def replace_one(self, spec, document, upsert=False):
+        docs = self.find(spec)
+        if docs:
+            self.docs[docs[0]['_id']] = dict(document, _id=docs[0]['_id'])
+        elif upsert:
+            self.insert(document)
+
+    def drop(self):
+        self.docs = {}
+
+    def update_many(self, spec, update):
+        docs = self.find(spec)
+        for doc in docs:
+            self.docs[doc['_id']].update(update['$set'])
+        return FakeUpdateResult(len(docs))
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+
+class FakeUpdateResult(object):
+    def __init__(self, modified_count):
+        self.modified_count = modified_count
+
+
+class FakeDatabase(object):
+    """
+    In-memory stand-in for a pymongo database, collections are created on
+    first access.
+    """
+    def __init__(self):
+        self.collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(name)
+        return self.collections[name]
+
+
+class FakeMongoClient(object):
+    """
+    Stand-in for a MongoClient, assign it to `db._client`.
+    """
+    def __init__(self):
+        self.databases = {}
+
+    def __getitem__(self, name):
+        if name not in self.databases:
+            self.databases[name] = FakeDatabase()
+        return self.databases[name]
+
+
+class FakeKey(object):
+    """
+    Stand-in for a boto S3 key.
+    """
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.key = name
+        self.etag = None
+        self.content = None
+
+    def set_contents_from_string(self, content, headers=None, policy=None,
+                                 md5=None):
+        self.bucket.uploads.append(self.key)
+        if self.bucket.latency:
+            sleep(self.bucket.latency)
+        self.content = content
+        self.etag = '"%s"' % (md5[0] if md5 else hashlib.md5(content).hexdigest())
+        self.bucket.keys[self.key] = self
+
+
+class FakeBucket(object):
+    """
+    In-memory stand-in for a boto S3 bucket. `latency` seconds are spent
+    on every upload.
+    """
+    def __init__(self, name='fake-bucket', latency=0):
+        self.name = name
+        self.latency = latency
+        self.keys = {}
+        self.uploads = []
+
+    def get_key(self, name):
+        return self.keys.get(name)
+
+    def new_key(self, name):
+        return FakeKey(self, name)
+
+
+class FakeHTTPResponse(object):
+    """
+    Mimics the parts of a requests response that we rely on.
+    """
+    def __init__(self, status_code=200, content='', json_data=None,
+                 headers=None):
+        self.status_code = status_code
+        self.content = content
+        self._json = json_data
+        self.headers = headers or {}
+
+    def json(self):
+        return self._json
+
+    def close(self):
+        pass
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPError('%s error' % self.status_code)
+
+
+class FakeHTTP(object):
+    """
+    Stand-in for the `requests` module as used by the shortcodes: serves
+    generated images for any image url and oEmbed payloads for tweets.
+    `latency` seconds are spent on every request, which all fail with
+    `status_code` unless it is 200. Images have the md5 of
+    their content as ETag, like S3 objects, and honour If-None-Match.
+    """
+    def __init__(self, latency=0, image_size=(640, 480), status_code=200):
+        self.latency = latency
+        self.status_code = status_code
+        self.requests = []
+        image = Image.new('RGB', image_size, (200, 200, 200))
+        buf = StringIO()
+        image.save(buf, 'JPEG')
+        self.image = buf.getvalue()
+        self.etag = '"%s"' % hashlib.md5(self.image).hexdigest()
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        self.requests.append((url, params))
+        if self.latency:
+            sleep(self.latency)
+        if self.status_code != 200:
+            return FakeHTTPResponse(status_code=self.status_code)
+        if 'oembed' in url:
+            tweet_id = dict(params or ())['id']
+            return FakeHTTPResponse(json_data={
+                'html': '<blockquote class="twitter-tweet"><p>Tweet %s '
+                        '<a href="https://t.co/%s">pic.twitter.com/%s</a>'
+                        '</p></blockquote>' % (tweet_id, tweet_id, tweet_id)
+            })
+        if (headers or {}).get('If-None-Match') == self.etag:
+            return FakeHTTPResponse(status_code=304,
+                                    headers={'ETag': self.etag})
+        return FakeHTTPResponse(content=self.image,
+                                headers={'ETag': self.etag})
+
+
+class FakeServices(object):
+    """
+    Points the process wide cache and HTTP client at `cache` and `http`,
+    by default a cache on a FakeMongoClient and a FakeHTTP, and sets
+    whether shortcodes are resolved in the background, until `stop` is
+    called. Can also be used as a context manager.
+    """
+    def __init__(self, cache=None, http=None, resolve_async=False):
+        self.cache = cache
+        self.http = http
+        self.resolve_async = resolve_async
+        self.saved = None
+
+    def start(self):
+        self.saved = (cache._cache, http_client._client,
+                      app_config.SHORTCODE_RESOLVE_ASYNC)
+        if self.cache is None:
+            self.cache = cache.MongoCache(FakeMongoClient()['liveblog'])
+        if self.http is None:
+            self.http = FakeHTTP()
+        cache._cache = self.cache
+        http_client._client = self.http
+        app_config.SHORTCODE_RESOLVE_ASYNC = self.resolve_async
+        return self
+
+    def stop(self):
+        (cache._cache, http_client._client,
+         app_config.SHORTCODE_RESOLVE_ASYNC) = self.saved
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import base64
+from collections import namedtuple, OrderedDict
 import copy
 from fnmatch import fnmatch
 import hashlib
@@ -16,6 +18,57 @@ logging.basicConfig(format=app_config.LOG_FORMAT)
 logger = logging.getLogger(__name__)
 logger.setLevel(app_config.LOG_LEVEL)
 
+Artifact = namedtuple('Artifact', ['path', 'content', 'md5', 'b64md5'])
+
+
+class ArtifactCollection(object):
+    """
+    In-memory collection of rendered files, keyed by their path relative
+    to the deploy folder. The md5 of each file is computed once, when
+    it is added, and reused by the publisher.
+    """
+    def __init__(self):
+        self._artifacts = OrderedDict()
+
+    def add(self, path, content):
+        """
+        Add rendered bytes under `path`, replacing any previous version.
+        """
+        path = path.lstrip('/')
+        digest = hashlib.md5(content)
+        self._artifacts[path] = Artifact(path, content,
+                                         digest.hexdigest(),
+                                         base64.b64encode(digest.digest()))
+
+    def __getitem__(self, path):
+        return self._artifacts[path.lstrip('/')]
+
+    def __contains__(self, path):
+        return path.lstrip('/') in self._artifacts
+
+    def __iter__(self):
+        return iter(self._artifacts.values())
+
+    def __len__(self):
+        return len(self._artifacts)
+
+    @property
+    def total_bytes(self):
+        return sum(len(a.content) for a in self)
+
+    def mirror(self, folder):
+        """
+        Write every artifact below `folder`. Only used for debugging,
+        the publisher never reads these files back.
+        """
+        for artifact in self:
+            filename = os.path.join(folder, artifact.path)
+            dirname = os.path.dirname(filename)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            with open(filename, 'wb') as f:
+                f.write(artifact.content)
+
 
 def deploy_file(bucket, src, dst, headers={}, public=True):
     """
@@ -53,6 +106,64 @@ def deploy_file(bucket, src, dst, headers={}, public=True):
         k.set_contents_from_filename(src, file_headers, policy=policy)
 
 
+def deploy_artifact(bucket, artifact, dst, headers={}, public=True):
+    """
+    Deploy a single in-memory artifact to S3, if the remote version is
+    different.
+    """
+    k = bucket.get_key(dst)
+    s3_md5 = None
+
+    if k:
+        s3_md5 = k.etag.strip('"')
+    else:
+        k = bucket.new_key(dst)
+
+    file_headers = copy.copy(headers)
+
+    if 'Content-Type' not in headers:
+        file_headers['Content-Type'] = mimetypes.guess_type(artifact.path)[0]
+
+    # Define policy
+    if public:
+        policy = 'public-read'
+    else:
+        policy = 'private'
+
+    if artifact.md5 == s3_md5:
+        logger.info('Skipping %s (has not changed)' % artifact.path)
+        return False
+    else:
+        logger.info('Uploading %s --> %s' % (artifact.path, dst))
+        k.set_contents_from_string(artifact.content, file_headers,
+                                   policy=policy,
+                                   md5=(artifact.md5, artifact.b64md5))
+        return True
+
+
+def deploy_artifacts(bucket_name, artifacts, dst, headers={}, bucket=None):
+    """
+    Deploy an ArtifactCollection to S3, checking each file to see if it
+    has changed. Returns the list of uploaded artifacts.
+
+    Pass an already connected `bucket` to reuse its connection.
+    """
+    if bucket_name == app_config.STAGING_S3_BUCKET:
+        public = False
+    else:
+        public = True
+    if bucket is None:
+        bucket = utils.get_bucket(bucket_name)
+    logger.info(dst)
+    uploaded = []
+    for artifact in artifacts:
+        dst_path = os.path.join(dst, artifact.path)
+        if deploy_artifact(bucket, artifact, dst_path, headers,
+                           public=public):
+            uploaded.append(artifact)
+    return uploaded
+
+
 def deploy_folder(bucket_name, src, dst, headers={}, ignore=[]):
     """
     Deploy a folder to S3, checking each file to see if it has changed.
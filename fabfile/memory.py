@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+"""
+Memory accounting for the long running deploy daemon.
+
+Every cycle records the process RSS (and, when tracemalloc is tracing,
+the traced allocations) in the gauges of its CycleStats. Once RSS goes
+over DAEMON_RSS_SOFT_LIMIT the daemon re-executes itself between
+cycles, picking up where it left off from the engine state snapshot,
+unless it already did within DAEMON_MIN_UPTIME.
+"""
+
+from collections import Counter
+from time import time
+import fcntl
+import gc
+import logging
+import os
+import resource
+import sys
+
+from bs4.element import NavigableString, Tag
+
+import app_config
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+
+def get_rss():
+    """
+    Current resident set size of the process in bytes. Falls back to the
+    peak RSS where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize()
+    except (IOError, IndexError, ValueError):
+        # ru_maxrss is in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def close_on_exec():
+    """
+    Mark every open descriptor but the standard streams close-on-exec,
+    so that the sockets and files that were not closed do not leak into
+    the process replacing this one.
+    """
+    try:
+        fds = [int(fd) for fd in os.listdir('/proc/self/fd')]
+    except OSError:
+        return
+    for fd in fds:
+        if fd <= 2:
+            continue
+        try:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+        except (IOError, OSError):
+            # Closed meanwhile, like the one listdir used
+            pass
+
+
+def count_soup_nodes():
+    """
+    Count the live BeautifulSoup tags and strings. This walks every object
+    tracked by the garbage collector, so it is only done now and then.
+    """
+    counts = Counter()
+    for obj in gc.get_objects():
+        if isinstance(obj, Tag):
+            counts['soup_tags'] += 1
+        elif isinstance(obj, NavigableString):
+            counts['soup_strings'] += 1
+    return counts
+
+
+class MemoryGuard(object):
+    """
+    Samples the memory use after every cycle and decides when the daemon
+    should restart itself.
+    """
+    def __init__(self, soft_limit=None,
+                 soup_count_cycles=app_config.DAEMON_SOUP_COUNT_CYCLES):
+        self.soft_limit = soft_limit or app_config.DAEMON_RSS_SOFT_LIMIT
+        self.soup_count_cycles = soup_count_cycles
+        self.samples = 0
+        self.refused_restart = False
+        self.rss = get_rss()
+        self.traced = self._get_traced()
+
+    def _get_traced(self):
+        if tracemalloc is None or not tracemalloc.is_tracing():
+            return None
+        return tracemalloc.get_traced_memory()[0]
+
+    def sample(self, stats):
+        """
+        Record the memory use at the end of the cycle of `stats`.
+        """
+        self.samples += 1
+        rss = get_rss()
+        stats.gauges['rss_bytes'] = rss
+        stats.gauges['rss_delta_bytes'] = rss - self.rss
+        self.rss = rss
+        traced = self._get_traced()
+        if traced is not None:
+            stats.gauges['traced_bytes'] = traced
+            stats.gauges['traced_delta_bytes'] = traced - (self.traced or 0)
+        self.traced = traced
+        if (self.soup_count_cycles and
+                self.samples % self.soup_count_cycles == 0):
+            stats.gauges.update(count_soup_nodes())
+
+    @property
+    def over_limit(self):
+        return bool(self.soft_limit) and self.rss > self.soft_limit
+
+    def should_restart(self, last_restart=None):
+        """
+        True when RSS is over the soft limit and the daemon did not restart
+        itself, at `last_restart`, within DAEMON_MIN_UPTIME.
+        """
+        if not self.over_limit:
+            return False
+        uptime = None if last_restart is None else time() - last_restart
+        if uptime is not None and uptime < app_config.DAEMON_MIN_UPTIME:
+            if not self.refused_restart:
+                logger.error('RSS of %.1fMB is over the %.1fMB soft limit %.0fs after the last restart, not restarting within %ss' % (
+                             self.rss / 1048576.0, self.soft_limit / 1048576.0,
+                             uptime, app_config.DAEMON_MIN_UPTIME))
+                self.refused_restart = True
+            return False
+        return True
+
+    def restart(self):
+        """
+        Replace the current process with a fresh copy of itself, keeping
+        its pid so that upstart does not notice.
+        """
+        logger.warning('RSS of %.1fMB is over the %.1fMB soft limit, restarting' % (
+                       self.rss / 1048576.0, self.soft_limit / 1048576.0))
+        for stream in (sys.stdout, sys.stderr):
+            stream.flush()
+        close_on_exec()
+        os.execv(sys.executable, [sys.executable] + sys.argv)
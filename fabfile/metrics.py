@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+"""
+Per cycle measurements for the deploy daemon.
+"""
+
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from time import time
+import json
+import logging
+import os
+import threading
+
+import app_config
+from stats_utils import percentile
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+# Stages timed inside another stage, by the stage containing them. They
+# are exported apart so that adding up the stages does not count them twice
+NESTED_STAGES = {
+    'prescan': 'parse',
+    'shortcodes': 'parse',
+}
+
+
+class CycleStats(object):
+    """
+    Stage timings and counts of a single daemon cycle, from fetching the
+    doc until its upload finished (or it was found to be unchanged).
+    """
+    def __init__(self):
+        self.started = time()
+        self.finished = None
+        self.stages = OrderedDict()
+        self.counts = Counter()
+        # Levels sampled during the cycle, like the memory use, which
+        # unlike the counts do not add up across cycles
+        self.gauges = {}
+        self.outcome = None
+        # Slugs of the published posts in the version built this cycle
+        self.published_slugs = []
+        # CycleProfiler when this cycle is being profiled
+        self.profiler = None
+        # Edit-to-live latencies of the posts that went live this cycle
+        self.latencies = []
+        # Errors of the posts that could not be parsed, by slug
+        self.post_errors = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the enclosed block as stage `name`.
+        """
+        start = time()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0) + time() - start
+
+    def finish(self, outcome):
+        self.finished = time()
+        self.outcome = outcome
+
+    @property
+    def duration(self):
+        return (self.finished or time()) - self.started
+
+    @property
+    def slowest_stage(self):
+        """
+        Returns the (name, seconds) of the slowest stage.
+        """
+        if not self.stages:
+            return None, 0
+        return max(self.stages.items(), key=lambda item: item[1])
+
+
+def mark_posts_live(cache, slugs, since):
+    """
+    Record, in the timestamps cache, when the upload containing the given
+    published posts finished. Only posts first published after `since`
+    (the daemon start) are tracked, older ones were live before we were
+    watching. Returns the edit-to-live latencies, in seconds, of the posts
+    marked and the slugs that need no further tracking: marked now,
+    already live or too old.
+    """
+    latencies = []
+    settled = []
+    now = datetime.utcnow()
+    for slug in slugs:
+        result = cache.get('timestamps', slug)
+        if result is None:
+            continue
+        if result['timestamp'] >= since and 'live' not in result:
+            result['live'] = now
+            result['event'] = app_config.CURRENT_LIVEBLOG
+            cache.set('timestamps', slug, result)
+            latencies.append((now - result['timestamp']).total_seconds())
+        settled.append(slug)
+    return latencies, settled
+
+
+def get_latencies(cache, event=None):
+    """
+    Edit-to-live latencies, in seconds, of the posts of an event:
+    from the moment a post was first seen as published until the upload
+    containing it finished. Reads the whole timestamps table.
+    """
+    event = event or app_config.CURRENT_LIVEBLOG
+    latencies = []
+    for result in cache.values('timestamps'):
+        if result.get('event') != event or 'live' not in result:
+            continue
+        delta = result['live'] - result['timestamp']
+        latencies.append(delta.total_seconds())
+    return latencies
+
+
+def summarize_latencies(latencies):
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'sum': sum(latencies),
+        'p50': percentile(latencies, 0.5),
+        'p95': percentile(latencies, 0.95),
+        'max': latencies[-1] if latencies else None,
+    }
+
+
+def get_latency_summary(cache, event=None):
+    return summarize_latencies(get_latencies(cache, event))
+
+
+class MetricsExporter(object):
+    """
+    Exports finished cycles as an append-only JSON lines log and as a
+    Prometheus textfile (for the node_exporter textfile collector),
+    both under SERVER_LOG_PATH.
+    """
+    def __init__(self, log_dir=None):
+        log_dir = log_dir or app_config.SERVER_LOG_PATH
+        self.json_log_path = os.path.join(log_dir,
+                                          app_config.DAEMON_METRICS_LOG)
+        self.textfile_path = os.path.join(log_dir,
+                                          app_config.DAEMON_METRICS_TEXTFILE)
+        self.stage_totals = Counter()
+        self.count_totals = Counter()
+        self.latency = None
+        self._lock = threading.Lock()
+
+    def export(self, stats, events, latency=None, cache_stats=None,
+               http_stats=None):
+        """
+        Export a finished CycleStats. `events` are the daemon's cumulative
+        event counters (cycles, deploys, skips...), `latency` the
+        current edit-to-live summary, if any, `cache_stats` the
+        cumulative usage of the in-process caches by table and
+        `http_stats` that of the HTTP client by host.
+        """
+        with self._lock:
+            self.stage_totals.update(stats.stages)
+            self.count_totals.update(stats.counts)
+            if latency is not None:
+                self.latency = latency
+            try:
+                self._write_json_log(stats, latency, cache_stats, http_stats)
+                self._write_textfile(stats, events, cache_stats or {},
+                                     http_stats or {})
+            except (IOError, OSError), e:
+                logger.error('Could not export cycle metrics: %s' % e)
+
+    def _write_json_log(self, stats, latency, cache_stats, http_stats):
+        record = {
+            'time': datetime.utcfromtimestamp(stats.started).isoformat() + 'Z',
+            'outcome': stats.outcome,
+            'duration': round(stats.duration, 4),
+            'stages': dict((k, round(v, 4)) for k, v in stats.stages.items()),
+            'counts': dict(stats.counts),
+        }
+        if stats.gauges:
+            record['gauges'] = stats.gauges
+        if latency is not None:
+            record['latency'] = latency
+        if stats.post_errors:
+            record['post_errors'] = stats.post_errors
+        if cache_stats:
+            record['cache'] = cache_stats
+        if http_stats:
+            record['http'] = http_stats
+        with open(self.json_log_path, 'a') as f:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def _write_textfile(self, stats, events, cache_stats, http_stats):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in samples:
+                # repr keeps the full precision of floats
+                if isinstance(value, float):
+                    value = repr(value)
+                lines.append('%s%s %s' % (name, labels, value))
+
+        metric('liveblog_cycle_duration_seconds', 'gauge',
+               'Duration of the last daemon cycle.',
+               [('', stats.duration)])
+        metric('liveblog_cycle_timestamp_seconds', 'gauge',
+               'Time the last daemon cycle finished.',
+               [('', stats.finished or time())])
+        stages, substages = _split_stages(stats.stages.items())
+        metric('liveblog_cycle_stage_seconds', 'gauge',
+               'Duration of each stage of the last daemon cycle.',
+               stages)
+        metric('liveblog_cycle_substage_seconds', 'gauge',
+               'Duration of the parts of a stage timed on their own in the '
+               'last daemon cycle, included in their parent stage.',
+               substages)
+        metric('liveblog_cycle_count', 'gauge',
+               'Counts of the last daemon cycle.',
+               [('{name="%s"}' % k, v) for k, v in sorted(stats.counts.items())])
+        metric('liveblog_cycle_gauge', 'gauge',
+               'Levels sampled at the end of the last daemon cycle.',
+               [('{name="%s"}' % k, v) for k, v in sorted(stats.gauges.items())])
+        stages, substages = _split_stages(sorted(self.stage_totals.items()))
+        metric('liveblog_stage_seconds_total', 'counter',
+               'Total time spent in each stage.',
+               stages)
+        metric('liveblog_substage_seconds_total', 'counter',
+               'Total time spent in the parts of a stage timed on their '
+               'own, included in their parent stage.',
+               substages)
+        metric('liveblog_count_total', 'counter',
+               'Totals of the per cycle counts.',
+               [('{name="%s"}' % k, v)
+                for k, v in sorted(self.count_totals.items())])
+        metric('liveblog_daemon_events_total', 'counter',
+               'Daemon events (cycles, deploys, skips, overruns...).',
+               [('{event="%s"}' % k, v) for k, v in sorted(events.items())])
+
+        if cache_stats:
+            metric('liveblog_cache_total', 'counter',
+                   'In-process cache hits, misses, expired and evicted '
+                   'entries.',
+                   [('{table="%s",result="%s"}' % (table, result), value)
+                    for table, counts in sorted(cache_stats.items())
+                    for result, value in sorted(counts.items())])
+
+        if http_stats:
+            hosts = sorted(http_stats.items())
+            metric('liveblog_http_requests_total', 'counter',
+                   'Outbound HTTP requests, errors and retries by host.',
+                   [('{host="%s",result="%s"}' % (host, result),
+                     counts.get(result, 0))
+                    for host, counts in hosts
+                    for result in ['requests', 'errors', 'retries']])
+            metric('liveblog_http_request_seconds', 'summary',
+                   'Latency of the recent outbound HTTP requests by host.',
+                   [('{host="%s",quantile="%s"}' % (host, quantile),
+                     counts[key])
+                    for host, counts in hosts
+                    for quantile, key in [('0.5', 'p50'), ('0.95', 'p95'),
+                                          ('1', 'max')]] +
+                   [('_sum{host="%s"}' % host, counts['seconds'])
+                    for host, counts in hosts] +
+                   [('_count{host="%s"}' % host, counts['requests'])
+                    for host, counts in hosts])
+
+        if self.latency and self.latency['count']:
+            metric('liveblog_edit_to_live_seconds', 'summary',
+                   'Time from a post being first seen as published until '
+                   'the upload containing it finished.',
+                   [('{quantile="0.5"}', self.latency['p50']),
+                    ('{quantile="0.95"}', self.latency['p95']),
+                    ('{quantile="1"}', self.latency['max']),
+                    ('_sum', self.latency['sum']),
+                    ('_count', self.latency['count'])])
+
+        # Write then rename so the collector never reads a partial file
+        tmp_path = '%s.tmp' % self.textfile_path
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.rename(tmp_path, self.textfile_path)
+
+
+def _split_stages(items):
+    """
+    Split (stage, seconds) items into the samples of the top level stages
+    and those of the NESTED_STAGES, labelled with their parent.
+    """
+    stages = []
+    substages = []
+    for name, seconds in items:
+        if name in NESTED_STAGES:
+            substages.append(('{stage="%s",parent="%s"}' % (
+                name, NESTED_STAGES[name]), seconds))
+        else:
+            stages.append(('{stage="%s"}' % name, seconds))
+    return stages, substages
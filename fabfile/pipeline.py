@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+"""
+Pipelined publishing for the deploy daemon.
+
+Fetching, parsing/rendering and uploading run in separate stages so that
+a slow S3 upload does not hold back detecting the next edit:
+
+    fetch (scheduler) --> render worker --> upload worker
+
+Stages are connected by single slot queues that coalesce: a new version
+replaces one that has not been picked up yet, so stale work is dropped.
+Every version gets an increasing sequence number and the upload worker
+never publishes a version older than the last one it published. A failed
+upload is retried with backoff by `retry_failed`, even if the doc does
+not change anymore.
+"""
+
+from collections import namedtuple
+from itertools import count
+from time import time
+import logging
+import threading
+
+import app_config
+
+from metrics import CycleStats
+from profiling import profiled
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+Version = namedtuple('Version', ['seq', 'html', 'force', 'stats'])
+Build = namedtuple('Build', ['seq', 'digest', 'artifacts', 'stats'])
+
+
+class CoalescingQueue(object):
+    """
+    Bounded (single slot) hand-off between two stages. Putting an item
+    while the previous one is still waiting replaces it.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.dropped = 0
+        self._item = None
+        self._cond = threading.Condition()
+
+    def put(self, item, merge=None):
+        """
+        Put an item, replacing any waiting one. `merge(old, new)` can be
+        given to carry information over from the replaced item.
+        """
+        with self._cond:
+            if self._item is not None:
+                logger.info('%s: dropping stale version %s' % (
+                            self.name, self._item.seq))
+                self.dropped += 1
+                if merge:
+                    item = merge(self._item, item)
+            self._item = item
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        Waits for an item, returns None if `timeout` expires first.
+        """
+        with self._cond:
+            if self._item is None:
+                self._cond.wait(timeout)
+            item = self._item
+            self._item = None
+            return item
+
+    def __len__(self):
+        return 0 if self._item is None else 1
+
+
+class PublishPipeline(object):
+    """
+    Runs the render and upload stages of a LiveblogEngine in background
+    threads.
+
+    `on_cycle_done(stats)` is called, from the worker thread, with the
+    CycleStats of every version that was published or found unchanged.
+    """
+    def __init__(self, engine, on_cycle_done=None):
+        self.engine = engine
+        self.on_cycle_done = on_cycle_done
+        self.render_queue = CoalescingQueue('render')
+        self.upload_queue = CoalescingQueue('upload')
+        self.published_seq = 0
+        self.publish_failures = 0
+        # When the last failed upload can be retried, None if there is none
+        self.retry_at = None
+        self._seq = count(1)
+        self._threads = []
+        # Versions submitted that are not finished, dropped or skipped yet
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        for target in (self._render_worker, self._upload_worker):
+            thread = threading.Thread(target=target, name=target.__name__)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, html, force=False, stats=None):
+        """
+        Queue a new version of the liveblog html for rendering.
+        Returns its sequence number.
+        """
+        version = Version(next(self._seq), html, force, stats or CycleStats())
+        with self._lock:
+            self._active += 1
+        # A forced rebuild must survive being coalesced with a newer version
+        self.render_queue.put(version, merge=lambda old, new: self._dropped(
+            old, new._replace(force=old.force or new.force)))
+        return version.seq
+
+    @property
+    def idle(self):
+        """
+        True when no version is being rendered or uploaded.
+        """
+        return self._active == 0
+
+    def retry_failed(self, stats=None):
+        """
+        Resubmit the latest liveblog html, forcing a rebuild, when the
+        last upload failed and its retry is due. Returns the sequence
+        number of the retry, or None.
+        """
+        if (self.retry_at is None or time() < self.retry_at or
+                not self.idle or self.engine.html is None):
+            return None
+        self.retry_at = None
+        logger.info('Retrying the publish that failed %s times' % (
+                    self.publish_failures))
+        return self.submit(self.engine.html, force=True, stats=stats)
+
+    def _finished(self):
+        with self._lock:
+            self._active -= 1
+
+    def _dropped(self, old, new):
+        """
+        Merge callback of the queues. A pending profiler is carried over
+        to the version that replaces a profiled one, so that a requested
+        profile is not lost to coalescing.
+        """
+        self._finished()
+        if new.stats.profiler is None:
+            new.stats.profiler = old.stats.profiler
+        return new
+
+    def _done(self, stats, outcome):
+        self._finished()
+        stats.finish(outcome)
+        if outcome == 'error':
+            self.engine.metrics['errors'] += 1
+        if self.on_cycle_done:
+            # Failing metrics or profile writes must not stop publishing
+            try:
+                self.on_cycle_done(stats)
+            except Exception:
+                logger.exception('Could not finish the cycle metrics')
+
+    def render_one(self, version):
+        try:
+            with profiled(version.stats):
+                build = self.engine.build(version.html, version.force,
+                                          stats=version.stats)
+        except Exception:
+            logger.exception('Could not build version %s' % version.seq)
+            self._done(version.stats, 'error')
+            return
+        if build is None:
+            self._done(version.stats, 'unchanged')
+        else:
+            digest, artifacts = build
+            self.upload_queue.put(Build(version.seq, digest, artifacts,
+                                        version.stats), merge=self._dropped)
+
+    def upload_one(self, build):
+        if build.seq <= self.published_seq:
+            logger.warning('Not publishing version %s, %s is already live' % (
+                           build.seq, self.published_seq))
+            self._finished()
+            return
+        try:
+            with profiled(build.stats):
+                self.engine.publish(build.artifacts, stats=build.stats)
+        except Exception:
+            logger.exception('Could not publish version %s' % build.seq)
+            # Make sure the retry rebuilds, whether the doc changes or not
+            self.engine.last_digest = None
+            self.publish_failures += 1
+            self.retry_at = time() + min(
+                app_config.LIVEBLOG_PUBLISH_RETRY_INTERVAL *
+                2 ** (self.publish_failures - 1),
+                app_config.LIVEBLOG_PUBLISH_MAX_RETRY_INTERVAL)
+            self._done(build.stats, 'error')
+            return
+        self.published_seq = build.seq
+        self.publish_failures = 0
+        self.retry_at = None
+        self.engine.metrics['deployed'] += 1
+        self._done(build.stats, 'published')
+
+    def _render_worker(self):
+        while True:
+            version = self.render_queue.get()
+            if version is None:
+                continue
+            try:
+                self.render_one(version)
+            except Exception:
+                logger.exception('Render worker failed on version %s' % (
+                                 version.seq))
+
+    def _upload_worker(self):
+        while True:
+            build = self.upload_queue.get()
+            if build is None:
+                continue
+            try:
+                self.upload_one(build)
+            except Exception:
+                logger.exception('Upload worker failed on version %s' % (
+                                 build.seq))
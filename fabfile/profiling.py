@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+"""
+On demand profiling of a single deploy daemon cycle.
+
+The next liveblog cycle is profiled after the daemon receives SIGUSR1
+(SIGUSR2 also takes allocation snapshots), or when the
+DAEMON_PROFILE_SENTINEL file shows up in SERVER_LOG_PATH. That can be done
+with `touch`, and writing `memory` to the file also takes allocation
+snapshots. The pstats file and a text report are written next to the
+other daemon logs.
+
+Allocation snapshots need the `tracemalloc` module, which only ships with
+Python 3 or with the pytracemalloc patched Python 2. Without it only the
+cProfile report is written.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+import cProfile
+import logging
+import os
+import pstats
+import signal
+
+import app_config
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+PROFILE_TOP_FUNCTIONS = 40
+PROFILE_TOP_ALLOCATIONS = 25
+
+
+class CycleProfiler(object):
+    """
+    Profiles the stages of one cycle, which may run in different threads,
+    and writes the results to `log_dir`.
+    """
+    def __init__(self, log_dir, memory=False):
+        self.log_dir = log_dir
+        self.profile = cProfile.Profile()
+        self.memory = memory and tracemalloc is not None
+        self.snapshot = None
+        self.started_tracing = False
+        if memory and not self.memory:
+            logger.warning('tracemalloc is not available, only profiling')
+        if self.memory:
+            # Leave tracing on afterwards if someone else started it
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            self.snapshot = tracemalloc.take_snapshot()
+
+    @contextmanager
+    def stage(self):
+        """
+        Profile the enclosed block in the calling thread.
+        """
+        self.profile.enable()
+        try:
+            yield
+        finally:
+            self.profile.disable()
+
+    def dump(self, stats):
+        """
+        Write the results of the profiled cycle. Returns the base path of
+        the written files.
+        """
+        name = datetime.utcnow().strftime('profile-%Y%m%d-%H%M%S')
+        base_path = os.path.join(self.log_dir, name)
+        self.profile.dump_stats('%s.pstats' % base_path)
+        with open('%s.txt' % base_path, 'w') as f:
+            f.write('Cycle %s in %.3fs, stages: %s\n\n' % (
+                    stats.outcome, stats.duration, dict(stats.stages)))
+            report = pstats.Stats(self.profile, stream=f)
+            report.sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+            if self.memory:
+                self._write_allocations(f)
+        logger.info('Wrote cycle profile to %s.*' % base_path)
+        return base_path
+
+    def _write_allocations(self, f):
+        snapshot = tracemalloc.take_snapshot()
+        if self.started_tracing:
+            tracemalloc.stop()
+        f.write('\nTop allocation sites\n\n')
+        for stat in snapshot.statistics('lineno')[:PROFILE_TOP_ALLOCATIONS]:
+            f.write('%s\n' % stat)
+        f.write('\nTop allocation growth during the cycle\n\n')
+        diff = snapshot.compare_to(self.snapshot, 'lineno')
+        for stat in diff[:PROFILE_TOP_ALLOCATIONS]:
+            f.write('%s\n' % stat)
+
+
+class ProfileTrigger(object):
+    """
+    Tells the daemon when to profile the next cycle. When nothing is
+    requested the cost is one `os.path.exists` per cycle.
+    """
+    def __init__(self, log_dir=None):
+        self.log_dir = log_dir or app_config.SERVER_LOG_PATH
+        self.sentinel_path = os.path.join(self.log_dir,
+                                          app_config.DAEMON_PROFILE_SENTINEL)
+        self.requested = None
+
+    def install(self):
+        """
+        Install the signal handlers, must be called from the main thread.
+        """
+        signal.signal(signal.SIGUSR1, self._handle_signal)
+        signal.signal(signal.SIGUSR2, self._handle_signal)
+
+    def _handle_signal(self, signum, frame):
+        self.requested = 'memory' if signum == signal.SIGUSR2 else 'cpu'
+
+    def _check_sentinel(self):
+        if not os.path.exists(self.sentinel_path):
+            return None
+        try:
+            with open(self.sentinel_path) as f:
+                mode = f.read().strip()
+            os.remove(self.sentinel_path)
+        except (IOError, OSError), e:
+            logger.warning('Could not read profile sentinel: %s' % e)
+            return None
+        return 'memory' if mode == 'memory' else 'cpu'
+
+    def take(self):
+        """
+        Returns a CycleProfiler if profiling was requested since the last
+        call, None otherwise.
+        """
+        requested = self.requested or self._check_sentinel()
+        self.requested = None
+        if requested is None:
+            return None
+        logger.info('Profiling the next cycle (%s)' % requested)
+        return CycleProfiler(self.log_dir, memory=(requested == 'memory'))
+
+
+@contextmanager
+def profiled(stats):
+    """
+    Profile the enclosed block if the cycle of `stats` is being profiled.
+    """
+    if stats is None or stats.profiler is None:
+        yield
+    else:
+        with stats.profiler.stage():
+            yield
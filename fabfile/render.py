@@ -14,11 +14,14 @@ from fabric.api import local, task
 
 import app
 import app_config
+import flat
 
 logging.basicConfig(format=app_config.LOG_FORMAT)
 logger = logging.getLogger(__name__)
 logger.setLevel(app_config.LOG_LEVEL)
 
+LIVEBLOG_VIEWS = ['_liveblog', '_preview', '_share', '_sharecard']
+
 
 def _fake_context(path):
     """
@@ -179,13 +182,17 @@ def render_copydoc():
         f.write(response.data.decode('utf-8'))
 
 
-def generate_views(views, parsed_liveblog):
+def generate_views(views, parsed_liveblog, mirror_path=None, copy=None):
+    """
+    Render the liveblog views into an in-memory ArtifactCollection.
+
+    If `mirror_path` is given the rendered files are also written to
+    that folder, for debugging purposes only. An already loaded
+    copytext `copy` can be passed to avoid reading it for every view.
+    """
     from flask import url_for, g
 
-    try:
-        os.makedirs('.liveblog/')
-    except OSError:
-        pass
+    artifacts = flat.ArtifactCollection()
 
     for view_name in views:
         logger.info("Generating view for {}".format(view_name))
@@ -200,32 +207,26 @@ def generate_views(views, parsed_liveblog):
 
                 with app.app.test_request_context():
                     path = url_for(view_name, slug=slug)
-                    # If this view type requires a subdirectory, then create one
-                    dirname = ".liveblog" + os.path.dirname(path)
-                    try:
-                        #logger.info("Creating directory: " + dirname)
-                        os.makedirs(dirname)
-                    except OSError:
-                        pass
-                    # for existing in os.listdir(dirname):
-                    #     filename = os.path.join(dirname, existing)
-                    #     logger.info("Existing file: " + filename)
-                    #     if os.path.isfile(filename):
-                    #         os.unlink(filename)
 
                 with _fake_context(path):
                     g.parsed_liveblog = parsed_liveblog
+                    g.copy = copy
                     response = view(slug)
-                    with codecs.open('.liveblog/{0}'.format(path), 'w', 'utf-8') as f:
-                        f.write(response.data.decode('utf-8'))
+                    # NB: Flask response object has utf-8 encoded the data
+                    artifacts.add(path, response.data)
         else:
             with app.app.test_request_context():
                 path = url_for(view_name)
             with _fake_context(path):
                 g.parsed_liveblog = parsed_liveblog
+                g.copy = copy
                 response = view()
-                with codecs.open('.liveblog/{0}'.format(path), 'w', 'utf-8') as f:
-                    f.write(response.data.decode('utf-8'))
+                artifacts.add(path, response.data)
+
+    if mirror_path:
+        artifacts.mirror(mirror_path)
+
+    return artifacts
 
 
 def parse_liveblog():
@@ -236,7 +237,10 @@ def parse_liveblog():
 
 
 @task
-def render_liveblog():
+def render_liveblog(mirror_path=app_config.LIVEBLOG_MIRROR_PATH):
+    """
+    Render the liveblog views, returns an ArtifactCollection.
+    """
     parsed_liveblog = parse_liveblog()
-    generate_views(['_liveblog', '_preview', '_share', '_sharecard'],
-                   parsed_liveblog)
+    return generate_views(LIVEBLOG_VIEWS, parsed_liveblog,
+                          mirror_path=mirror_path)
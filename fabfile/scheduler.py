@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+"""
+Minimal interval scheduler used by the deploy daemon.
+"""
+
+from time import sleep, time
+import logging
+
+import app_config
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+
+class Job(object):
+    """
+    A function run every `interval` seconds.
+
+    The interval of adaptive jobs can move between `min_interval` and
+    `max_interval`, see `adapt`.
+    """
+    def __init__(self, name, interval, func, min_interval=None,
+                 max_interval=None, backoff=1):
+        self.name = name
+        self.interval = interval
+        self.min_interval = min_interval or interval
+        self.max_interval = max_interval or interval
+        self.backoff = backoff
+        self.func = func
+        self.next_run = 0
+        self.runs = 0
+        self.failures = 0
+        self.last_duration = None
+
+    def is_due(self, now):
+        return now >= self.next_run
+
+    def adapt(self, active, floor=0):
+        """
+        Poll at the minimum interval while `active`, otherwise back off.
+        The interval never drops below `floor`, typically the duration
+        of recent cycles, so that we do not poll faster than we publish.
+        """
+        if active:
+            interval = self.min_interval
+        else:
+            interval = min(self.max_interval, self.interval * self.backoff)
+        self.interval = max(interval, floor)
+
+    def run(self):
+        start = time()
+        try:
+            return self.func()
+        finally:
+            self.runs += 1
+            end = time()
+            self.last_duration = end - start
+            if self.last_duration > self.interval:
+                logger.warning('%s took %.2fs, longer than its %.2fs interval' % (
+                               self.name, self.last_duration, self.interval))
+            # Schedule from the start of the run to keep a steady cadence
+            # but always leave some slack after an overrun
+            self.next_run = max(start + self.interval,
+                                end + app_config.DAEMON_MIN_SLACK)
+
+
+class Scheduler(object):
+    """
+    Runs each registered job on its own interval. Jobs that are due at
+    the same time run in the order they were added.
+    """
+    def __init__(self):
+        self.jobs = []
+
+    def add(self, name, interval, func, **kwargs):
+        job = Job(name, interval, func, **kwargs)
+        self.jobs.append(job)
+        return job
+
+    def run_pending(self):
+        """
+        Run the due jobs. A failing job is logged and runs again at its
+        next interval, it does not stop the other jobs.
+        """
+        for job in self.jobs:
+            if job.is_due(time()):
+                logger.debug('Running %s' % job.name)
+                try:
+                    job.run()
+                except Exception:
+                    job.failures += 1
+                    logger.exception('%s failed' % job.name)
+
+    def idle_time(self):
+        """
+        Seconds until the next job is due.
+        """
+        if not self.jobs:
+            return 0
+        return max(0, min(job.next_run for job in self.jobs) - time())
+
+    def run_forever(self):
+        while True:
+            self.run_pending()
+            sleep(self.idle_time())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+"""
+Synthetic liveblog documents for tests and benchmarks.
+
+`generate_liveblog` produces html shaped like the Google Doc export that
+CopyDoc and parse_doc expect: a pinned post followed by posts delimited
+by the `+++` and `---` markers, each with a headline, front matter
+and contents mixing plain paragraphs and shortcodes.
+"""
+
+from random import Random
+
+from openpyxl import Workbook
+
+POST_START = '+' * 60
+POST_END = '-' * 60
+
+# Relative weight of each kind of paragraph in the posts
+DEFAULT_MIX = {
+    'text': 12,
+    'internal_link': 2,
+    'image': 3,
+    'tweet': 2,
+    'youtube': 1,
+}
+
+LOREM = (u'Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do '
+         u'eiusmod tempor incididunt ut labore et dolore magna aliqua. '
+         u'Ut enim ad minim veniam, quis nostrud exercitation ullamco.')
+
+
+def generate_authors(num_authors=8):
+    """
+    Returns an authors dictionary as built by `parse_doc.getAuthorsData`.
+    """
+    authors = {}
+    for i in range(num_authors):
+        initials = 'A%02d' % i
+        authors[initials] = {
+            'initials': initials,
+            'name': 'Author %s' % i,
+            'role': 'Reporter',
+            'page': 'http://www.npr.org/people/%s' % i,
+            'img': '',
+        }
+    return authors
+
+
+def generate_copy(path):
+    """
+    Writes a copy spreadsheet with the keys used by the liveblog templates.
+    """
+    workbook = Workbook()
+    sheets = {
+        'content': ['project_name', 'header_title', 'livestream',
+                    'livestream_text'],
+        'share': ['share_url', 'facebook_title', 'facebook_text',
+                  'facebook_image_url', 'facebook_app_id', 'twitter_handle',
+                  'twitter_image_url', 'meta_description',
+                  'google_news_image_url'],
+    }
+    for i, (name, keys) in enumerate(sorted(sheets.items())):
+        sheet = workbook.active if i == 0 else workbook.create_sheet()
+        sheet.title = name
+        sheet.append(['key', 'value'])
+        for key in keys:
+            sheet.append([key, 'Synthetic %s' % key])
+    workbook.save(path)
+
+
+def _paragraph(text):
+    return u'<p class="c1"><span class="c0">%s</span></p>' % text
+
+
+def _contents(rng, index, mix, paragraphs):
+    kinds = []
+    for kind, weight in sorted(mix.items()):
+        kinds.extend([kind] * weight)
+    html = []
+    for i in range(paragraphs):
+        kind = rng.choice(kinds)
+        embed_id = rng.randint(0, 10 ** 6)
+        if kind == 'image':
+            html.append(_paragraph(
+                u'[%% image photo-%s.jpg caption="Caption %s" '
+                u'credit="Credit %s" %%]' % (embed_id, index, index)))
+        elif kind == 'tweet':
+            html.append(_paragraph(
+                u'[%% tweet https://twitter.com/npr/status/%s %%]' % embed_id))
+        elif kind == 'youtube':
+            html.append(_paragraph(
+                u'[%% youtube https://www.youtube.com/embed/v%s '
+                u'youtube_start_time="0" %%]' % embed_id))
+        elif kind == 'internal_link':
+            html.append(_paragraph(
+                u'%s [%% internal_link post-%s link_text="Earlier" %%] %s' % (
+                    LOREM[:60], rng.randint(0, index), LOREM[60:])))
+        else:
+            html.append(_paragraph(LOREM))
+    return html
+
+
+def _post(headline, metadata, contents):
+    html = [_paragraph(POST_START), u'<h1>%s</h1>' % headline,
+            _paragraph(u'---')]
+    html.extend(_paragraph(u'%s: %s' % item) for item in metadata)
+    html.append(_paragraph(u'---'))
+    html.extend(contents)
+    html.append(_paragraph(POST_END))
+    return html
+
+
+def generate_liveblog(num_posts, mix=None, paragraphs=4, authors=None,
+                      drafts=0.1, seed=0):
+    """
+    Generate the html of a liveblog doc with a pinned post and
+    `num_posts` posts, a `drafts` fraction of which is not published.
+    `mix` weights the kinds of paragraphs, see DEFAULT_MIX.
+    """
+    rng = Random(seed)
+    mix = mix or DEFAULT_MIX
+    initials = sorted(authors or generate_authors())
+    html = [u'<html><head><meta content="text/html; charset=UTF-8" '
+            u'http-equiv="content-type"></head><body>',
+            _paragraph(u'Instructions and notes are ignored')]
+    html.extend(_post(u'Pinned headline', [
+        (u'Slug', u'pinned-post'),
+        (u'Pinned', u'yes'),
+        (u'Published mode', u'yes'),
+    ], [_paragraph(LOREM)]))
+    for i in range(num_posts):
+        byline = u', '.join(u'Author %s (%s)' % (key[1:], key)
+                            for key in rng.sample(initials, 2))
+        published = u'no' if rng.random() < drafts else u'yes'
+        html.extend(_post(u'Headline of post %s' % i, [
+            (u'Slug', u'post-%s' % i),
+            (u'Published', published),
+            (u'Authors', byline),
+        ], _contents(rng, i, mix, paragraphs)))
+    html.append(u'</body></html>')
+    return u''.join(html)
@@ -6,14 +6,19 @@ Commands related to syncing copytext from Google Docs.
 
 import app_config
 import logging
+import os
 
 from fabric.api import task
-from oauth import get_document, get_credentials, get_doc, get_doc_as_text
+from oauth import get_document, get_credentials, get_doc, get_doc_as_text, get_doc_revision
+from utils import prep_bool_arg
 
 logging.basicConfig(format=app_config.LOG_FORMAT)
 logger = logging.getLogger(__name__)
 logger.setLevel(app_config.LOG_LEVEL)
 
+# Revision of the last downloaded liveblog doc, see get_liveblog()
+LIVEBLOG_REVISION = None
+
 
 @task(default=True)
 def update():
@@ -35,8 +40,27 @@ def update():
 
 
 @task
-def get_liveblog():
+def get_liveblog(force=False):
+    """
+    Downloads the liveblog Google Doc as HTML if it has changed.
+
+    Checks the Drive revision metadata first and skips the export if the
+    doc has not been modified since the last download.
+    Returns True if a new version was downloaded.
+    """
+    global LIVEBLOG_REVISION
+
     gdoc = app_config.LIVEBLOG_GDOC_KEY
     path = app_config.LIVEBLOG_HTML_PATH
-    if gdoc:
-        get_doc(gdoc, path)
+    if not gdoc:
+        return False
+
+    revision = get_doc_revision(gdoc)
+    if (not prep_bool_arg(force) and revision == LIVEBLOG_REVISION and
+            os.path.exists(path)):
+        logger.debug('liveblog doc unchanged (revision %s)' % revision)
+        return False
+
+    get_doc(gdoc, path)
+    LIVEBLOG_REVISION = revision
+    return True
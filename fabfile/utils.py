@@ -7,12 +7,12 @@ import boto
 import json
 import webbrowser
 import logging
-import requests
 
 from distutils.util import strtobool
 from distutils.spawn import find_executable
 from boto.s3.connection import OrdinaryCallingFormat
 from fabric.api import local, task, prompt
+from http_client import get_client
 from oauth import get_credentials
 from StringIO import StringIO
 from time import sleep
@@ -62,7 +62,7 @@ def get_fontello_session_id():
     fontello_config_path = os.path.join('fontello', 'config.json')
 
     with open(fontello_config_path) as fontello_config:
-        fontello_session_id = requests.post(
+        fontello_session_id = get_client().post(
             FONTELLO_HOST,
             files={'config': fontello_config}
         ).content
@@ -83,14 +83,14 @@ def install_font(force=True):
         if not os.path.exists(directory_path):
             os.makedirs(directory_path)
 
-    if force or \
+    if prep_bool_arg(force) or \
             len(os.listdir(CSS_DIR)) == 0 or \
             len(os.listdir(FONT_DIR)) == 0:
         logger.info('Installing font')
 
         fontello_session_id = get_fontello_session_id()
         zip_url = '{}/{}/get'.format(FONTELLO_HOST, fontello_session_id)
-        zip_stream = requests.get(zip_url).content
+        zip_stream = get_client().get(zip_url).content
         zipfile = ZipFile(StringIO(zip_stream))
 
         for filepath in zipfile.namelist():
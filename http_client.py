@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+"""
+Shared HTTP client for the outbound requests of the project.
+
+One requests Session keeps connections to each host alive in a pool.
+Every request has connect and read timeouts, idempotent requests are
+retried with jittered exponential backoff on connection errors and on
+statuses meaning the server is overloaded, and the latency of the
+requests is tracked per host.
+"""
+
+from collections import Counter, deque
+from random import uniform
+from time import sleep
+from timeit import default_timer
+from urlparse import urlparse
+import logging
+import threading
+
+from requests import ConnectionError, RequestException, Session, Timeout
+from requests.adapters import HTTPAdapter
+
+import app_config
+from stats_utils import percentile
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+# Statuses worth retrying
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+# Latencies kept per host for the percentiles
+LATENCY_WINDOW = 500
+
+_client = None
+
+
+class HTTPClient(object):
+    """
+    Pooled requests session with timeouts, retries and per host stats.
+    """
+    def __init__(self, timeout=None, retries=None, backoff=None,
+                 pool_size=None):
+        self.timeout = timeout or (app_config.HTTP_CONNECT_TIMEOUT,
+                                   app_config.HTTP_READ_TIMEOUT)
+        self.retries = app_config.HTTP_RETRIES if retries is None else retries
+        self.backoff = app_config.HTTP_BACKOFF if backoff is None else backoff
+        pool_size = pool_size or app_config.HTTP_POOL_SIZE
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._counts = {}
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        """
+        Close the pooled connections.
+        """
+        self.session.close()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """
+        POST `url`. Not retried unless `retries` is given, the server may
+        have acted on a request that failed.
+        """
+        kwargs.setdefault('retries', 0)
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, retries=None, **kwargs):
+        """
+        Send a request, see requests.Session.request. Returns the last
+        response or raises the last error once the retries are exhausted.
+        """
+        retries = self.retries if retries is None else retries
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlparse(url).netloc
+        attempt = 0
+        while True:
+            start = default_timer()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (ConnectionError, Timeout), e:
+                self._record(host, default_timer() - start, 'errors')
+                if attempt >= retries:
+                    raise
+                logger.info('%s %s failed (%s), retrying' % (method, url, e))
+            except RequestException:
+                self._record(host, default_timer() - start, 'errors')
+                raise
+            else:
+                failed = response.status_code in RETRY_STATUSES
+                self._record(host, default_timer() - start,
+                             'errors' if failed else None)
+                if not failed or attempt >= retries:
+                    return response
+                logger.info('%s %s returned %s, retrying' % (
+                            method, url, response.status_code))
+                response.close()
+            attempt += 1
+            self._record_retry(host)
+            # Full jitter, spreads the retries of concurrent requests
+            sleep(uniform(0, self.backoff * 2 ** (attempt - 1)))
+
+    def _record(self, host, seconds, outcome):
+        with self._lock:
+            counts = self._counts.setdefault(host, Counter())
+            counts['requests'] += 1
+            counts['seconds'] += seconds
+            if outcome:
+                counts[outcome] += 1
+            self._latencies.setdefault(
+                host, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+    def _record_retry(self, host):
+        with self._lock:
+            self._counts[host]['retries'] += 1
+
+    def get_stats(self):
+        """
+        Returns the requests, errors, retries and total seconds of each
+        host, with the percentiles of its recent latencies.
+        """
+        stats = {}
+        with self._lock:
+            for host, counts in self._counts.items():
+                latencies = sorted(self._latencies[host])
+                host_stats = dict(counts)
+                host_stats['p50'] = percentile(latencies, 0.5)
+                host_stats['p95'] = percentile(latencies, 0.95)
+                host_stats['max'] = latencies[-1]
+                stats[host] = host_stats
+        return stats
+
+
+def get_client():
+    """
+    Returns the process wide HTTP client.
+    """
+    global _client
+    if _client is None:
+        _client = HTTPClient()
+    return _client
+
+
+def close_client():
+    """
+    Close the process wide HTTP client, the next get_client creates a new
+    one.
+    """
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
@@ -1,9 +1,12 @@
 import app_config
 import codecs
 import os
+import socket
+import threading
 
 from app_config import authomatic
 from authomatic.adapters import WerkzeugAdapter
+from contextlib import contextmanager
 from exceptions import KeyError
 from flask import Blueprint, make_response, redirect, render_template, url_for
 from functools import wraps
@@ -13,9 +16,15 @@ from render_utils import make_context
 # and: https://developers.google.com/drive/v3/web/manage-downloads
 DRIVE_API_EXPORT_TEMPLATE = 'https://www.googleapis.com/drive/v3/files/%s/export?mimeType=%s'
 DOC_URL_TEMPLATE = 'https://www.googleapis.com/drive/v3/files/%s/export?mimeType=%s'
+# Via: https://developers.google.com/drive/v3/reference/files/get
+DRIVE_API_METADATA_TEMPLATE = 'https://www.googleapis.com/drive/v3/files/%s?fields=%s'
+DRIVE_API_REVISION_FIELDS = 'id,headRevisionId,modifiedTime,version'
 
 oauth = Blueprint('_oauth', __name__)
 
+# Serializes changing the process wide default socket timeout
+_timeout_lock = threading.Lock()
+
 @oauth.route('/oauth/')
 def oauth_alert():
     """
@@ -28,7 +37,7 @@ def oauth_alert():
 
     credentials = get_credentials()
     if credentials:
-        resp = authomatic.access(credentials, 'https://www.googleapis.com/oauth2/v1/userinfo?alt=json')
+        resp = _access(credentials, 'https://www.googleapis.com/oauth2/v1/userinfo?alt=json')
         if resp.status == 200:
             context['email'] = resp.data['email']
 
@@ -90,7 +99,8 @@ def get_credentials():
     credentials = authomatic.credentials(serialized_credentials)
 
     if not credentials.valid:
-        credentials.refresh()
+        with _drive_timeout():
+            credentials.refresh()
         save_credentials(credentials)
 
     return credentials
@@ -103,18 +113,19 @@ def save_credentials(credentials):
     with open(file_path, 'w') as f:
         f.write(credentials.serialize())
 
-def get_document(key, file_path, mimeType=None):
+def get_document(key, file_path, mimeType=None, credentials=None):
     """
     Uses Authomatic to get the google doc
     """
     mime = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
     if not mimeType:
         mimeType = mime
-    credentials = get_credentials()
+    if not credentials:
+        credentials = get_credentials()
     url = DRIVE_API_EXPORT_TEMPLATE % (
         key,
         mimeType)
-    response = app_config.authomatic.access(credentials, url)
+    response = _access(credentials, url)
 
     if response.status != 200:
         if response.status == 404:
@@ -126,13 +137,37 @@ def get_document(key, file_path, mimeType=None):
         writefile.write(response.content)
 
 
-def get_doc(key, file_path):
+def get_doc_revision(key, credentials=None):
+    """
+    Uses Authomatic to get a revision marker for the google doc.
+
+    This is a small metadata request that does not export the document.
+    Google native documents do not have a `headRevisionId` so we fall
+    back to `modifiedTime`.
+    """
+    if not credentials:
+        credentials = get_credentials()
+    url = DRIVE_API_METADATA_TEMPLATE % (key, DRIVE_API_REVISION_FIELDS)
+    response = _access(credentials, url)
+
+    if response.status != 200:
+        if response.status == 404:
+            raise KeyError("Error! Your Google Doc (%s) does not exist or you do not have permission to access it." % key)
+        else:
+            raise KeyError("Error! Google returned a %s error" % response.status)
+
+    metadata = response.data
+    return metadata.get('headRevisionId') or metadata.get('modifiedTime')
+
+
+def get_doc(key, file_path, credentials=None):
     """
     Uses Authomatic to get the google doc
     """
-    credentials = get_credentials()
+    if not credentials:
+        credentials = get_credentials()
     url = DOC_URL_TEMPLATE % (key, 'text/html')
-    response = app_config.authomatic.access(credentials, url)
+    response = _access(credentials, url)
 
     if response.status != 200:
         if response.status == 404:
@@ -143,6 +178,8 @@ def get_doc(key, file_path):
     with codecs.open(file_path, 'w', 'utf-8') as writefile:
         writefile.write(response.content)
 
+    return response.content
+
 
 def get_doc_as_text(key, file_path):
     """
@@ -150,7 +187,7 @@ def get_doc_as_text(key, file_path):
     """
     credentials = get_credentials()
     url = DOC_URL_TEMPLATE % (key, 'text/plain')
-    response = app_config.authomatic.access(credentials, url)
+    response = _access(credentials, url)
 
     if response.status != 200:
         if response.status == 404:
@@ -161,6 +198,28 @@ def get_doc_as_text(key, file_path):
     with codecs.open(file_path, 'w', 'utf-8') as writefile:
         writefile.write(response.content)
 
+@contextmanager
+def _drive_timeout():
+    """
+    Authomatic opens its connections without a timeout, so a hung Google
+    endpoint would block the daemon indefinitely. Bound them with the
+    default socket timeout while the enclosed requests run.
+    """
+    with _timeout_lock:
+        saved = socket.getdefaulttimeout()
+        socket.setdefaulttimeout(app_config.DRIVE_TIMEOUT)
+        try:
+            yield
+        finally:
+            socket.setdefaulttimeout(saved)
+
+def _access(credentials, url):
+    """
+    Uses Authomatic to access a Google API url, with DRIVE_TIMEOUT
+    """
+    with _drive_timeout():
+        return app_config.authomatic.access(credentials, url)
+
 def _has_api_credentials():
     """
     Test for API credentials
@@ -4,11 +4,16 @@ import logging
 import re
 import app_config
 import datetime
+from cache import get_cache
+from contextlib import contextmanager
+import hashlib
+import json
 import pytz
-from shortcode import process_shortcode
+from HTMLParser import HTMLParser
+from collections import Counter
+from shortcode import (process_shortcode, process_shortcode_text,
+                       resolve_contexts, scan_shortcodes)
 import cPickle as pickle
-from bs4 import BeautifulSoup
-from pymongo import MongoClient
 import xlrd
 
 logging.basicConfig(format=app_config.LOG_FORMAT)
@@ -34,8 +39,14 @@ shortcode_regex = re.compile(ur'^\s*\[%\s*.*\s*%\]\s*$', re.UNICODE)
 internal_link_regex = re.compile(ur'(\[% internal_link\s+.*?\s*%\])',
                                  re.UNICODE)
 
+html_tag_regex = re.compile(ur'<[^>]*>', re.UNICODE)
+
+html_parser = HTMLParser()
+
 author_initials_regex = re.compile(ur'^(.*)\((\w{2,3})\)\s*$', re.UNICODE)
 
+whitespace_regex = re.compile(ur'\s+', re.UNICODE)
+
 
 def is_post_marker(tag):
     """
@@ -140,10 +151,8 @@ def compose_pinned_post(post):
     3.Compose the HTML for the compact graphic
     """
     pinned_post = post
-    # Get the timestamps collection
-    client = MongoClient(app_config.MONGODB_URL)
-    database = client['liveblog']
-    collection = database.pinned
+    # Get the pinned post cache
+    cache = get_cache()
     try:
         post['pinned']
     except KeyError:
@@ -151,11 +160,10 @@ def compose_pinned_post(post):
 
     # Cache pinned post contents
     if post['published mode'] != 'yes':
-        result = collection.find_one({'_id': post['slug']})
+        result = cache.get('pinned', post['slug'])
         if not result:
             logger.debug('did not find pinned post %s' % post['slug'])
-            collection.insert({
-                '_id': post['slug'],
+            cache.set('pinned', post['slug'], {
                 'cached_contents': post['contents'],
                 'cached_headline': post['headline'],
             })
@@ -168,13 +176,13 @@ def compose_pinned_post(post):
             logger.debug('returning cached headline %s' % (
                          post['cached_headline']))
     else:
-        # Update mongodb cache
+        # Update the cache
         post['cached_contents'] = post['contents']
         post['cached_headline'] = post['headline']
         logger.debug("update cached headline to %s" % post['headline'])
-        collection.update({'_id': post['slug']},
-                          {'cached_contents': post['contents'],
-                           'cached_headline': post['headline']})
+        cache.set('pinned', post['slug'],
+                  {'cached_contents': post['contents'],
+                   'cached_headline': post['headline']})
 
     return pinned_post
 
@@ -192,10 +200,14 @@ def add_last_timestamp(posts):
 
 
 def process_inline_internal_link(m):
-    raw_shortcode = m.group(1)
-    fake_p = BeautifulSoup('<p>%s</p>' % (raw_shortcode), "html.parser")
-    parsed_inline_shortcode = process_shortcode(fake_p)
-    return parsed_inline_shortcode
+    """
+    Render an internal link shortcode matched in serialized html, which
+    may contain markup and entities: get its text as BeautifulSoup would
+    """
+    raw_shortcode = html_tag_regex.sub(u'', m.group(1))
+    if u'&' in raw_shortcode:
+        raw_shortcode = html_parser.unescape(raw_shortcode)
+    return process_shortcode_text(raw_shortcode)
 
 
 def process_headline(contents):
@@ -267,32 +279,138 @@ def process_metadata(contents):
     return metadata
 
 
-def process_post_contents(contents):
+def process_post_contents(contents, stats=None, contexts=None):
     """
     Process post copy content
-    In particular parse and generate HTML from shortcodes
+    In particular parse and generate HTML from shortcodes, with the
+    `contexts` resolved during the prescan if given
     """
     logger.debug('--process_post_contents start--')
 
     parsed = []
     for tag in contents:
         text = tag.get_text()
+        # Most paragraphs have no shortcodes at all
+        if u'[%' not in text:
+            parsed.append(unicode(tag))
+            continue
         m = shortcode_regex.match(text)
         if m:
-            parsed.append(process_shortcode(tag))
+            with _stage(stats, 'shortcodes'):
+                parsed.append(process_shortcode(tag, contexts))
         else:
             # Parsed searching and replacing for inline internal links
-            parsed_tag = internal_link_regex.sub(process_inline_internal_link,
-                                                 unicode(tag))
+            with _stage(stats, 'shortcodes'):
+                parsed_tag = internal_link_regex.sub(
+                    process_inline_internal_link, unicode(tag))
             logger.debug('parsed tag: %s' % parsed_tag)
             parsed.append(parsed_tag)
     post_contents = ''.join(parsed)
     return post_contents
 
 
-def parse_raw_posts(raw_posts, authors):
+def prescan_shortcodes(raw_posts):
+    """
+    Returns how many times each shortcode (tag, id) appears in the posts
+    """
+    inventory = Counter()
+    for raw_post in raw_posts:
+        for tag in raw_post:
+            text = tag.get_text()
+            if u'[%' in text:
+                inventory.update(scan_shortcodes(text))
+    return inventory
+
+
+def parse_raw_post(raw_post, authors, cache, stats=None, contexts=None):
+    """
+    parse a raw post into a post object
+    """
+    post = {}
+    marker_counter = 0
+    post_raw_headline = []
+    post_raw_metadata = []
+    post_raw_contents = []
+    for tag in raw_post:
+        text = tag.get_text()
+        m = frontmatter_marker_regex.match(text)
+        if m:
+            marker_counter += 1
+        else:
+            if (marker_counter == 0):
+                post_raw_headline.append(tag)
+            elif (marker_counter == 1):
+                post_raw_metadata.append(tag)
+            else:
+                post_raw_contents.append(tag)
+    post[u'headline'] = process_headline(post_raw_headline)
+    metadata = process_metadata(post_raw_metadata)
+    add_author_metadata(metadata, authors)
+    for k, v in metadata.iteritems():
+        post[k] = v
+    post[u'contents'] = process_post_contents(post_raw_contents, stats,
+                                              contexts)
+
+    # Retrieve timestamp from the cache
+    utcnow = datetime.datetime.utcnow()
+    # Ignore pinned post timestamp generation
+    if 'pinned' in post.keys():
+        return post
+    if post['published'] == 'yes':
+        result = cache.get('timestamps', post['slug'])
+        if not result:
+            # This fires when we have a newly published post
+            logger.debug('did not find post timestamp %s: ' % post['slug'])
+            cache.set('timestamps', post['slug'], {
+                'timestamp': utcnow,
+            })
+            post['timestamp'] = utcnow.replace(tzinfo=pytz.utc)
+        else:
+            logger.debug('post %s timestamp: retrieved from cache' % (
+                         post['slug']))
+            post['timestamp'] = result['timestamp'].replace(
+                tzinfo=pytz.utc)
+            logger.debug("timestamp from DB: %s" % post['timestamp'])
+    else:
+        post['timestamp'] = utcnow.replace(tzinfo=pytz.utc)
+    return post
+
+
+def find_raw_post_slug(raw_post):
+    """
+    Best effort search of the slug of a post that could not be parsed
+    """
+    for tag in raw_post:
+        m = extract_metadata_regex.match(tag.get_text())
+        if m and m.group(1).strip().lower() == 'slug':
+            return m.group(2).strip().lower()
+    return None
+
+
+def load_last_good_posts():
+    """
+    Returns the posts of the last parsed document, including its pinned
+    post, by slug
+    """
+    try:
+        with open(app_config.LIVEBLOG_BACKUP_PATH, 'rb') as f:
+            parsed_document = pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError), e:
+        logger.warning('could not load the liveblog backup: %s' % e)
+        return {}
+    posts = list(parsed_document.get('posts') or [])
+    if parsed_document.get('pinned_post'):
+        posts.append(parsed_document['pinned_post'])
+    return dict((post['slug'], post) for post in posts if 'slug' in post)
+
+
+def parse_raw_posts(raw_posts, authors, stats=None, contexts=None,
+                    errors=None):
     """
     parse raw posts into an array of post objects
+
+    A post that fails to parse is replaced by its last good version,
+    if any, or left out. Its error is added to `errors` by slug.
     """
 
     # Divide each post into its subparts
@@ -300,60 +418,30 @@ def parse_raw_posts(raw_posts, authors):
     # - FrontMatter
     # - Contents
     posts = []
+    last_good_posts = None
+    if errors is None:
+        errors = {}
 
-    # Get the timestamps collection
-    client = MongoClient(app_config.MONGODB_URL)
-    database = client['liveblog']
-    collection = database.timestamps
-    for raw_post in raw_posts:
-        post = {}
-        marker_counter = 0
-        post_raw_headline = []
-        post_raw_metadata = []
-        post_raw_contents = []
-        for tag in raw_post:
-            text = tag.get_text()
-            m = frontmatter_marker_regex.match(text)
-            if m:
-                marker_counter += 1
-            else:
-                if (marker_counter == 0):
-                    post_raw_headline.append(tag)
-                elif (marker_counter == 1):
-                    post_raw_metadata.append(tag)
-                else:
-                    post_raw_contents.append(tag)
-        post[u'headline'] = process_headline(post_raw_headline)
-        metadata = process_metadata(post_raw_metadata)
-        add_author_metadata(metadata, authors)
-        for k, v in metadata.iteritems():
-            post[k] = v
-        post[u'contents'] = process_post_contents(post_raw_contents)
-        posts.append(post)
-
-        # Retrieve timestamp from mongo
-        utcnow = datetime.datetime.utcnow()
-        # Ignore pinned post timestamp generation
-        if 'pinned' in post.keys():
-            continue
-        if post['published'] == 'yes':
-            result = collection.find_one({'_id': post['slug']})
-            if not result:
-                # This fires when we have a newly published post
-                logger.debug('did not find post timestamp %s: ' % post['slug'])
-                collection.insert({
-                    '_id': post['slug'],
-                    'timestamp': utcnow,
-                })
-                post['timestamp'] = utcnow.replace(tzinfo=pytz.utc)
+    # Get the timestamps cache
+    cache = get_cache()
+    for i, raw_post in enumerate(raw_posts):
+        try:
+            post = parse_raw_post(raw_post, authors, cache, stats, contexts)
+        except Exception, e:
+            slug = find_raw_post_slug(raw_post)
+            key = slug or 'post #%s' % (i + 1)
+            errors[key] = '%s: %s' % (e.__class__.__name__, e)
+            if last_good_posts is None:
+                last_good_posts = load_last_good_posts()
+            if slug in last_good_posts:
+                logger.error('could not parse post %s, keeping its last good '
+                             'version: %s' % (key, errors[key]))
+                posts.append(last_good_posts[slug])
             else:
-                logger.debug('post %s timestamp: retrieved from cache' % (
-                             post['slug']))
-                post['timestamp'] = result['timestamp'].replace(
-                    tzinfo=pytz.utc)
-                logger.debug("timestamp from DB: %s" % post['timestamp'])
+                logger.error('could not parse post %s, leaving it out: %s' % (
+                             key, errors[key]))
         else:
-            post['timestamp'] = utcnow.replace(tzinfo=pytz.utc)
+            posts.append(post)
 
     return posts
 
@@ -434,10 +522,78 @@ def getAuthorsData():
         return authors
 
 
-def parse(doc, authors=None):
+def _canonical_value(value):
+    """
+    Normalize a parsed value so that insignificant differences
+    (whitespace runs, dict ordering) do not change the hash
+    """
+    if isinstance(value, dict):
+        return dict((k, _canonical_value(v)) for k, v in value.iteritems())
+    elif isinstance(value, (list, tuple)):
+        return [_canonical_value(v) for v in value]
+    elif isinstance(value, basestring):
+        return whitespace_regex.sub(u' ', value).strip()
+    elif isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def _canonical_post(post):
+    """
+    Draft posts get a new timestamp on every parse so it is left out
+    """
+    if post.get('published') != 'yes':
+        post = dict(post)
+        post.pop('timestamp', None)
+    return post
+
+
+def _hash(value):
+    serialized = json.dumps(_canonical_value(value), sort_keys=True)
+    return hashlib.sha1(serialized).hexdigest()
+
+
+def hash_post(post):
+    """
+    Compute a canonical hash of a single parsed post.
+    """
+    return _hash(_canonical_post(post))
+
+
+def hash_document(parsed_document):
+    """
+    Compute a canonical hash of a parsed document.
+    """
+    canonical = dict(parsed_document)
+    canonical['posts'] = [_canonical_post(post) for post
+                          in parsed_document.get('posts') or []]
+    return _hash(canonical)
+
+
+@contextmanager
+def _stage(stats, name):
+    """
+    Time a block as stage `name` of the cycle `stats`, if given.
+    """
+    if stats is None:
+        yield
+    else:
+        with stats.stage(name):
+            yield
+
+
+def parse(doc, authors=None, stats=None):
     """
     Custom parser for the debates google doc format
     returns boolean marking if the transcript is live or has ended
+
+    If given, the split and parse timings are recorded in the `stats`
+    of the current daemon cycle (prescan and shortcodes are included in
+    parse), with the number of shortcodes of each tag and the errors of
+    the posts that could not be parsed
+
+    A post that fails to parse does not fail the document, see
+    `parse_raw_posts`
     """
     try:
         parsed_document = {}
@@ -446,36 +602,58 @@ def parse(doc, authors=None):
         logger.info('-------------start------------')
         if not authors:
             authors = getAuthorsData()
-        status, raw_posts = split_posts(doc)
-        posts = parse_raw_posts(raw_posts, authors)
-        if posts:
-            idx = find_pinned_post(posts)
-            if idx is not None:
-                pinned_post = posts.pop(idx)
-                pinned_post = compose_pinned_post(pinned_post)
+        with _stage(stats, 'split'):
+            status, raw_posts = split_posts(doc)
+        with _stage(stats, 'parse'):
+            # Resolve the context of every shortcode up front, in bulk
+            with _stage(stats, 'prescan'):
+                inventory = prescan_shortcodes(raw_posts)
+                try:
+                    contexts = resolve_contexts(inventory)
+                except Exception, e:
+                    # Each post resolves its own shortcodes then
+                    logger.error('could not resolve the shortcodes up '
+                                 'front: %s' % e)
+                    contexts = None
+            if stats is not None:
+                stats.counts['shortcodes'] = sum(inventory.values())
+                stats.counts['shortcodes_unique'] = len(inventory)
+                for (tag, id), count in inventory.iteritems():
+                    stats.counts['shortcodes_%s' % tag] += count
+            errors = {}
+            posts = parse_raw_posts(raw_posts, authors, stats, contexts,
+                                    errors)
+            if stats is not None:
+                stats.counts['post_errors'] = len(errors)
+                stats.post_errors = errors
+            if posts:
+                idx = find_pinned_post(posts)
+                if idx is not None:
+                    pinned_post = posts.pop(idx)
+                    pinned_post = compose_pinned_post(pinned_post)
+                else:
+                    logger.error("Did not find a pinned post on the document")
+                ordered_posts = order_posts(posts)
+                published_posts = filter(lambda p: p['published'] == 'yes',
+                                         ordered_posts)
+                pinned_post['timestamp'] = add_last_timestamp(published_posts)
+                logger.info('Number of published posts %s' % len(published_posts))
+                logger.info('Total number of Posts: %s' % len(ordered_posts))
+                if not status and len(published_posts):
+                    status = 'during'
+                elif not status:
+                    status = 'before'
             else:
-                logger.error("Did not find a pinned post on the document")
-            ordered_posts = order_posts(posts)
-            published_posts = filter(lambda p: p['published'] == 'yes',
-                                     ordered_posts)
-            pinned_post['timestamp'] = add_last_timestamp(published_posts)
-            logger.info('Number of published posts %s' % len(published_posts))
-            logger.info('Total number of Posts: %s' % len(ordered_posts))
-            if not status and len(published_posts):
-                status = 'during'
-            elif not status:
+                # Handle empty initial liveblog
+                logger.warning('Have not found posts.')
                 status = 'before'
-        else:
-            # Handle empty initial liveblog
-            logger.warning('Have not found posts.')
-            status = 'before'
-            ordered_posts = []
-        parsed_document['status'] = status
-        parsed_document['pinned_post'] = pinned_post
-        parsed_document['posts'] = ordered_posts
-        logger.info('storing liveblog backup')
-        with open(app_config.LIVEBLOG_BACKUP_PATH, 'wb') as f:
-            pickle.dump(parsed_document, f)
+                ordered_posts = []
+            parsed_document['status'] = status
+            parsed_document['pinned_post'] = pinned_post
+            parsed_document['posts'] = ordered_posts
+            logger.info('storing liveblog backup')
+            with open(app_config.LIVEBLOG_BACKUP_PATH, 'wb') as f:
+                pickle.dump(parsed_document, f)
     except Exception, e:
         logger.error('unexpected exception: %s' % e)
         logger.info('restoring liveblog backup and setting error status')
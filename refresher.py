@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+"""
+Background refreshes of cached values, so that the parse cycle can keep
+serving a stale value instead of waiting on a remote service.
+"""
+
+from Queue import Queue
+from collections import Counter
+import logging
+import threading
+
+import app_config
+
+logging.basicConfig(format=app_config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+logger.setLevel(app_config.LOG_LEVEL)
+
+
+class Refresher(object):
+    """
+    Runs refresh jobs in daemon worker threads, started on first use.
+    A key already waiting or being refreshed is not submitted again.
+    """
+    def __init__(self, name, workers=1):
+        self.name = name
+        self.workers = workers
+        self.stats = Counter()
+        self._queue = Queue()
+        self._pending = set()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, key, func, *args):
+        """
+        Queue `func(*args)` to refresh `key`. Returns False if a refresh
+        of `key` is already pending.
+        """
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+            self.stats['submitted'] += 1
+            if not self._threads:
+                self._start()
+        self._queue.put((key, func, args))
+        return True
+
+    def _start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work,
+                                      name='%s-refresh-%s' % (self.name, i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            key, func, args = self._queue.get()
+            try:
+                func(*args)
+                self.stats['refreshed'] += 1
+            except Exception, e:
+                logger.warning('%s %s: refresh failed, keeping the stale '
+                               'value: %s' % (self.name, key, e))
+                self.stats['failed'] += 1
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+                self._queue.task_done()
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def join(self):
+        """
+        Wait until every submitted refresh finished.
+        """
+        self._queue.join()
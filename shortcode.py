@@ -1,20 +1,47 @@
 # _*_ coding:utf-8 _*_
 import app_config
-import datetime
+import hashlib
 import logging
-import requests
+import re
 import shortcodes
+import threading
 
 from PIL import Image
 from StringIO import StringIO
 from bs4 import BeautifulSoup
+from cache import get_cache
+from circuit import CircuitBreaker, NegativeCache
+from collections import Counter, OrderedDict
+from datetime import datetime
 from functools import partial
+from http_client import get_client
 from jinja2 import Environment, FileSystemLoader
-from pymongo import MongoClient
+from multiprocessing.pool import ThreadPool
+from refresher import Refresher
+from requests import RequestException
+from urlparse import urlparse
 
 TWITTER_OEMBED_URL = 'https://api.twitter.com/1.1/statuses/oembed.json'
 IMAGE_URL_TEMPLATE = '%s/%s'
 IMAGE_TYPES = ['image', 'graphic']
+# Tag and arguments of each shortcode of a text
+shortcode_scan_regex = re.compile(ur'\[%\s*(\w+)(.*?)%\]', re.UNICODE)
+# Arguments of a shortcode, as split by the shortcodes library:
+# key="quoted", "quoted", key=value or value
+shortcode_arg_regex = re.compile(r"""
+    (?:([^\s'"=]+)=)?
+    (
+        "((?:[^\\"]|\\.)*)"
+        |
+        '((?:[^\\']|\\.)*)'
+    )
+    |
+    ([^\s'"=]+)=(\S+)
+    |
+    (\S+)
+""", re.VERBOSE)
+# Statuses that mean the host, not the requested url, is failing
+HOST_FAILURE_STATUSES = [429, 500, 502, 503, 504]
 SHORTCODE_DICT = {
     'tweet': {
         'show_media': 1,
@@ -47,6 +74,14 @@ logging.basicConfig(format=app_config.LOG_FORMAT)
 logger = logging.getLogger(__name__)
 logger.setLevel(app_config.LOG_LEVEL)
 
+# Lookups that failed recently and hosts that keep failing are not tried
+negative_cache = NegativeCache()
+breaker = CircuitBreaker()
+
+# Revalidate the image metadata and tweet layouts served stale
+image_refresher = Refresher('image', workers=app_config.IMAGE_REFRESH_WORKERS)
+tweet_refresher = Refresher('tweet', workers=app_config.TWEET_REFRESH_WORKERS)
+
 
 def _process_id(url, tag):
     """
@@ -59,18 +94,150 @@ def _process_id(url, tag):
         return url
 
 
-def _get_extra_context(id, tag):
+class Unavailable(Exception):
     """
-    Do some processing
+    A remote lookup failed or was not tried, see `_fetch`.
+    """
+    pass
+
+
+class Pending(Unavailable):
+    """
+    A lookup is running in the background, see `_resolve_later`.
+    """
+    pass
+
+
+# Shortcodes rendered as placeholders that have been resolved, or whose
+# stored context changed when revalidated, since `take_resolved` was
+# last called
+_resolved = 0
+_resolved_lock = threading.Lock()
+
+
+def _mark_resolved():
+    global _resolved
+    with _resolved_lock:
+        _resolved += 1
+
+
+def _resolve(fetch, *args):
+    fetch(*args)
+    _mark_resolved()
+
+
+def _resolve_later(refresher, id, fetch, *args):
+    """
+    Run `fetch(*args)` in the background and raise Pending, so that the
+    shortcode renders as a placeholder until a later cycle.
+    """
+    refresher.submit(id, _resolve, fetch, *args)
+    raise Pending('resolving in the background')
+
+
+def has_resolved():
+    """
+    Whether placeholders can be replaced by their actual content, or
+    revalidated embeds render differently, since `take_resolved` was last
+    called, the liveblog needs to be rebuilt then.
+    """
+    return _resolved > 0
+
+
+def take_resolved():
+    """
+    Returns how many placeholders can be replaced by their actual
+    content, or revalidated embeds changed, since the last call. Called
+    when a build starts, as that build renders them.
+    """
+    global _resolved
+    with _resolved_lock:
+        resolved, _resolved = _resolved, 0
+    return resolved
+
+
+def _get_context_key(id, tag):
+    """
+    Key of the extra context of a shortcode, None if it needs none.
+    Images and graphics share their context.
     """
-    extra = dict()
     if tag in IMAGE_TYPES:
-        extra.update(_get_image_context(id))
+        return ('images', id)
     if tag == 'tweet':
-        extra.update(_get_tweet_context(id))
+        return ('tweets', id)
+    return None
+
+
+def _get_extra_context(id, tag, contexts=None, result=None):
+    """
+    Do some processing
+
+    `contexts` are the contexts already resolved by `resolve_contexts`
+    and `result` the cached value of the shortcode, when looked up
+    already ({} when missing).
+    """
+    key = _get_context_key(id, tag)
+    if contexts is not None and key in contexts:
+        return dict(contexts[key])
+    extra = dict()
+    try:
+        if tag in IMAGE_TYPES:
+            extra.update(_get_image_context(id, result))
+        if tag == 'tweet':
+            extra.update(_get_tweet_context(id, result))
+    except Pending, e:
+        logger.info('%s %s: rendering a placeholder, %s' % (tag, id, e))
+        extra.update(_get_placeholder_context(id, tag))
+    except Unavailable, e:
+        logger.warning('%s %s: rendering a placeholder, %s' % (tag, id, e))
+        extra.update(_get_placeholder_context(id, tag))
     return extra
 
 
+def _get_placeholder_context(id, tag):
+    """
+    Context rendering a shortcode whose lookup failed or is pending.
+    """
+    if tag in IMAGE_TYPES:
+        return dict(ratio=app_config.IMAGE_PLACEHOLDER_RATIO,
+                    url=IMAGE_URL_TEMPLATE % (app_config.IMAGE_URL, id),
+                    unavailable=True)
+    return dict(layout='text', unavailable=True)
+
+
+def _fetch(url, **kwargs):
+    """
+    GET `url`, raising Unavailable when it fails. Failures are remembered
+    for FETCH_NEGATIVE_TTL seconds and a host that keeps failing is left
+    alone for FETCH_BREAKER_RESET seconds, see circuit.py.
+    """
+    key = (url, kwargs.get('params'))
+    reason = negative_cache.get(key)
+    if reason is not None:
+        raise Unavailable('failed recently: %s' % reason)
+    host = urlparse(url).netloc
+    if not breaker.allow(host):
+        raise Unavailable('%s is failing' % host)
+
+    try:
+        response = get_client().get(url, **kwargs)
+    except RequestException, e:
+        breaker.record_failure(host)
+        negative_cache.add(key, e)
+        raise Unavailable(e)
+
+    if response.status_code in HOST_FAILURE_STATUSES:
+        breaker.record_failure(host)
+    else:
+        breaker.record_success(host)
+    try:
+        response.raise_for_status()
+    except RequestException, e:
+        negative_cache.add(key, e)
+        raise Unavailable(e)
+    return response
+
+
 def _handler(context, content, pargs, kwargs, tag, defaults):
     """
     Default handler all other handlers inherit from.
@@ -79,105 +246,300 @@ def _handler(context, content, pargs, kwargs, tag, defaults):
         id = _process_id(pargs[0], tag)
         template_context = dict(url=pargs[0],
                             id=id)
-        extra_context = _get_extra_context(id, tag)
+        extra_context = _get_extra_context(id, tag, context)
         template_context.update(extra_context)
     else:
         template_context = dict()
     template_context.update(defaults)
     template_context.update(kwargs)
-    template = env.get_template('%s.html' % tag)
-    output = template.render(**template_context)
-    return output
+    return render_cache.render(tag, template_context)
+
+
+class RenderCache(object):
+    """
+    Bounded LRU of rendered shortcodes by tag and template context, the
+    same embed is rendered once while it stays in the liveblog.
+    """
+    def __init__(self, templates, size=None):
+        self.templates = templates
+        self.size = size or app_config.SHORTCODE_RENDER_CACHE_SIZE
+        self.stats = Counter()
+        self._outputs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, tag, template_context):
+        key = (tag, tuple(sorted(template_context.items())))
+        with self._lock:
+            output = self._outputs.pop(key, None)
+            if output is not None:
+                self._outputs[key] = output
+                self.stats['hits'] += 1
+                return output
+            self.stats['misses'] += 1
+        output = self.templates[tag].render(**template_context)
+        with self._lock:
+            self._outputs[key] = output
+            while len(self._outputs) > self.size:
+                self._outputs.popitem(last=False)
+                self.stats['evictions'] += 1
+        return output
 
 
 """
-Register handlers
+Compile the templates and register handlers
 """
+templates = dict((tag, env.get_template('%s.html' % tag))
+                 for tag in SHORTCODE_DICT)
+render_cache = RenderCache(templates)
 parser = shortcodes.Parser()
 for tag, defaults in SHORTCODE_DICT.items():
     tag_handler = partial(_handler, tag=tag, defaults=defaults)
     parser.register(tag_handler, tag)
 
 
-def process_shortcode(tag):
+def process_shortcode(tag, contexts=None):
     """
     Generates html from shortcode
     """
+    return process_shortcode_text(tag.get_text(), contexts)
+
+
+def process_shortcode_text(text, contexts=None):
+    """
+    Generates html from the text of a shortcode, using the extra
+    `contexts` resolved by `resolve_contexts` if given
+    """
     # Replace unicode <br>
-    text = tag.get_text().replace(u'\xa0', u' ')
+    text = text.replace(u'\xa0', u' ')
     try:
-        return parser.parse(text)
+        return parser.parse(text, contexts)
     except shortcodes.RenderingError as e:
         logger.error('Could not render short code in: "%s"' % text)
         logger.error('cause: %s' % e.__cause__)
         return ''
 
 
-def _get_image_context(id):
+def _get_positional_args(argstring):
+    """
+    Positional arguments of a shortcode. Parsed here rather than through
+    the shortcodes library, which only exposes its parser on a Shortcode
+    instance built while rendering.
+    """
+    pargs = []
+    for match in shortcode_arg_regex.finditer(argstring):
+        if match.group(2) and not match.group(1):
+            pargs.append(match.group(3) or match.group(4))
+        elif match.group(7):
+            pargs.append(match.group(7))
+    return pargs
+
+
+def scan_shortcodes(text):
+    """
+    Returns the (tag, id) of the shortcodes in `text` that have an id.
+    """
+    found = []
+    for m in shortcode_scan_regex.finditer(text.replace(u'\xa0', u' ')):
+        tag, argstring = m.group(1), m.group(2)
+        if tag not in SHORTCODE_DICT:
+            continue
+        pargs = _get_positional_args(argstring)
+        if pargs:
+            try:
+                found.append((tag, _process_id(pargs[0], tag)))
+            except IndexError:
+                # Malformed tweet url, left for the render to report
+                continue
+    return found
+
+
+def resolve_contexts(invocations):
+    """
+    Resolve at once the extra context of the given (tag, id) shortcodes,
+    for `process_shortcode`. Cached values are read with one query per
+    table and the misses are fetched concurrently (or in the background
+    with SHORTCODE_RESOLVE_ASYNC), rendering then needs no I/O.
+    """
+    keys = {}
+    for tag, id in invocations:
+        key = _get_context_key(id, tag)
+        if key is not None:
+            keys.setdefault(key, tag)
+
+    cache = get_cache()
+    contexts = {}
+    misses = []
+    for table in ['images', 'tweets']:
+        ids = [id for t, id in keys if t == table]
+        if not ids:
+            continue
+        results = cache.get_many(table, ids)
+        for id in ids:
+            result = results.get(id)
+            if result:
+                contexts[(table, id)] = _get_extra_context(
+                    id, keys[(table, id)], result=result)
+            else:
+                misses.append((table, id))
+
+    def resolve_miss(key):
+        try:
+            return key, _get_extra_context(key[1], keys[key], result={})
+        except Exception, e:
+            # Left for the render, which reports the broken shortcode
+            logger.error('%s %s: could not resolve: %s' % (keys[key], key[1], e))
+            return key, None
+
+    if misses and not app_config.SHORTCODE_RESOLVE_ASYNC:
+        pool = ThreadPool(min(len(misses), app_config.SHORTCODE_FETCH_WORKERS))
+        try:
+            resolved = pool.map(resolve_miss, misses)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        resolved = [resolve_miss(key) for key in misses]
+    contexts.update((key, context) for key, context in resolved
+                    if context is not None)
+    return contexts
+
+
+def get_image_metadata(content, etag=None):
+    """
+    Dimensions, size, format and md5 of an image, with the ETag it was
+    served with if any.
+    """
+    image = Image.open(StringIO(content))
+    return {
+        'width': image.width,
+        'height': image.height,
+        'ratio': float(image.height) / float(image.width),
+        'bytes': len(content),
+        'format': image.format,
+        'etag': etag,
+        'md5': hashlib.md5(content).hexdigest(),
+        'checked': datetime.utcnow(),
+    }
+
+
+def _fetch_image_metadata(id, url, cached=None):
+    """
+    Download an image and cache its metadata. When it is already cached
+    the request is conditional and only the check date changes if the
+    ETag still matches.
+    """
+    headers = {}
+    if cached and cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    response = _fetch(url, headers=headers)
+    if response.status_code == 304:
+        metadata = dict(cached, checked=datetime.utcnow())
+    else:
+        try:
+            metadata = get_image_metadata(response.content,
+                                          response.headers.get('ETag'))
+        except IOError, e:
+            negative_cache.add((url, None), 'not an image')
+            raise Unavailable('not an image: %s' % e)
+        if cached and metadata['md5'] != cached.get('md5'):
+            logger.info('image %s: changed, new ratio %s' % (
+                        id, metadata['ratio']))
+            if metadata['ratio'] != cached.get('ratio'):
+                _mark_resolved()
+    get_cache().set('images', id, metadata)
+    return metadata
+
+
+def _get_image_context(id, result=None):
     """
     Download image and get/cache aspect ratio.
+
+    Image metadata does not expire: once older than IMAGE_REVALIDATE_AFTER
+    it is still served while a conditional request checks in the
+    background whether the image changed.
     """
     url = IMAGE_URL_TEMPLATE % (app_config.IMAGE_URL, id)
 
-    client = MongoClient(app_config.MONGODB_URL)
-    database = client['liveblog']
-    collection = database.images
-    result = collection.find_one({'_id': id})
+    if result is None:
+        result = get_cache().get('images', id)
 
     if not result:
         logger.info('image %s: uncached, downloading %s' % (id, url))
-        response = requests.get(url)
-        image = Image.open(StringIO(response.content))
-        ratio = float(image.height) / float(image.width)
-        collection.insert({
-            '_id': id,
-            'date': datetime.datetime.utcnow(),
-            'ratio': ratio,
-        })
+        if app_config.SHORTCODE_RESOLVE_ASYNC:
+            _resolve_later(image_refresher, id, _fetch_image_metadata, id, url)
+        ratio = _fetch_image_metadata(id, url)['ratio']
     else:
         logger.info('image %s: retrieved from cache' % id)
         ratio = result['ratio']
+        # Entries cached before revalidation was added have no date
+        checked = result.get('checked')
+        if (checked is None or (datetime.utcnow() - checked).total_seconds() >
+                app_config.IMAGE_REVALIDATE_AFTER):
+            image_refresher.submit(id, _fetch_image_metadata, id, url, result)
 
     ratio = round(ratio * 100, 2)
     return dict(ratio=ratio, url=url)
 
 
-def _get_tweet_context(id):
+def _fetch_tweet_layout(id, cached=None):
     """
-    Try and figure out a tweet's aspect ratio har dee har.
+    Get the tweet's oEmbed and cache its layout. When revalidating the
+    `cached` layout, a change is flagged for the next build.
     """
     layout = 'text'
+    params = (('id', id),)
+    response = _fetch(TWITTER_OEMBED_URL, params=params)
+    try:
+        html = response.json()['html']
+    except (ValueError, KeyError, TypeError), e:
+        negative_cache.add((TWITTER_OEMBED_URL, params), 'malformed oEmbed')
+        raise Unavailable('malformed oEmbed: %r' % e)
+    soup = BeautifulSoup(html)
+    links = soup.find_all('a')
+    for link in links:
+        logger.info(link)
+        if link.text == link.get('href'):
+            layout = 'attached_link'
+        if 'pic.twitter.com' in link.text:
+            layout = 'image'
+    soup.decompose()
+
+    logger.info('tweet %s: is layout `%s`' % (id, layout))
+    if cached and layout != cached.get('layout'):
+        _mark_resolved()
+
+    get_cache().set('tweets', id, {
+        'layout': layout,
+        'fetched': datetime.utcnow(),
+    })
+    return layout
+
+
+def _get_tweet_context(id, result=None):
+    """
+    Try and figure out a tweet's aspect ratio har dee har.
 
-    client = MongoClient(app_config.MONGODB_URL)
-    database = client['liveblog']
-    collection = database.tweets
-    result = collection.find_one({'_id': id})
+    Layouts older than TWEET_REVALIDATE_AFTER are still served while
+    they are fetched again in the background. Tweets never seen before
+    (or evicted after DB_TWEET_TTL) are fetched in the cycle, or in the
+    background with SHORTCODE_RESOLVE_ASYNC.
+    """
+    if result is None:
+        result = get_cache().get('tweets', id)
 
     if not result:
         logger.info('tweet %s: uncached, downloading' % id)
-        response = requests.get(TWITTER_OEMBED_URL, params=(('id', id),))
-        response.raise_for_status()
-        data = response.json()
-        soup = BeautifulSoup(data['html'])
-        links = soup.find_all('a')
-        for link in links:
-            logger.info(link)
-            if link.text == link.attrs['href']:
-                layout = 'attached_link'
-            if 'pic.twitter.com' in link.text:
-                layout = 'image'
-
-        logger.info('tweet %s: is layout `%s`' % (id, layout))
-
-        collection.insert({
-            '_id': id,
-            'date': datetime.datetime.utcnow(),
-            'layout': layout,
-        })
+        if app_config.SHORTCODE_RESOLVE_ASYNC:
+            _resolve_later(tweet_refresher, id, _fetch_tweet_layout, id)
+        layout = _fetch_tweet_layout(id)
     else:
         layout = result['layout']
         logger.info('tweet %s: retrieved from cache, is layout `%s`' % (id, layout))
+        # Entries cached before revalidation was added have no date
+        fetched = result.get('fetched')
+        if (fetched is None or (datetime.utcnow() - fetched).total_seconds() >
+                app_config.TWEET_REVALIDATE_AFTER):
+            if tweet_refresher.submit(id, _fetch_tweet_layout, id, result):
+                logger.info('tweet %s: stale, revalidating' % id)
 
     return dict(layout=layout)
-
-
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+"""
+Summary statistics shared by the daemon metrics, the HTTP client stats
+and the benchmarks.
+"""
+
+import math
+
+
+def percentile(values, fraction):
+    """
+    Nearest rank percentile of a sorted list.
+    """
+    if not values:
+        return None
+    rank = int(math.ceil(fraction * len(values))) - 1
+    return values[max(0, rank)]
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+
+import os
+import unittest
+
+from fabfile import benchmarks
+
+@unittest.skipUnless(os.environ.get('LIVEBLOG_BENCHMARKS'),
+                     'set LIVEBLOG_BENCHMARKS=1 to run the microbenchmarks')
+class MicrobenchmarkTestCase(unittest.TestCase):
+    """
+    Fail when a hot helper gets slower than its stored baseline by more
+    than BENCHMARK_REGRESSION_THRESHOLD.
+    """
+    def test_no_regressions(self):
+        baseline = benchmarks.load_baseline()
+        calibration, results = benchmarks.run_microbenchmarks()
+        regressions = benchmarks.find_regressions(results, baseline)
+
+        assert not regressions, regressions
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime
+
+from cache import FrontCache, MongoCache, SqliteCache
+from fabfile.fakes import FakeMongoClient
+
+class CacheContract(object):
+    """
+    Behaviour shared by every cache backend.
+    """
+    def test_get_set(self):
+        self.cache.set('timestamps', 'post-1', {'timestamp': datetime(2020, 1, 1)})
+
+        assert self.cache.get('timestamps', 'post-1') == {
+            'timestamp': datetime(2020, 1, 1)}
+        assert self.cache.get('timestamps', 'post-2') is None
+        assert self.cache.get('pinned', 'post-1') is None
+
+    def test_set_replaces(self):
+        self.cache.set('images', 'a.jpg', {'ratio': 0.5})
+        self.cache.set('images', 'a.jpg', {'ratio': 0.75})
+
+        assert self.cache.get('images', 'a.jpg') == {'ratio': 0.75}
+        assert self.cache.values('images') == [{'ratio': 0.75}]
+
+    def test_get_many(self):
+        self.cache.set('images', 'a.jpg', {'ratio': 0.5})
+        self.cache.set('images', 'b.jpg', {'ratio': 0.75})
+        self.cache.set('tweets', '1', {'layout': 'text'})
+
+        assert self.cache.get_many('images', ['a.jpg', 'b.jpg', 'c.jpg']) == {
+            'a.jpg': {'ratio': 0.5}, 'b.jpg': {'ratio': 0.75}}
+
+    def test_ttl(self):
+        self.cache.set('tweets', '1', {'layout': 'text'})
+        self.cache.set('timestamps', 'post-1', {'timestamp': datetime(2020, 1, 1)})
+        time.sleep(0.02)
+
+        assert self.cache.get('tweets', '1') is None
+        assert self.cache.values('tweets') == []
+        assert self.cache.get('timestamps', 'post-1') is not None
+
+    def test_bootstrap(self):
+        self.cache.set('pinned', 'pinned-post', {'cached_headline': 'Live'})
+        self.cache.bootstrap()
+
+        assert self.cache.get('pinned', 'pinned-post') is None
+
+class MongoCacheTestCase(CacheContract, unittest.TestCase):
+    """
+    Test the MongoDB cache backend.
+    """
+    def setUp(self):
+        self.cache = MongoCache(FakeMongoClient()['liveblog'],
+                                ttls={'tweets': 0.01})
+
+class SqliteCacheTestCase(CacheContract, unittest.TestCase):
+    """
+    Test the embedded SQLite cache backend.
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = SqliteCache(os.path.join(self.tmp_dir, 'cache.sqlite'),
+                                 ttls={'tweets': 0.01})
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmp_dir)
+
+class FrontCacheTestCase(CacheContract, unittest.TestCase):
+    """
+    Test the in-process LRU in front of a backend.
+    """
+    def setUp(self):
+        self.backend = MongoCache(FakeMongoClient()['liveblog'],
+                                  ttls={'tweets': 0.01})
+        self.cache = FrontCache(self.backend, tables=['images', 'tweets'],
+                                size=2)
+
+    def test_hits_skip_backend(self):
+        self.cache.set('images', 'a.jpg', {'ratio': 0.5})
+        self.backend.database['images'].drop()
+
+        assert self.cache.get('images', 'a.jpg') == {'ratio': 0.5}
+        assert self.cache.get_stats()['images'] == {'hits': 1}
+
+    def test_miss_fills_from_backend(self):
+        self.backend.set('images', 'a.jpg', {'ratio': 0.5})
+
+        assert self.cache.get('images', 'a.jpg') == {'ratio': 0.5}
+        assert self.cache.get('images', 'a.jpg') == {'ratio': 0.5}
+        assert self.cache.get_stats()['images'] == {'hits': 1, 'misses': 1}
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set('images', 'a.jpg', {'ratio': 0.5})
+        self.cache.set('images', 'b.jpg', {'ratio': 0.5})
+        self.cache.get('images', 'a.jpg')
+        self.cache.set('tweets', '1', {'layout': 'text'})
+        self.backend.database['images'].drop()
+
+        assert self.cache.get('images', 'a.jpg') is not None
+        assert self.cache.get('images', 'b.jpg') is None
+        assert self.cache.get_stats()['images']['evictions'] == 1
+
+if __name__ == '__main__':
+    unittest.main()
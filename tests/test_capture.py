@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from fabfile import capture
+
+class CaptureTestCase(unittest.TestCase):
+    """
+    Test archiving and listing the downloaded doc versions.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.folder = os.path.join(self.tmpdir, 'event')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        second = datetime(2019, 12, 19, 20, 0, 5, 250000)
+        first = datetime(2019, 12, 19, 20, 0, 1)
+        capture.archive(u'<p>second – 2</p>', second, self.folder)
+        path = capture.archive(u'<p>first</p>', first, self.folder)
+
+        captures = capture.list_captures(self.folder)
+        assert captures == [(first, path), (second, captures[1][1])]
+        assert capture.read_capture(captures[0][1]) == u'<p>first</p>'
+        assert capture.read_capture(captures[1][1]) == u'<p>second – 2</p>'
+
+    def test_ignores_other_files(self):
+        capture.archive(u'<p>doc</p>', folder=self.folder)
+        with open(os.path.join(self.folder, 'notes.html.gz'), 'w') as f:
+            f.write('')
+
+        assert len(capture.list_captures(self.folder)) == 1
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+import codecs
+import os
+import shutil
+import tempfile
+import unittest
+
+import app_config
+from fabfile.engine import LiveblogEngine
+from fabfile.fakes import FakeDrive
+from fabfile.synthetic import generate_copy
+
+class FakeCredentials(object):
+    valid = True
+
+class ResumeTestCase(unittest.TestCase):
+    """
+    Test resuming the engine after a memory restart.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved = (app_config.authomatic,
+                      app_config.COPY_PATH,
+                      app_config.AUTHORS_PATH,
+                      app_config.LIVEBLOG_HTML_PATH,
+                      app_config.DAEMON_STATE_PATH)
+        self.drive = FakeDrive()
+        self.drive.put(app_config.COPY_GOOGLE_DOC_KEY, '')
+        self.drive.put(app_config.AUTHORS_GOOGLE_DOC_KEY, '')
+        app_config.authomatic = self.drive
+        app_config.COPY_PATH = os.path.join(self.tmpdir, 'copy.xlsx')
+        app_config.AUTHORS_PATH = os.path.join(self.tmpdir, 'authors.xlsx')
+        app_config.LIVEBLOG_HTML_PATH = os.path.join(self.tmpdir,
+                                                     'liveblog.html')
+        app_config.DAEMON_STATE_PATH = os.path.join(self.tmpdir,
+                                                    'state.pickle')
+        generate_copy(app_config.COPY_PATH)
+        with codecs.open(app_config.LIVEBLOG_HTML_PATH, 'w', 'utf-8') as f:
+            f.write(u'<html><body>liveblog</body></html>')
+
+    def tearDown(self):
+        (app_config.authomatic,
+         app_config.COPY_PATH,
+         app_config.AUTHORS_PATH,
+         app_config.LIVEBLOG_HTML_PATH,
+         app_config.DAEMON_STATE_PATH) = self.saved
+        shutil.rmtree(self.tmpdir)
+
+    def test_resume_does_not_refresh_copy_and_authors(self):
+        engine = LiveblogEngine()
+        engine.revision = '7'
+        engine.restarted = 1576785600
+        engine.revisions = dict(
+            (key, self.drive.files[key]['modifiedTime'])
+            for key in (app_config.COPY_GOOGLE_DOC_KEY,
+                        app_config.AUTHORS_GOOGLE_DOC_KEY))
+        engine.save_state()
+
+        resumed = LiveblogEngine()
+        resumed.credentials = FakeCredentials()
+        assert resumed.load_state()
+        assert not os.path.exists(app_config.DAEMON_STATE_PATH)
+        assert resumed.html == u'<html><body>liveblog</body></html>'
+        assert resumed.restarted == 1576785600
+        assert resumed.copy is not None
+        assert resumed.authors is not None
+
+        assert not resumed.refresh_copy()
+        assert not resumed.refresh_authors()
+        assert self.drive.exports == []
+
+if __name__ == '__main__':
+    unittest.main()
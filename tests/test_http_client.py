@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+import unittest
+
+from requests import ConnectionError
+
+from http_client import HTTPClient
+from fabfile.fakes import FakeHTTPResponse
+
+class FakeSession(object):
+    """
+    Returns (or raises) the given outcomes in turn.
+    """
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return FakeHTTPResponse(status_code=outcome)
+
+class HTTPClientTestCase(unittest.TestCase):
+    """
+    Test the retries and stats of the shared HTTP client.
+    """
+    def setUp(self):
+        self.client = HTTPClient(retries=2, backoff=0)
+
+    def test_retries_overloaded_server(self):
+        self.client.session = FakeSession([503, 429, 200])
+
+        response = self.client.get('https://api.twitter.com/oembed')
+
+        assert response.status_code == 200
+        stats = self.client.get_stats()['api.twitter.com']
+        assert (stats['requests'], stats['errors'], stats['retries']) == (3, 2, 2)
+
+    def test_gives_up_after_retries(self):
+        self.client.session = FakeSession([ConnectionError('down')] * 3)
+
+        self.assertRaises(ConnectionError, self.client.get,
+                          'https://media.npr.org/a.jpg')
+        assert len(self.client.session.calls) == 3
+
+    def test_post_is_not_retried(self):
+        self.client.session = FakeSession([503, 200])
+
+        assert self.client.post('https://fontello.com').status_code == 503
+        assert len(self.client.session.calls) == 1
+
+    def test_default_timeout(self):
+        self.client.session = FakeSession([200])
+        self.client.get('https://media.npr.org/a.jpg')
+
+        method, url, kwargs = self.client.session.calls[0]
+        assert kwargs['timeout'] == self.client.timeout
+
+if __name__ == '__main__':
+    unittest.main()
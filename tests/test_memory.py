@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+import fcntl
+import tempfile
+import unittest
+from time import time
+
+import app_config
+from fabfile.memory import MemoryGuard, close_on_exec
+
+class MemoryGuardTestCase(unittest.TestCase):
+    """
+    Test deciding when the daemon restarts itself.
+    """
+    def setUp(self):
+        self.guard = MemoryGuard(soft_limit=1, soup_count_cycles=0)
+
+    def test_restarts_over_limit(self):
+        assert self.guard.should_restart()
+        assert self.guard.should_restart(
+            time() - app_config.DAEMON_MIN_UPTIME - 1)
+
+    def test_no_restart_under_limit(self):
+        self.guard.soft_limit = self.guard.rss * 2
+
+        assert not self.guard.should_restart()
+
+    def test_no_restart_loop(self):
+        assert not self.guard.should_restart(time() - 1)
+        assert self.guard.refused_restart
+
+class CloseOnExecTestCase(unittest.TestCase):
+    """
+    Test keeping descriptors from leaking into the restarted daemon.
+    """
+    def test_marks_open_files(self):
+        with tempfile.TemporaryFile() as f:
+            close_on_exec()
+            flags = fcntl.fcntl(f.fileno(), fcntl.F_GETFD)
+
+            assert flags & fcntl.FD_CLOEXEC
+        assert not fcntl.fcntl(1, fcntl.F_GETFD) & fcntl.FD_CLOEXEC
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+import app_config
+import cache
+from fabfile.memory import MemoryGuard
+from fabfile.metrics import (CycleStats, MetricsExporter, get_latencies,
+                             mark_posts_live, summarize_latencies)
+from fabfile.fakes import FakeMongoClient
+from stats_utils import percentile
+
+class LatencyTestCase(unittest.TestCase):
+    """
+    Test the edit to live latency tracking.
+    """
+    def setUp(self):
+        self.cache = cache.MongoCache(FakeMongoClient()['liveblog'])
+        self.since = datetime.utcnow() - timedelta(hours=1)
+
+    def test_percentile(self):
+        values = range(1, 101)
+
+        assert percentile(values, 0.5) == 50
+        assert percentile(values, 0.95) == 95
+        assert percentile(values, 1) == 100
+        assert percentile([3], 0.5) == 3
+        assert percentile([], 0.5) is None
+
+    def test_summarize_latencies(self):
+        summary = summarize_latencies([4.0, 1.0, 3.0, 2.0])
+
+        assert summary == {'count': 4, 'sum': 10.0, 'p50': 2.0, 'p95': 4.0,
+                           'max': 4.0}
+        assert summarize_latencies([])['max'] is None
+
+    def test_marks_new_posts_once(self):
+        published = datetime.utcnow() - timedelta(seconds=30)
+        self.cache.set('timestamps', 'new', {'timestamp': published})
+        self.cache.set('timestamps', 'old', {'timestamp': self.since -
+                                             timedelta(hours=1)})
+
+        latencies, settled = mark_posts_live(self.cache,
+                                             ['new', 'old', 'missing'],
+                                             self.since)
+        assert len(latencies) == 1
+        assert 30 <= latencies[0] < 60
+        assert sorted(settled) == ['new', 'old']
+        assert 'live' not in self.cache.get('timestamps', 'old')
+
+        latencies, settled = mark_posts_live(self.cache, ['new'], self.since)
+        assert latencies == []
+        assert settled == ['new']
+
+    def test_get_latencies_of_event(self):
+        published = datetime.utcnow()
+        self.cache.set('timestamps', 'a', {
+            'timestamp': published, 'live': published + timedelta(seconds=5),
+            'event': app_config.CURRENT_LIVEBLOG})
+        self.cache.set('timestamps', 'b', {
+            'timestamp': published, 'live': published + timedelta(seconds=9),
+            'event': 'another-event'})
+        self.cache.set('timestamps', 'c', {'timestamp': published})
+
+        assert get_latencies(self.cache) == [5.0]
+        assert get_latencies(self.cache, 'another-event') == [9.0]
+
+class MetricsExporterTestCase(unittest.TestCase):
+    """
+    Test the JSON log and the Prometheus textfile of the cycle metrics.
+    """
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.exporter = MetricsExporter(log_dir=self.log_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def read_textfile(self):
+        with open(self.exporter.textfile_path) as f:
+            return f.read().splitlines()
+
+    def finished_stats(self):
+        stats = CycleStats()
+        stats.stages['fetch'] = 0.25
+        stats.stages['parse'] = 1.5
+        stats.stages['prescan'] = 0.5
+        stats.counts['posts'] = 10
+        stats.finish('deployed')
+        return stats
+
+    def test_textfile(self):
+        latency = {'count': 2, 'sum': 7.5, 'p50': 3.0, 'p95': 4.5,
+                   'max': 4.5}
+        self.exporter.export(self.finished_stats(), {'cycles': 1}, latency,
+                             {'images': {'hits': 3, 'misses': 1}})
+        self.exporter.export(self.finished_stats(), {'cycles': 2}, None, None,
+                             {'example.com': {'requests': 3, 'errors': 1,
+                                              'seconds': 1.5, 'p50': 0.25,
+                                              'p95': 1.0, 'max': 1.0}})
+        lines = self.read_textfile()
+
+        assert '# TYPE liveblog_stage_seconds_total counter' in lines
+        assert 'liveblog_stage_seconds_total{stage="parse"} 3.0' in lines
+        assert 'liveblog_cycle_stage_seconds{stage="parse"} 1.5' in lines
+        # Nested stages are exported apart so that the stages add up
+        assert not [line for line in lines if 'stage="prescan"}' in line]
+        assert ('liveblog_substage_seconds_total'
+                '{stage="prescan",parent="parse"} 1.0') in lines
+        assert 'liveblog_http_request_seconds_sum{host="example.com"} 1.5' in lines
+        assert 'liveblog_http_request_seconds_count{host="example.com"} 3' in lines
+        assert 'liveblog_count_total{name="posts"} 20' in lines
+        assert 'liveblog_daemon_events_total{event="cycles"} 2' in lines
+        # The last latency summary is kept for the cycles without one
+        assert 'liveblog_edit_to_live_seconds{quantile="0.95"} 4.5' in lines
+        assert 'liveblog_edit_to_live_seconds_sum 7.5' in lines
+        assert 'liveblog_edit_to_live_seconds_count 2' in lines
+        # Cache stats are only written when given
+        assert not [line for line in lines if 'liveblog_cache' in line]
+        assert not os.path.exists(self.exporter.textfile_path + '.tmp')
+
+    def test_json_log(self):
+        stats = self.finished_stats()
+        stats.post_errors = {'post-1': 'ValueError: bad'}
+        self.exporter.export(stats, {})
+        self.exporter.export(self.finished_stats(), {})
+
+        with open(self.exporter.json_log_path) as f:
+            records = [json.loads(line) for line in f]
+        assert len(records) == 2
+        assert records[0]['outcome'] == 'deployed'
+        assert records[0]['stages'] == {'fetch': 0.25, 'parse': 1.5,
+                                        'prescan': 0.5}
+        assert records[0]['counts'] == {'posts': 10}
+        assert records[0]['post_errors'] == {'post-1': 'ValueError: bad'}
+        assert 'post_errors' not in records[1]
+
+    def test_failed_rename_is_logged(self):
+        # Renaming the temporary file onto a folder raises an OSError
+        os.mkdir(self.exporter.textfile_path)
+        with open(os.path.join(self.exporter.textfile_path, 'keep'), 'w'):
+            pass
+        self.exporter.export(self.finished_stats(), {})
+
+        assert self.exporter.count_totals == {'posts': 10}
+
+    def test_memory_samples_are_gauges(self):
+        guard = MemoryGuard(soup_count_cycles=0)
+        for i in range(2):
+            stats = CycleStats()
+            stats.counts['posts'] = 10
+            guard.sample(stats)
+            stats.finish('deployed')
+            self.exporter.export(stats, {})
+
+        assert 'rss_bytes' not in stats.counts
+        assert self.exporter.count_totals == {'posts': 20}
+        lines = self.read_textfile()
+        assert 'liveblog_count_total{name="posts"} 20' in lines
+        assert ('liveblog_cycle_gauge{name="rss_bytes"} %s' %
+                stats.gauges['rss_bytes']) in lines
+
+if __name__ == '__main__':
+    unittest.main()
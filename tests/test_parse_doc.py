@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+import copy
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from bs4 import BeautifulSoup
+from copydoc import CopyDoc
+
+import app_config
+import cache
+import parse_doc
+from fabfile.metrics import CycleStats
+from fabfile.fakes import FakeMongoClient, FakeServices
+from fabfile.synthetic import generate_authors, generate_liveblog
+
+def make_document():
+    return {
+        'status': 'during',
+        'pinned_post': None,
+        'posts': [{
+            'slug': 'first',
+            'published': 'yes',
+            'headline': u'First post',
+            'contents': u'<p>Some text</p>',
+            'timestamp': datetime.datetime(2019, 12, 19, 21, 0, 0),
+        }, {
+            'slug': 'draft',
+            'published': 'no',
+            'headline': u'Draft post',
+            'contents': u'<p>Draft text</p>',
+            'timestamp': datetime.datetime(2019, 12, 19, 22, 0, 0),
+        }]
+    }
+
+class HashDocumentTestCase(unittest.TestCase):
+    """
+    Test the canonical hash of parsed documents.
+    """
+    def test_same_document(self):
+        assert parse_doc.hash_document(make_document()) == parse_doc.hash_document(make_document())
+
+    def test_ignores_whitespace(self):
+        doc = make_document()
+        doc['posts'][1]['contents'] = u'<p>Draft \n  text</p>'
+
+        assert parse_doc.hash_document(doc) == parse_doc.hash_document(make_document())
+
+    def test_ignores_draft_timestamps(self):
+        doc = make_document()
+        doc['posts'][1]['timestamp'] = datetime.datetime.utcnow()
+
+        assert parse_doc.hash_document(doc) == parse_doc.hash_document(make_document())
+
+    def test_detects_changes(self):
+        doc = make_document()
+        original = copy.deepcopy(doc)
+        doc['posts'][1]['published'] = 'yes'
+
+        assert parse_doc.hash_document(doc) != parse_doc.hash_document(original)
+
+        doc = make_document()
+        doc['posts'][0]['timestamp'] = datetime.datetime.utcnow()
+
+        assert parse_doc.hash_document(doc) != parse_doc.hash_document(original)
+
+class ProcessPostContentsTestCase(unittest.TestCase):
+    """
+    Test the rendering of the paragraphs of a post.
+    """
+    def test_inline_internal_link(self):
+        soup = BeautifulSoup(
+            u'<p><span>See [% internal_link post-1 </span>'
+            u'<span>link_text="A &amp; B" %] now</span></p>'
+            u'<p>No shortcode, 100% [sic]</p>', 'html.parser')
+
+        assert parse_doc.process_post_contents(soup.find_all('p')) == (
+            u'<p><span>See <a class="internal-link" href="#post-1">A & B</a>'
+            u' now</span></p><p>No shortcode, 100% [sic]</p>')
+
+class PostErrorsTestCase(unittest.TestCase):
+    """
+    Test that a post failing to parse does not fail the document.
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.services = FakeServices().start()
+        self.saved = app_config.LIVEBLOG_BACKUP_PATH
+        app_config.LIVEBLOG_BACKUP_PATH = os.path.join(self.tmp_dir,
+                                                       'backup.pickle')
+        mix = {'text': 1}
+        self.html = generate_liveblog(3, mix=mix, drafts=0)
+        # Post 1 loses its mandatory Published line
+        self.broken_html = self.html.replace(
+            u'Slug: post-1</span></p><p class="c1"><span class="c0">'
+            u'Published: yes', u'Slug: post-1')
+        self.authors = generate_authors()
+
+    def tearDown(self):
+        self.services.stop()
+        app_config.LIVEBLOG_BACKUP_PATH = self.saved
+        shutil.rmtree(self.tmp_dir)
+
+    def parse(self, html, stats=None):
+        return parse_doc.parse(CopyDoc(html), self.authors, stats)
+
+    def test_drops_broken_post(self):
+        stats = CycleStats()
+        parsed = self.parse(self.broken_html, stats)
+
+        assert parsed['status'] == 'during'
+        assert sorted(post['slug'] for post in parsed['posts']) == ['post-0', 'post-2']
+        assert stats.post_errors.keys() == ['post-1']
+        assert stats.counts['post_errors'] == 1
+
+    def test_keeps_last_good_version(self):
+        good = self.parse(self.html)
+        parsed = self.parse(self.broken_html)
+
+        assert parsed['status'] == 'during'
+        assert parsed['posts'] == good['posts']
+
+class FailingBulkCache(cache.MongoCache):
+    """
+    A cache whose bulk reads fail.
+    """
+    def get_many(self, table, keys):
+        raise IOError('cache is down')
+
+class ResolveFailureTestCase(unittest.TestCase):
+    """
+    Test that failing to resolve the shortcodes up front does not fail
+    the document.
+    """
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.services = FakeServices(
+            FailingBulkCache(FakeMongoClient()['liveblog'])).start()
+        self.saved = app_config.LIVEBLOG_BACKUP_PATH
+        app_config.LIVEBLOG_BACKUP_PATH = os.path.join(self.tmp_dir,
+                                                       'backup.pickle')
+
+    def tearDown(self):
+        self.services.stop()
+        app_config.LIVEBLOG_BACKUP_PATH = self.saved
+        shutil.rmtree(self.tmp_dir)
+
+    def test_posts_resolve_their_own_shortcodes(self):
+        html = generate_liveblog(3, mix={'image': 1}, drafts=0)
+        parsed = parse_doc.parse(CopyDoc(html), generate_authors())
+
+        assert parsed['status'] == 'during'
+        assert len(parsed['posts']) == 3
+        assert 'padding-bottom' in parsed['posts'][0]['contents']
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+import unittest
+from collections import Counter
+
+import app_config
+from fabfile import pipeline
+from fabfile.metrics import CycleStats
+from fabfile.pipeline import Build, CoalescingQueue, PublishPipeline
+
+class FakeEngine(object):
+    """
+    Records what the pipeline asks the engine to build and publish.
+    """
+    def __init__(self):
+        self.built = []
+        self.published = []
+        self.html = None
+        self.last_digest = None
+        self.metrics = Counter()
+
+    def build(self, html, force=False, stats=None):
+        self.built.append((html, force))
+        return html, 'artifacts for %s' % html
+
+    def publish(self, artifacts, stats=None):
+        self.published.append(artifacts)
+
+class CoalescingQueueTestCase(unittest.TestCase):
+    """
+    Test the single slot queue between pipeline stages.
+    """
+    def test_keeps_newest(self):
+        queue = CoalescingQueue('test')
+        queue.put(Build(1, 'a', None, None))
+        queue.put(Build(2, 'b', None, None))
+
+        assert queue.get(0).seq == 2
+        assert queue.get(0) is None
+        assert queue.dropped == 1
+
+class PublishPipelineTestCase(unittest.TestCase):
+    """
+    Test coalescing and ordering in the publish pipeline.
+    """
+    def setUp(self):
+        self.saved = pipeline.time
+        self.now = 1000
+        pipeline.time = lambda: self.now
+        self.engine = FakeEngine()
+        self.pipeline = PublishPipeline(self.engine)
+
+    def tearDown(self):
+        pipeline.time = self.saved
+
+    def run_pipeline(self):
+        self.pipeline.render_one(self.pipeline.render_queue.get(0))
+        build = self.pipeline.upload_queue.get(0)
+        if build is not None:
+            self.pipeline.upload_one(build)
+
+    def test_drops_stale_versions(self):
+        self.pipeline.submit('first')
+        self.pipeline.submit('second')
+        self.pipeline.render_one(self.pipeline.render_queue.get(0))
+
+        assert self.engine.built == [('second', False)]
+
+    def test_force_survives_coalescing(self):
+        self.pipeline.submit('first', force=True)
+        self.pipeline.submit('second')
+        self.pipeline.render_one(self.pipeline.render_queue.get(0))
+
+        assert self.engine.built == [('second', True)]
+
+    def test_never_publishes_older_version(self):
+        self.pipeline.upload_one(Build(2, 'b', 'new', CycleStats()))
+        self.pipeline.upload_one(Build(1, 'a', 'old', CycleStats()))
+
+        assert self.engine.published == ['new']
+        assert self.pipeline.published_seq == 2
+
+    def test_idle_after_coalesced_versions_finish(self):
+        self.pipeline.submit('first')
+        self.pipeline.submit('second')
+        assert not self.pipeline.idle
+
+        self.pipeline.render_one(self.pipeline.render_queue.get(0))
+        self.pipeline.upload_one(self.pipeline.upload_queue.get(0))
+
+        assert self.pipeline.idle
+
+    def test_publish_failure_forces_rebuild(self):
+        def fail(artifacts, stats=None):
+            raise IOError('S3 is down')
+        self.engine.publish = fail
+        self.engine.last_digest = 'b'
+        self.pipeline.upload_one(Build(1, 'b', 'new', CycleStats()))
+
+        assert self.engine.last_digest is None
+        assert self.pipeline.published_seq == 0
+
+    def test_failed_publish_is_retried_without_changes(self):
+        published = self.engine.published
+        def fail_once(artifacts, stats=None):
+            self.engine.publish = lambda artifacts, stats=None: (
+                published.append(artifacts))
+            raise IOError('S3 is down')
+        self.engine.publish = fail_once
+        self.engine.html = 'doc'
+        self.pipeline.submit('doc')
+        self.run_pipeline()
+        assert published == []
+
+        # The doc does not change, the retry waits for its backoff
+        assert self.pipeline.retry_failed() is None
+        self.now += app_config.LIVEBLOG_PUBLISH_RETRY_INTERVAL
+        seq = self.pipeline.retry_failed()
+        assert seq == 2
+        assert self.pipeline.retry_failed() is None
+        self.run_pipeline()
+
+        assert self.engine.built == [('doc', False), ('doc', True)]
+        assert published == ['artifacts for doc']
+        assert self.pipeline.published_seq == seq
+        assert self.pipeline.retry_at is None
+
+    def test_retry_backs_off(self):
+        def fail(artifacts, stats=None):
+            raise IOError('S3 is down')
+        self.engine.publish = fail
+        for i in range(2):
+            self.pipeline.upload_one(Build(i + 1, 'b', 'new', CycleStats()))
+
+        assert self.pipeline.publish_failures == 2
+        assert self.pipeline.retry_at == (
+            self.now + 2 * app_config.LIVEBLOG_PUBLISH_RETRY_INTERVAL)
+
+    def test_failing_cycle_callback_does_not_stop_publishing(self):
+        def fail(stats):
+            raise OSError('Log folder is gone')
+        self.pipeline.on_cycle_done = fail
+        for html in ('first', 'second'):
+            self.pipeline.submit(html)
+            self.run_pipeline()
+
+        assert self.engine.published == ['artifacts for first',
+                                         'artifacts for second']
+        assert self.pipeline.idle
+
+if __name__ == '__main__':
+    unittest.main()
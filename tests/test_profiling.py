@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+
+from fabfile import profiling
+from fabfile.metrics import CycleStats
+from fabfile.profiling import ProfileTrigger, profiled
+
+class ProfileTriggerTestCase(unittest.TestCase):
+    """
+    Test requesting the profile of a cycle.
+    """
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.trigger = ProfileTrigger(log_dir=self.log_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def touch_sentinel(self, content=''):
+        with open(self.trigger.sentinel_path, 'w') as f:
+            f.write(content)
+
+    def test_nothing_requested(self):
+        assert self.trigger.take() is None
+
+    def test_sentinel_profiles_one_cycle(self):
+        self.touch_sentinel()
+
+        profiler = self.trigger.take()
+        assert profiler is not None
+        assert not profiler.memory
+        assert not os.path.exists(self.trigger.sentinel_path)
+        assert self.trigger.take() is None
+
+    def test_sentinel_memory_mode(self):
+        self.touch_sentinel('memory\n')
+
+        profiler = self.trigger.take()
+        # Without tracemalloc only the cProfile report is written
+        assert profiler.memory == (profiling.tracemalloc is not None)
+
+    def test_signal(self):
+        self.trigger._handle_signal(signal.SIGUSR1, None)
+
+        assert self.trigger.take() is not None
+        assert self.trigger.take() is None
+
+    def test_dump(self):
+        self.touch_sentinel()
+        stats = CycleStats()
+        stats.profiler = self.trigger.take()
+        with profiled(stats):
+            sorted(range(1000), reverse=True)
+        stats.finish('deployed')
+
+        base_path = stats.profiler.dump(stats)
+        assert os.path.exists('%s.pstats' % base_path)
+        with open('%s.txt' % base_path) as f:
+            report = f.read()
+        assert report.startswith('Cycle deployed in')
+        assert 'sorted' in report
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import unittest
+
+import app_config
+from fabfile import scheduler
+from fabfile.scheduler import Job, Scheduler
+
+class FakeClock(object):
+    """
+    Stands in for time.time, jobs advance it by their duration.
+    """
+    def __init__(self, now=1000):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def job(self, duration):
+        def func():
+            self.now += duration
+        return func
+
+class JobTestCase(unittest.TestCase):
+    """
+    Test the cadence and the adaptive interval of scheduled jobs.
+    """
+    def setUp(self):
+        self.saved = scheduler.time
+        scheduler.time = self.clock = FakeClock()
+
+    def tearDown(self):
+        scheduler.time = self.saved
+
+    def test_keeps_cadence_from_start(self):
+        job = Job('test', 10, self.clock.job(3))
+        job.run()
+
+        assert job.next_run == 1010
+        assert job.last_duration == 3
+        assert not job.is_due(1009)
+        assert job.is_due(1010)
+
+    def test_overrun_leaves_slack(self):
+        job = Job('test', 10, self.clock.job(15))
+        job.run()
+
+        assert job.next_run == 1015 + app_config.DAEMON_MIN_SLACK
+
+    def test_failed_run_is_rescheduled(self):
+        def fail():
+            raise IOError('Drive is down')
+        job = Job('test', 10, fail)
+
+        self.assertRaises(IOError, job.run)
+        assert job.runs == 1
+        assert job.next_run == 1010
+
+    def test_adapt_backs_off_to_max(self):
+        job = Job('test', 10, None, min_interval=5, max_interval=30,
+                  backoff=2)
+        job.adapt(False)
+        assert job.interval == 20
+        job.adapt(False)
+        assert job.interval == 30
+
+        job.adapt(True)
+        assert job.interval == 5
+
+    def test_adapt_respects_floor(self):
+        job = Job('test', 10, None, min_interval=5, max_interval=30,
+                  backoff=2)
+        job.adapt(True, floor=8)
+
+        assert job.interval == 8
+
+class SchedulerTestCase(unittest.TestCase):
+    """
+    Test running the due jobs.
+    """
+    def setUp(self):
+        self.saved = scheduler.time
+        scheduler.time = self.clock = FakeClock()
+        self.scheduler = Scheduler()
+
+    def tearDown(self):
+        scheduler.time = self.saved
+
+    def test_runs_due_jobs_in_order(self):
+        ran = []
+        self.scheduler.add('first', 10, lambda: ran.append('first'))
+        self.scheduler.add('second', 20, lambda: ran.append('second'))
+        self.scheduler.run_pending()
+        self.clock.now += 10
+        self.scheduler.run_pending()
+
+        assert ran == ['first', 'second', 'first']
+        assert self.scheduler.idle_time() == 10
+
+    def test_failing_job_does_not_stop_others(self):
+        def fail():
+            raise IOError('Drive is down')
+        ran = []
+        failing = self.scheduler.add('copy', 10, fail)
+        self.scheduler.add('liveblog', 10, lambda: ran.append('liveblog'))
+        self.scheduler.run_pending()
+
+        assert ran == ['liveblog']
+        assert failing.failures == 1
+        assert failing.next_run == 1010
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# _*_ coding:utf-8 _*_
+
+import unittest
+from datetime import datetime, timedelta
+
+import app_config
+import cache
+import http_client
+import shortcode
+from circuit import CircuitBreaker, NegativeCache
+from fabfile.fakes import (FakeHTTP, FakeHTTPResponse, FakeMongoClient,
+                           FakeServices)
+
+class BrokenOEmbedResponse(FakeHTTPResponse):
+    def json(self):
+        raise ValueError('No JSON object could be decoded')
+
+class BrokenOEmbedHTTP(FakeHTTP):
+    """
+    Answers oEmbed requests with `response`.
+    """
+    def __init__(self, response):
+        super(BrokenOEmbedHTTP, self).__init__()
+        self.response = response
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        self.requests.append((url, params))
+        return self.response
+
+class TweetContextTestCase(unittest.TestCase):
+    """
+    Test the stale-while-revalidate tweet layouts.
+    """
+    def setUp(self):
+        self.services = FakeServices().start()
+        self.http = self.services.http
+        shortcode.take_resolved()
+
+    def tearDown(self):
+        shortcode.tweet_refresher.join()
+        self.services.stop()
+
+    def test_fetches_unknown_tweet(self):
+        assert shortcode._get_tweet_context('1') == {'layout': 'image'}
+        assert len(self.http.requests) == 1
+
+    def test_fresh_tweet_is_not_fetched(self):
+        cache._cache.set('tweets', '1', {'layout': 'text',
+                                         'fetched': datetime.utcnow()})
+
+        assert shortcode._get_tweet_context('1') == {'layout': 'text'}
+        shortcode.tweet_refresher.join()
+        assert self.http.requests == []
+
+    def test_stale_tweet_is_revalidated(self):
+        fetched = datetime.utcnow() - timedelta(days=1)
+        cache._cache.set('tweets', '1', {'layout': 'text',
+                                         'fetched': fetched})
+
+        assert shortcode._get_tweet_context('1') == {'layout': 'text'}
+        shortcode.tweet_refresher.join()
+        assert len(self.http.requests) == 1
+        assert cache._cache.get('tweets', '1')['layout'] == 'image'
+        # The new layout is rendered by the next build
+        assert shortcode.take_resolved() == 1
+
+class ImageContextTestCase(unittest.TestCase):
+    """
+    Test the image metadata cache.
+    """
+    def setUp(self):
+        self.http = FakeHTTP(image_size=(400, 300))
+        self.services = FakeServices(http=self.http).start()
+        shortcode.take_resolved()
+
+    def tearDown(self):
+        shortcode.image_refresher.join()
+        self.services.stop()
+
+    def test_fetches_unknown_image(self):
+        context = shortcode._get_image_context('a.jpg')
+
+        assert context['ratio'] == 75.0
+        metadata = cache._cache.get('images', 'a.jpg')
+        assert (metadata['width'], metadata['height']) == (400, 300)
+        assert metadata['format'] == 'JPEG'
+        assert metadata['etag'] == self.http.etag
+
+    def test_unchanged_image_is_revalidated(self):
+        metadata = shortcode.get_image_metadata(self.http.image,
+                                                self.http.etag)
+        metadata['checked'] = None
+        cache._cache.set('images', 'a.jpg', metadata)
+
+        assert shortcode._get_image_context('a.jpg')['ratio'] == 75.0
+        shortcode.image_refresher.join()
+        assert len(self.http.requests) == 1
+        revalidated = cache._cache.get('images', 'a.jpg')
+        assert revalidated['checked'] is not None
+        assert revalidated['bytes'] == len(self.http.image)
+        assert not shortcode.has_resolved()
+
+    def test_changed_image_triggers_rebuild(self):
+        square = FakeHTTP(image_size=(300, 300))
+        metadata = shortcode.get_image_metadata(square.image, square.etag)
+        metadata['checked'] = None
+        cache._cache.set('images', 'a.jpg', metadata)
+
+        assert shortcode._get_image_context('a.jpg')['ratio'] == 100.0
+        shortcode.image_refresher.join()
+        assert cache._cache.get('images', 'a.jpg')['ratio'] == 0.75
+        assert shortcode.take_resolved() == 1
+
+    def test_seeded_image_is_downloaded_once(self):
+        # Seeded from a local copy, without the ETag of the remote one
+        metadata = shortcode.get_image_metadata(self.http.image)
+        metadata['checked'] = None
+        cache._cache.set('images', 'a.jpg', metadata)
+
+        assert shortcode._get_image_context('a.jpg')['ratio'] == 75.0
+        shortcode.image_refresher.join()
+        revalidated = cache._cache.get('images', 'a.jpg')
+        assert revalidated['etag'] == self.http.etag
+        assert revalidated['md5'] == metadata['md5']
+
+class FetchFailureTestCase(unittest.TestCase):
+    """
+    Test the placeholders rendered when lookups fail.
+    """
+    def setUp(self):
+        self.services = FakeServices().start()
+        self.saved = shortcode.negative_cache, shortcode.breaker
+        shortcode.negative_cache = NegativeCache(ttl=60)
+        shortcode.breaker = CircuitBreaker(threshold=2, reset_after=60)
+
+    def tearDown(self):
+        self.services.stop()
+        shortcode.negative_cache, shortcode.breaker = self.saved
+
+    def test_missing_image_is_cached_negatively(self):
+        http_client._client = http = FakeHTTP(status_code=404)
+
+        context = shortcode._get_extra_context('a.jpg', 'image')
+        assert context['unavailable']
+        shortcode._get_extra_context('a.jpg', 'image')
+        assert len(http.requests) == 1
+        assert not shortcode.breaker.is_open('media.npr.org')
+
+    def test_failing_host_opens_circuit(self):
+        http_client._client = http = FakeHTTP(status_code=503)
+
+        for id in ['1', '2', '3']:
+            context = shortcode._get_extra_context(id, 'tweet')
+            assert context == {'layout': 'text', 'unavailable': True}
+        assert len(http.requests) == 2
+        assert shortcode.breaker.is_open('api.twitter.com')
+
+    def test_malformed_oembed_renders_placeholder(self):
+        for response in [FakeHTTPResponse(json_data={'error': 'gone'}),
+                         BrokenOEmbedResponse()]:
+            http_client._client = http = BrokenOEmbedHTTP(response)
+            shortcode.negative_cache = NegativeCache(ttl=60)
+
+            for i in range(2):
+                context = shortcode._get_extra_context('1', 'tweet')
+                assert context == {'layout': 'text', 'unavailable': True}
+            assert len(http.requests) == 1
+
+class AsyncResolutionTestCase(unittest.TestCase):
+    """
+    Test the placeholders of shortcodes resolved in the background.
+    """
+    def setUp(self):
+        self.services = FakeServices(http=FakeHTTP(image_size=(400, 300)),
+                                     resolve_async=True).start()
+        shortcode.take_resolved()
+
+    def tearDown(self):
+        self.services.stop()
+
+    def test_placeholder_until_resolved(self):
+        context = shortcode._get_extra_context('a.jpg', 'image')
+        assert context['ratio'] == app_config.IMAGE_PLACEHOLDER_RATIO
+        assert context['unavailable']
+
+        shortcode.image_refresher.join()
+        assert shortcode.has_resolved()
+        assert shortcode.take_resolved() == 1
+        assert not shortcode.has_resolved()
+        context = shortcode._get_extra_context('a.jpg', 'image')
+        assert context['ratio'] == 75.0
+        assert 'unavailable' not in context
+
+class ResolveContextsTestCase(unittest.TestCase):
+    """
+    Test the batched resolution of the shortcodes of a document.
+    """
+    def setUp(self):
+        self.database = FakeMongoClient()['liveblog']
+        self.http = FakeHTTP(image_size=(400, 300))
+        self.services = FakeServices(cache.MongoCache(self.database),
+                                     self.http).start()
+
+    def tearDown(self):
+        self.services.stop()
+
+    def test_scan_shortcodes(self):
+        text = (u'[% image a.jpg caption="A" %] and [% tweet '
+                u'https://twitter.com/npr/status/1 %] [% npr_video '
+                u'story_id="1" %]')
+
+        assert shortcode.scan_shortcodes(text) == [('image', 'a.jpg'),
+                                                   ('tweet', '1')]
+
+    def test_scan_quoted_ids(self):
+        text = (u'[% image "a b.jpg" credit=\'X\' %][% graphic '
+                u'caption="A" c.png %]')
+
+        assert shortcode.scan_shortcodes(text) == [('image', 'a b.jpg'),
+                                                   ('graphic', 'c.png')]
+
+    def test_renders_without_lookups(self):
+        cache._cache.set('images', 'a.jpg', {'ratio': 0.5,
+                                             'checked': datetime.utcnow()})
+        contexts = shortcode.resolve_contexts([('image', 'a.jpg'),
+                                               ('graphic', 'a.jpg'),
+                                               ('tweet', '1')])
+
+        assert contexts[('images', 'a.jpg')]['ratio'] == 50.0
+        assert contexts[('tweets', '1')] == {'layout': 'image'}
+        assert len(self.http.requests) == 1
+        self.database['images'].drop()
+        self.database['tweets'].drop()
+        output = shortcode.process_shortcode_text(
+            u'[% image a.jpg %][% tweet https://twitter.com/npr/status/1 %]',
+            contexts)
+        assert 'padding-bottom: 50.0%' in output
+        assert 'embed-tweet image' in output
+        assert self.database['images'].queries == 0
+
+class RenderCacheTestCase(unittest.TestCase):
+    """
+    Test the memoized shortcode rendering.
+    """
+    def setUp(self):
+        self.render_cache = shortcode.RenderCache(shortcode.templates, size=1)
+
+    def test_renders_once(self):
+        context = {'url': 'post-1', 'id': 'post-1', 'link_text': 'Earlier'}
+        output = self.render_cache.render('internal_link', context)
+
+        assert output == '<a class="internal-link" href="#post-1">Earlier</a>'
+        assert self.render_cache.render('internal_link', dict(context)) == output
+        assert self.render_cache.stats == {'hits': 1, 'misses': 1}
+
+    def test_evicts_least_recently_used(self):
+        self.render_cache.render('internal_link', {'id': 'post-1'})
+        self.render_cache.render('internal_link', {'id': 'post-2'})
+        self.render_cache.render('internal_link', {'id': 'post-1'})
+
+        assert self.render_cache.stats['evictions'] == 2
+        assert self.render_cache.stats['misses'] == 3
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+import app_config
+from fabfile import text
+from fabfile.fakes import FakeDrive
+
+class GetLiveblogTestCase(unittest.TestCase):
+    """
+    Test the conditional download of the liveblog doc.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved = (app_config.authomatic,
+                      app_config.LIVEBLOG_GDOC_KEY,
+                      app_config.LIVEBLOG_HTML_PATH)
+        self.drive = FakeDrive()
+        self.drive.put('doc', '<html><body>first</body></html>')
+        app_config.authomatic = self.drive
+        app_config.LIVEBLOG_GDOC_KEY = 'doc'
+        app_config.LIVEBLOG_HTML_PATH = os.path.join(self.tmpdir, 'liveblog.html')
+        text.LIVEBLOG_REVISION = None
+
+    def tearDown(self):
+        (app_config.authomatic,
+         app_config.LIVEBLOG_GDOC_KEY,
+         app_config.LIVEBLOG_HTML_PATH) = self.saved
+        text.LIVEBLOG_REVISION = None
+        shutil.rmtree(self.tmpdir)
+
+    def test_skips_export_when_unchanged(self):
+        assert text.get_liveblog() == True
+        assert text.get_liveblog() == False
+        assert text.get_liveblog() == False
+
+        assert len(self.drive.exports) == 1
+
+    def test_exports_after_edit(self):
+        text.get_liveblog()
+        self.drive.put('doc', '<html><body>second</body></html>')
+
+        assert text.get_liveblog() == True
+
+        with open(app_config.LIVEBLOG_HTML_PATH) as f:
+            assert 'second' in f.read()
+
+    def test_force(self):
+        text.get_liveblog()
+
+        assert text.get_liveblog(force='true') == True
+        assert len(self.drive.exports) == 2
+
+    def test_drive_requests_time_out(self):
+        timeouts = []
+        access = self.drive.access
+        def timed_access(credentials, url, **kwargs):
+            timeouts.append(socket.getdefaulttimeout())
+            return access(credentials, url, **kwargs)
+        self.drive.access = timed_access
+        saved = socket.getdefaulttimeout()
+        text.get_liveblog()
+
+        assert timeouts == [app_config.DRIVE_TIMEOUT] * 2
+        assert socket.getdefaulttimeout() == saved
+
+if __name__ == '__main__':
+    unittest.main()